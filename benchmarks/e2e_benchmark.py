@@ -0,0 +1,269 @@
+"""Hermetic end-to-end benchmark: ingest a synthetic drive through /connect, then load /query.
+
+Usage:
+    python -m benchmarks.e2e_benchmark [--files 200] [--users 8] [--queries-per-user 10]
+        [--output results.json] [--compare previous.json]
+
+Google Drive, LlamaParse, the OpenAI embeddings, Gemini and Supabase are
+replaced by the stand-ins in benchmarks/fakes.py, each with a configurable
+latency, so no credential or network access is needed. Everything else (the
+FastAPI app, ingestion pipeline, caches, local vector store and query
+workflow) is the real code. The run happens in a fresh temporary directory,
+so caches and stores start empty.
+
+Reports ingest files/sec and chunks/sec, query p50/p95/p99 latency and
+throughput under N concurrent users, and peak RSS. Results are written as
+JSON (by default to benchmarks/results/) so runs can be compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import ClassVar
+
+import httpx
+from llama_index.core import Settings
+
+import connecter.connecter
+import main
+import rag.indexer
+import rag.parser
+import rag.scheduler
+from benchmarks.fakes import FakeDriveConnecter, FakeEmbedding, FakeLLM, FakeLlamaParse, LatencyVectorStore, SyntheticCorpus
+from rag.indexer import Indexer
+from rag.parser import Parser
+from rag.pipeline import IngestionPipeline
+from rag.retriever import RouterQueryWorkflow
+from rag.scheduler import Scheduler, ScheduledEmbedding, ScheduledLLM
+from rag.service import QueryService
+from rag.summarizer import Summarizer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def deep_merge(base, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            deep_merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+def install_fakes(args, corpus):
+    """Swap the external services for the fakes and point the config at the local backends."""
+    overrides = {
+        "vector_store": {"backend": "local", "local": {"dim": args.embedding_dim}},
+        "answer_cache": {"enabled": args.answer_cache},
+        # the fakes have no quota, but the calls still go through the scheduler's concurrency and priorities
+        "scheduler": {"providers": {
+            provider: {"rpm": None, "tpm": None} for provider in ("openai", "gemini", "llamaparse")
+        }},
+    }
+    for cls in (Indexer, Parser, QueryService, Summarizer, IngestionPipeline, RouterQueryWorkflow, Scheduler):
+        load = cls._load_configs
+        cls._load_configs = lambda self, load=load: deep_merge(load(self), overrides)
+
+    class ScheduledFakeLLM(ScheduledLLM, FakeLLM):
+        provider: ClassVar[str] = "gemini"
+
+    class ScheduledFakeEmbedding(ScheduledEmbedding, FakeEmbedding):
+        provider: ClassVar[str] = "openai"
+
+    llm = ScheduledFakeLLM(first_token_latency=args.llm_latency, token_latency=args.token_latency)
+    embed_model = ScheduledFakeEmbedding(dim=args.embedding_dim, latency=args.embed_latency)
+    Settings.llm = llm
+    Settings.embed_model = embed_model
+    # the service, summarizer and indexer import the client classes from the scheduler when they build them
+    rag.scheduler.ScheduledGemini = lambda **kwargs: llm
+    rag.scheduler.ScheduledOpenAIEmbedding = lambda **kwargs: ScheduledFakeEmbedding(
+        dim=args.embedding_dim, latency=args.embed_latency, embed_batch_size=kwargs["embed_batch_size"]
+    )
+    rag.indexer.LocalVectorStore = lambda **kwargs: LatencyVectorStore(latency=args.vector_latency, **kwargs)
+
+    class BenchmarkParser(Parser):
+        def _initialize_parser(self):
+            return FakeLlamaParse(corpus, latency_per_page=args.parse_latency)
+
+    # main imports these when a sync starts, so the module attributes are the ones to replace
+    rag.parser.Parser = BenchmarkParser
+    connecter.connecter.GoogleDriveConnecter = lambda **kwargs: FakeDriveConnecter(
+        corpus, latency=args.drive_latency, download_latency=args.download_latency, extensions=kwargs.get("extensions")
+    )
+
+
+def build_queries(corpus):
+    with open(os.path.join(os.path.dirname(__file__), "router_queries.json")) as f:
+        queries = [item["query"] for item in json.load(f)]
+    # exact-term lookups of codes that appear verbatim on a page
+    for i in range(0, corpus.num_files, max(1, corpus.num_files // 8)):
+        file_id = corpus.files[i]["id"]
+        queries.append(f"Which deck mentions PRJ-{file_id[-4:]}-{i % corpus.pages_per_file}?")
+    return queries
+
+
+async def run_ingest(client, poll_interval):
+    start = time.perf_counter()
+    response = await client.get("/connect", params={"full": True})
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        await asyncio.sleep(poll_interval)
+        status = (await client.get(f"/connect/{job_id}")).json()
+        if status["status"] not in ("queued", "running"):
+            break
+    elapsed = time.perf_counter() - start
+    if status["status"] != "succeeded":
+        raise RuntimeError(f"Ingestion failed: {status['error']}")
+    # the job finishes once the query service is refreshed, so the index is queryable from here
+    progress = status["progress"]
+    return {
+        "seconds": elapsed,
+        "files_indexed": progress["files_indexed"],
+        "chunks_indexed": progress["chunks_indexed"],
+        "files_per_second": progress["files_indexed"] / elapsed,
+        "chunks_per_second": progress["chunks_indexed"] / elapsed,
+        "progress": progress,
+    }
+
+
+async def run_queries(client, queries, users, queries_per_user):
+    latencies = []
+    errors = 0
+
+    async def user(index):
+        nonlocal errors
+        for i in range(queries_per_user):
+            query = queries[(index * queries_per_user + i) % len(queries)]
+            start = time.perf_counter()
+            response = await client.post("/query", json={"message": query})
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(index) for index in range(users)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "queries_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(args, corpus):
+    app = main.app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            ingest = await run_ingest(client, args.poll_interval)
+            ingest["peak_rss_mb"] = peak_rss_mb()
+            query = await run_queries(client, build_queries(corpus), args.users, args.queries_per_user)
+            query["peak_rss_mb"] = peak_rss_mb()
+    return {"ingest": ingest, "query": query}
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared to {previous_path} (commit {str(previous.get('commit'))[:8]}):")
+    for section in ("ingest", "query"):
+        for key, value in results[section].items():
+            before = previous.get(section, {}).get(key)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+                print(f"  {section}.{key:<20} {before:12.2f} -> {value:12.2f}  ({(value - before) / before:+.1%})")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus_group = parser.add_argument_group("corpus")
+    corpus_group.add_argument("--files", type=int, default=200)
+    corpus_group.add_argument("--pages", type=int, default=10, help="pages per file")
+    corpus_group.add_argument("--words-per-page", type=int, default=250)
+    corpus_group.add_argument("--visual-ratio", type=float, default=0.3, help="share of pages with an image")
+    corpus_group.add_argument("--duplicate-ratio", type=float, default=0.0, help="share of boilerplate pages repeated across files")
+    latency_group = parser.add_argument_group("synthetic latencies, in seconds")
+    latency_group.add_argument("--drive-latency", type=float, default=0.05, help="per Drive API call")
+    latency_group.add_argument("--download-latency", type=float, default=0.1, help="per file download")
+    latency_group.add_argument("--parse-latency", type=float, default=0.2, help="per page sent to LlamaParse")
+    latency_group.add_argument("--embed-latency", type=float, default=0.05, help="per embedding request")
+    latency_group.add_argument("--llm-latency", type=float, default=0.3, help="LLM time to first token")
+    latency_group.add_argument("--token-latency", type=float, default=0.005, help="LLM time per token")
+    latency_group.add_argument("--vector-latency", type=float, default=0.02, help="per vector store call")
+    load_group = parser.add_argument_group("query load")
+    load_group.add_argument("--users", type=int, default=8, help="concurrent users")
+    load_group.add_argument("--queries-per-user", type=int, default=10)
+    load_group.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache enabled")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/e2e_<commit>_<time>.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    return parser
+
+
+def main_cli():
+    args = build_arg_parser().parse_args()
+
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"e2e_{(commit or 'nogit')[:8]}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ))
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    corpus = SyntheticCorpus(args.files, args.pages, args.words_per_page, args.visual_ratio, args.seed, args.duplicate_ratio)
+    install_fakes(args, corpus)
+    # caches, manifest and vector stores are relative paths, a fresh directory makes the run hermetic
+    os.chdir(tempfile.mkdtemp(prefix="ctrlf-benchmark-"))
+
+    results = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": vars(args),
+        **asyncio.run(run(args, corpus)),
+    }
+
+    ingest, query = results["ingest"], results["query"]
+    print(f"\nIngest  {ingest['files_indexed']} files, {ingest['chunks_indexed']} chunks in {ingest['seconds']:.1f} s: "
+          f"{ingest['files_per_second']:.2f} files/s, {ingest['chunks_per_second']:.1f} chunks/s")
+    print(f"Query   {query['requests']} requests from {args.users} users, {query['errors']} errors: "
+          f"{query['queries_per_second']:.2f} q/s, p50 {query['p50_ms']:.0f} ms, "
+          f"p95 {query['p95_ms']:.0f} ms, p99 {query['p99_ms']:.0f} ms")
+    print(f"Peak RSS {query['peak_rss_mb']:.0f} MB")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if compare_path:
+        compare(results, compare_path)
+
+
+if __name__ == "__main__":
+    main_cli()
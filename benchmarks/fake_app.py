@@ -0,0 +1,18 @@
+"""The FastAPI app with the benchmark stand-ins installed, for serving with uvicorn workers.
+
+Every worker process imports this module, so each one installs the same
+fakes over the same synthetic corpus. Options are read from the
+CTRLF_BENCHMARK_ARGS environment variable, in e2e_benchmark's command line
+syntax, e.g. CTRLF_BENCHMARK_ARGS="--files 50 --llm-latency 0".
+"""
+import os
+import shlex
+
+from benchmarks.e2e_benchmark import build_arg_parser, install_fakes
+from benchmarks.fakes import SyntheticCorpus
+
+args = build_arg_parser().parse_args(shlex.split(os.environ.get("CTRLF_BENCHMARK_ARGS", "")))
+corpus = SyntheticCorpus(args.files, args.pages, args.words_per_page, args.visual_ratio, args.seed, args.duplicate_ratio)
+install_fakes(args, corpus)
+
+from main import app  # noqa: E402
@@ -0,0 +1,338 @@
+"""Local stand-ins for Google Drive, LlamaParse, OpenAI embeddings, Gemini and the vector store.
+
+Each fake has a configurable synthetic latency, so the benchmarks exercise the
+real pipeline, caches and query stack without credentials or network access.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.base.llms.types import (
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+from connecter.connecter import GoogleDriveConnecter
+from rag.vector_store import LocalVectorStore
+
+WORDS = (
+    "market growth revenue strategy client digital transformation cost margin supply chain retail "
+    "banking media pricing customer segment europe asia survey benchmark operations capital risk "
+    "regulation energy healthcare portfolio merger synergy forecast investment productivity talent"
+).split()
+FILE_ID_PREFIX = b"%ctrlf-file-id:"
+
+
+class SyntheticCorpus:
+    """Deterministic drive content: file records and the text of every page."""
+
+    def __init__(self, num_files=100, pages_per_file=10, words_per_page=250, visual_ratio=0.3, seed=0,
+                 duplicate_ratio=0.0, templates=5):
+        self.num_files = num_files
+        self.pages_per_file = pages_per_file
+        self.words_per_page = words_per_page
+        # share of pages holding an image, which the tiered parser escalates to LlamaParse
+        self.visual_ratio = visual_ratio
+        # share of boilerplate pages (disclaimers, methodology, team slides), copied from one of a few templates
+        self.duplicate_ratio = duplicate_ratio
+        self.templates = templates
+        self.seed = seed
+        self.files = [self._file_record(i) for i in range(num_files)]
+        self.folder_ids = sorted({parent for file in self.files for parent in file['parents']})
+
+    def _file_record(self, i):
+        file_id = f"file{i:06d}"
+        return {
+            'id': file_id,
+            'name': f"deck_{i:06d}.pdf",
+            'mimeType': 'application/pdf',
+            'parents': [f"folder{i % 10}"],
+            'size': str(self.pages_per_file * self.words_per_page * 8),
+            'md5Checksum': hashlib.md5(f"{self.seed}:{file_id}".encode()).hexdigest(),
+            'createdTime': '2024-01-01T00:00:00.000Z',
+            'modifiedTime': '2024-06-01T00:00:00.000Z',
+            'webViewLink': f"https://drive.example/{file_id}",
+            'lastModifyingUser': {'displayName': f"Expert {i % 7}", 'photoLink': ''},
+        }
+
+    def page_text(self, file_id, page_index):
+        rng = random.Random(f"{self.seed}:{file_id}:{page_index}")
+        words = [rng.choice(WORDS) for _ in range(self.words_per_page)]
+        if self.is_duplicate(file_id, page_index):
+            template = random.Random(f"{self.seed}:template:{rng.randrange(self.templates)}")
+            words = [template.choice(WORDS) for _ in range(self.words_per_page)]
+        # a verbatim code per page, the kind of exact term users search for
+        words.insert(rng.randrange(len(words)), f"PRJ-{file_id[-4:]}-{page_index}")
+        return " ".join(words)
+
+    def folder(self, folder_id):
+        return {'id': folder_id, 'name': f"Folder {folder_id[-1]}", 'parents': []}
+
+    def is_duplicate(self, file_id, page_index):
+        return random.Random(f"{self.seed}:{file_id}:{page_index}:duplicate").random() < self.duplicate_ratio
+
+    def is_visual(self, file_id, page_index):
+        return random.Random(f"{self.seed}:{file_id}:{page_index}:visual").random() < self.visual_ratio
+
+    def file_bytes(self, file):
+        """
+        A real PDF of the file's pages, with a text layer and an image on the visual pages
+
+        A comment after the header names the file, so the fake parser can find its pages.
+        """
+        objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+        objects.append(b"<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /ColorSpace /DeviceGray "
+                       b"/BitsPerComponent 8 /Length 1 >>\nstream\n\x00\nendstream")
+        kids = []
+        for page_index in range(self.pages_per_file):
+            text = self.page_text(file['id'], page_index).encode()
+            content = b"BT /F1 10 Tf 72 720 Td (" + text + b") Tj ET"
+            resources = b"/Font << /F1 3 0 R >>"
+            if self.is_visual(file['id'], page_index):
+                content += b" q 100 0 0 100 72 72 cm /Im1 Do Q"
+                resources += b" /XObject << /Im1 4 0 R >>"
+            objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+            objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                           b"/Resources << " % len(objects) + resources + b" >> >>")
+            kids.append(len(objects))
+        objects[1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids)
+                      + b"] /Count %d >>" % len(kids))
+
+        pdf = b"%PDF-1.4\n" + FILE_ID_PREFIX + file['id'].encode() + b"\n"
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(pdf))
+            pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(pdf)
+        pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF" % (len(objects) + 1, xref)
+        return pdf
+
+
+class _Request:
+    def __init__(self, result, latency):
+        self.result = result
+        self.latency = latency
+
+    def execute(self):
+        time.sleep(self.latency)
+        return self.result
+
+
+class _Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q=None, pageSize=100, pageToken=None, **kwargs):
+        corpus = self.drive.corpus
+        if q and 'application/vnd.google-apps.folder' in q:
+            items = [corpus.folder(folder_id) for folder_id in corpus.folder_ids]
+        else:
+            items = corpus.files
+        start = int(pageToken or 0)
+        result = {'files': [dict(item) for item in items[start:start + pageSize]]}
+        if start + pageSize < len(items):
+            result['nextPageToken'] = str(start + pageSize)
+        return _Request(result, self.drive.latency)
+
+    def get(self, fileId, **kwargs):
+        return _Request(self.drive.corpus.folder(fileId), self.drive.latency)
+
+
+class FakeDriveService:
+    """The slice of the Drive v3 API the connecter uses for listing and folder lookups."""
+
+    def __init__(self, corpus, latency=0.05):
+        self.corpus = corpus
+        self.latency = latency
+
+    def files(self):
+        return _Files(self)
+
+
+class FakeDriveConnecter(GoogleDriveConnecter):
+    """GoogleDriveConnecter over a FakeDriveService, with downloads served from the synthetic corpus.
+
+    Listing, path resolution, the download pool and the retry loop are the
+    real ones; only the API calls and the media transfer are replaced.
+    """
+
+    def __init__(self, corpus, latency=0.05, download_latency=0.1, extensions=None):
+        self.config = self._load_config()
+        self.extensions = self._extension_map(extensions)
+        self.fields = ",".join(self.config['drive_api']['fields'])
+        self._path_index = None
+        self._local = threading.local()
+        self.corpus = corpus
+        self.download_latency = download_latency
+        self.service = FakeDriveService(corpus, latency)
+
+    def _thread_service(self):
+        return self.service
+
+    def _file(self, file_id):
+        return next(file for file in self.corpus.files if file['id'] == file_id)
+
+    def get_file_content(self, file_id, mime_type, service=None):
+        time.sleep(self.download_latency)
+        return io.BytesIO(self.corpus.file_bytes(self._file(file_id)))
+
+    def spool_file_content(self, file, service=None):
+        time.sleep(self.download_latency)
+        fd, spool_path = tempfile.mkstemp(prefix='ctrlf-', suffix='.pdf')
+        with os.fdopen(fd, 'wb') as spool_file:
+            spool_file.write(self.corpus.file_bytes(file))
+        return spool_path
+
+
+class FakeLlamaParse:
+    """LlamaParse stand-in: returns the corpus pages of the file, honouring target_pages."""
+
+    def __init__(self, corpus, latency_per_page=0.2, target_pages=None):
+        self.corpus = corpus
+        self.latency_per_page = latency_per_page
+        self.target_pages = target_pages
+        self.pages_parsed = 0
+
+    def model_copy(self, update=None):
+        return FakeLlamaParse(self.corpus, self.latency_per_page, (update or {}).get('target_pages'))
+
+    async def aload_data(self, file_path):
+        with open(file_path, 'rb') as f:
+            f.readline()
+            file_id = f.readline()[len(FILE_ID_PREFIX):].strip().decode()
+        if self.target_pages:
+            pages = [int(page) for page in self.target_pages.split(",")]
+        else:
+            pages = range(self.corpus.pages_per_file)
+        await asyncio.sleep(self.latency_per_page * len(pages))
+        self.pages_parsed += len(pages)
+        return [Document(text=self.corpus.page_text(file_id, page)) for page in pages]
+
+    def load_data(self, file_path):
+        return asyncio.run(self.aload_data(file_path))
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Hashed bag-of-words embedding with a fixed latency per API call (one call per batch)."""
+
+    dim: int = 1536
+    latency: float = 0.05
+    _calls: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str):
+        time.sleep(self.latency)
+        self._calls += 1
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str):
+        await asyncio.sleep(self.latency)
+        self._calls += 1
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str):
+        return self._get_query_embedding(text)
+
+    def _get_text_embeddings(self, texts):
+        time.sleep(self.latency)
+        self._calls += 1
+        return [self._embed(text) for text in texts]
+
+
+class FakeLLM(CustomLLM):
+    """Gemini stand-in: fixed time to first token, then a steady token rate."""
+
+    first_token_latency: float = 0.3
+    token_latency: float = 0.005
+    num_tokens: int = 60
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm", context_window=1000000, num_output=1024)
+
+    def _text(self, prompt):
+        if "return the top choices" in prompt:
+            # router prompt: choose the chunk engine, in the JSON the structured predictor parses
+            return json.dumps({"answers": [{"choice": 2, "reason": "fake router"}]})
+        return " ".join(["answer"] * self.num_tokens)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self._text(prompt)
+        time.sleep(self.first_token_latency + self.token_latency * len(text.split()))
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        time.sleep(self.first_token_latency)
+        text = ""
+        for token in self._text(prompt).split(" "):
+            time.sleep(self.token_latency)
+            delta = token if not text else " " + token
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self._text(prompt)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * len(text.split()))
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        async def gen():
+            await asyncio.sleep(self.first_token_latency)
+            text = ""
+            for token in self._text(prompt).split(" "):
+                await asyncio.sleep(self.token_latency)
+                delta = token if not text else " " + token
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+        return gen()
+
+
+class LatencyVectorStore(LocalVectorStore):
+    """LocalVectorStore with a fixed round-trip latency, standing in for a remote Supabase collection."""
+
+    latency: float = 0.02
+
+    def add(self, nodes, **add_kwargs):
+        time.sleep(self.latency)
+        return super().add(nodes, **add_kwargs)
+
+    def delete_where(self, filters):
+        time.sleep(self.latency)
+        return super().delete_where(filters)
+
+    def query(self, query, **kwargs):
+        time.sleep(self.latency)
+        return super().query(query, **kwargs)
@@ -0,0 +1,103 @@
+"""Compare routing accuracy and latency of the local EmbeddingRouter against the LLM router.
+
+Usage:
+    python -m benchmarks.router_benchmark [--local-only] [--queries benchmarks/router_queries.json]
+
+The local router embeds with the configured embedding model and needs
+OPENAI_API_KEY; the LLM router needs GOOGLE_API_KEY (both loaded from .env),
+--local-only skips it. Local latencies include embedding the query.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from llama_index.core.llms import MockLLM
+from llama_index.core.response_synthesizers import TreeSummarize
+from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.llms.gemini import Gemini
+
+from rag.retriever import RouterQueryWorkflow
+from rag.service import QueryService
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(name, latencies, correct, total, fallbacks=None):
+    line = (
+        f"{name:<14} accuracy {correct / total:6.1%}  "
+        f"p50 {statistics.median(latencies) * 1000:8.2f} ms  "
+        f"p95 {percentile(latencies, 95) * 1000:8.2f} ms"
+    )
+    if fallbacks is not None:
+        line += f"  LLM fallbacks {fallbacks}/{total + fallbacks}"
+    print(line)
+
+
+async def run_llm_router(workflow, queries):
+    latencies, correct = [], 0
+    for item in queries:
+        start = time.perf_counter()
+        answers = await workflow._llm_route(item["query"])
+        latencies.append(time.perf_counter() - start)
+        correct += answers.answers[0].choice == item["choice"]
+    return latencies, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", default=os.path.join(os.path.dirname(__file__), "router_queries.json"))
+    parser.add_argument("--local-only", action="store_true", help="skip the LLM router")
+    args = parser.parse_args()
+    load_dotenv()
+
+    with open(args.queries) as f:
+        queries = json.load(f)
+
+    # Only the router parts of the service are needed, not the vector store
+    service = QueryService.__new__(QueryService)
+    service.config = service._load_configs()
+    llm = MockLLM() if args.local_only else Gemini(model=service.config["models"]["llm"])
+    workflow = RouterQueryWorkflow(query_engines=[], llm=llm, summarizer=TreeSummarize(llm=llm))
+    embed_model = OpenAIEmbedding(model=service.config["embedding"]["model"])
+    router = service._build_router(workflow.choice_descriptions, embed_fn=embed_model.get_text_embedding_batch)
+
+    # local router, cold: every query is classified, low-confidence ones count as fallbacks
+    latencies, correct, fallbacks = [], 0, 0
+    for item in queries:
+        start = time.perf_counter()
+        answers = router.route(item["query"])
+        latencies.append(time.perf_counter() - start)
+        if answers is None:
+            fallbacks += 1
+        else:
+            correct += answers.answers[0].choice == item["choice"]
+    # accuracy is measured on the queries the local router decided itself
+    decided = len(queries) - fallbacks
+    report("local", latencies, correct, decided or 1, fallbacks)
+
+    # local router, warm: repeated queries are served from the memo
+    for item in queries:
+        answers = router.route(item["query"])
+        if answers is not None:
+            router.remember(item["query"], answers)
+    latencies = []
+    for item in queries:
+        start = time.perf_counter()
+        router.lookup(item["query"])
+        latencies.append(time.perf_counter() - start)
+    report("local (memo)", latencies, correct, decided or 1)
+
+    if not args.local_only:
+        latencies, correct = asyncio.run(run_llm_router(workflow, queries))
+        report("llm", latencies, correct, len(queries))
+
+
+if __name__ == "__main__":
+    main()
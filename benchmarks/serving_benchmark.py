@@ -0,0 +1,204 @@
+"""Cold start and multi-worker query throughput of the API, served by uvicorn.
+
+Usage:
+    python -m benchmarks.serving_benchmark [--workers 1,2,4] [--users 32] [--queries-per-user 10]
+        [--fakes "--files 50 --llm-latency 0"] [--output results.json]
+
+Cold start is measured twice: the time to import main in a fresh interpreter
+(with the slowest imports, from python -X importtime), and the time from
+launching uvicorn to the first answered request.
+
+For each worker count, uvicorn serves benchmarks/fake_app.py (the real app
+over the stand-ins of benchmarks/fakes.py) from a fresh directory. A sync is
+started through /connect and polled until done, with every request free to
+land on any worker, then the benchmark waits for all workers to load the new
+index version before loading /query with concurrent users.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.e2e_benchmark import REPO_ROOT, build_arg_parser, build_queries, git_commit, percentile
+from benchmarks.fakes import SyntheticCorpus
+
+
+def import_time(runs):
+    """Median wall time of importing main in a fresh interpreter, and the slowest imports of the last run."""
+    baseline, totals = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        baseline.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        )
+        totals.append(time.perf_counter() - start)
+    # "import time: self [us] | cumulative | imported package", top level imports of main are indented by 3 spaces
+    slowest = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|    ?(\S+)$", line)
+        if match:
+            slowest.append((match.group(2), int(match.group(1)) / 1e6))
+    slowest.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "import_seconds": statistics.median(totals) - statistics.median(baseline),
+        "slowest_imports": dict(slowest[:10]),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch(workers, fakes, port, directory):
+    env = dict(os.environ, CTRLF_BENCHMARK_ARGS=fakes, PYTHONPATH=REPO_ROOT)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.fake_app:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client, process, timeout=300):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.05)
+    raise TimeoutError("uvicorn did not start")
+
+
+def index_version(directory):
+    try:
+        with open(os.path.join(directory, ".cache", "state", "index_version.json")) as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        return 0
+
+
+async def run_ingest(client, poll_interval):
+    start = time.perf_counter()
+    job_id = (await client.get("/connect", params={"full": True})).json()["job_id"]
+    while True:
+        await asyncio.sleep(poll_interval)
+        response = await client.get(f"/connect/{job_id}")
+        # any worker answers, the job record is read from the shared state
+        response.raise_for_status()
+        status = response.json()
+        if status["status"] not in ("queued", "running"):
+            break
+    if status["status"] != "succeeded":
+        raise RuntimeError(f"Ingestion failed: {status['error']}")
+    return {"seconds": time.perf_counter() - start, "chunks_indexed": status["progress"]["chunks_indexed"]}
+
+
+async def run_queries(client, queries, users, queries_per_user, latest_version):
+    latencies = []
+    errors = 0
+    on_latest_version = 0
+
+    async def user(index):
+        nonlocal errors, on_latest_version
+        for i in range(queries_per_user):
+            query = queries[(index * queries_per_user + i) % len(queries)]
+            start = time.perf_counter()
+            response = await client.post("/query", json={"message": query})
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+            on_latest_version += response.headers.get("X-Index-Version") == str(latest_version)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(index) for index in range(users)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        # answers from a worker still on an older index version
+        "stale_answers": len(latencies) - on_latest_version,
+        "queries_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+async def run_workers(workers, args, queries):
+    directory = tempfile.mkdtemp(prefix="ctrlf-serving-")
+    port = free_port()
+    process = launch(workers, args.fakes, port, directory)
+    try:
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            ready = await wait_ready(client, process)
+            ingest = await run_ingest(client, args.poll_interval)
+            # the other workers load the new index version on their next poll, leave them two
+            await asyncio.sleep(2 * args.state_poll_seconds)
+            query = await run_queries(client, queries, args.users, args.queries_per_user, index_version(directory))
+    finally:
+        process.terminate()
+        process.wait()
+    return {"workers": workers, "ready_seconds": ready, "ingest": ingest, "query": query}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=f"1,{os.cpu_count()}", help="comma separated worker counts")
+    parser.add_argument("--users", type=int, default=32, help="concurrent users")
+    parser.add_argument("--queries-per-user", type=int, default=10)
+    parser.add_argument("--fakes", default="--files 50 --llm-latency 0 --token-latency 0 --embed-latency 0 --vector-latency 0",
+                        help="options of the stand-ins, in e2e_benchmark's syntax")
+    parser.add_argument("--import-runs", type=int, default=3)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--state-poll-seconds", type=float, default=2, help="serving.poll_seconds of the config")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/serving_<commit>_<time>.json")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"serving_{(commit or 'nogit')[:8]}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ))
+    fake_args = build_arg_parser().parse_args(shlex.split(args.fakes))
+    queries = build_queries(SyntheticCorpus(fake_args.files, fake_args.pages, fake_args.words_per_page,
+                                            fake_args.visual_ratio, fake_args.seed))
+
+    cold_start = import_time(args.import_runs)
+    print(f"Import main  {cold_start['import_seconds']:.2f} s, slowest: "
+          + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in cold_start["slowest_imports"].items()))
+    runs = []
+    for workers in (int(count) for count in args.workers.split(",")):
+        run = asyncio.run(run_workers(workers, args, queries))
+        query = run["query"]
+        print(f"{workers:>2} workers  ready in {run['ready_seconds']:.1f} s, {query['queries_per_second']:.1f} q/s, "
+              f"p50 {query['p50_ms']:.0f} ms, p95 {query['p95_ms']:.0f} ms, {query['errors']} errors, "
+              f"{query['stale_answers']} answers from a stale index")
+        runs.append(run)
+
+    results = {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "params": vars(args),
+               "cold_start": cold_start, "runs": runs}
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,7 +1,18 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
-import os, json, io
+from googleapiclient.errors import HttpError
+from connecter.folder_index import FolderPathIndex
+from rag.concurrency import iter_completed
+from rag.metrics import span, BYTES_DOWNLOADED
+from concurrent.futures import ThreadPoolExecutor
+import http.client, httplib2, ssl
+import os, json, io, random, tempfile, threading, time
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# dropped connections, timeouts and TLS failures are as transient as a 503
+RETRYABLE_ERRORS = (ConnectionError, TimeoutError, ssl.SSLError, http.client.HTTPException, httplib2.HttpLib2Error)
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
 
 
 class GoogleDriveConnecter:
@@ -16,6 +27,8 @@ class GoogleDriveConnecter:
         self.config = self._load_config()
         self.extensions = self._extension_map(extensions)
         self.fields = ",".join(self.config['drive_api']['fields']) 
+        self._path_index = None
+        self._local = threading.local()
 
     def _load_config(self):
         config_path = os.path.join(os.path.dirname(__file__), 'config.json')
@@ -28,19 +41,47 @@ class GoogleDriveConnecter:
         extension_map = self.config["drive_api"]["extension"]
         return [extension_map[ext] for ext in extensions if ext in extension_map]
 
-    def list_files(self):
+    def iter_files(self, page_size=None):
+        """
+        Stream file records from Google Drive, following every result page
+
+        Args:
+            page_size (int): Number of files requested per page, defaults to the configured page_size
+
+        Yields:
+            File records as soon as the page containing them has been received
+        """
         query = None
         if self.extensions:
             query = " or ".join(f"mimeType='{mime}'" for mime in self.extensions)
-            
+        yield from self._iter_listing(query, self.fields, page_size)
+
+    def iter_folders(self, page_size=None):
+        """Stream the id, name and parents of every folder visible to the service account."""
+        yield from self._iter_listing(f"mimeType='{FOLDER_MIME_TYPE}'", "id, name, parents", page_size)
+
+    def _iter_listing(self, query, fields, page_size=None):
+        page_size = page_size or self.config['drive_api']['page_size']
+        page_token = None
+        while True:
+            with span("list"):
+                results = self.service.files().list(
+                    q=query,
+                    pageSize=page_size,
+                    pageToken=page_token,
+                    fields=f"nextPageToken, files({fields})",
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True
+                ).execute()
+            yield from results.get('files', [])
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+    def list_files(self, page_size=None):
         try:
-            results = self.service.files().list(
-                q=query,
-                fields=f"files({self.fields})",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            return results.get('files', [])
+            return list(self.iter_files(page_size))
         
         except Exception as e:
             print(f"Error listing files: {e}")
@@ -49,27 +90,32 @@ class GoogleDriveConnecter:
     def fetch_file_data(self, files, file):
         return {
             'content':self.get_file_content(file['id'],file['mimeType']),
-            'metadata':{
-                'file_id':file['id'],
-                'file_type':file['mimeType'],
-                'file_name':file['name'],
-                'file_path':self.get_file_path(files, file['id']),
-                'file_size':file['size'],
-                'creation_date':file['createdTime'],
-                'last_modified_date':file['modifiedTime'],
-                'experts':self.get_experts(file),
-                'url' : file['webViewLink']
-            }
+            'metadata':self.get_file_metadata(files, file)
         }
 
-    def get_file_content(self, file_id, mime_type):
+    def get_file_metadata(self, files, file):
+        return {
+            'file_id':file['id'],
+            'file_type':file['mimeType'],
+            'file_name':file['name'],
+            'file_path':self.get_file_path(files, file['id']),
+            'file_size':file.get('size'),
+            'creation_date':file['createdTime'],
+            'last_modified_date':file['modifiedTime'],
+            'experts':self.get_experts(file),
+            'url' : file['webViewLink']
+        }
+
+    def _get_media_request(self, file_id, mime_type, service):
         # Check if it's a Google native format
         if mime_type.startswith('application/vnd.google-apps.'):
             # Export the file instead of direct download
-            request = self.service.files().export(fileId=file_id, mimeType='application/pdf')
-        else:
-            # Regular file, use standard get_media
-            request = self.service.files().get_media(fileId=file_id)
+            return service.files().export(fileId=file_id, mimeType='application/pdf')
+        # Regular file, use standard get_media
+        return service.files().get_media(fileId=file_id)
+
+    def get_file_content(self, file_id, mime_type, service=None):
+        request = self._get_media_request(file_id, mime_type, service or self.service)
         
         file_content = io.BytesIO()
         downloader = MediaIoBaseDownload(file_content, request)
@@ -80,6 +126,100 @@ class GoogleDriveConnecter:
             
         file_content.seek(0)
         return file_content
+
+    def spool_file_content(self, file, service=None):
+        """
+        Download a file chunk by chunk straight into a temporary file on disk
+
+        Only one chunk (download.chunk_size bytes) is held in memory at a time,
+        whatever the size of the file. The caller owns the returned file and is
+        responsible for removing it.
+
+        Returns:
+            Path of the spooled file, with the extension the parser expects
+        """
+        request = self._get_media_request(file['id'], file['mimeType'], service or self.service)
+        if file['mimeType'].startswith('application/vnd.google-apps.'):
+            suffix = '.pdf'
+        else:
+            suffix = os.path.splitext(file['name'])[1]
+
+        fd, spool_path = tempfile.mkstemp(prefix='ctrlf-', suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as spool_file:
+                downloader = MediaIoBaseDownload(spool_file, request, chunksize=self.config['download']['chunk_size'])
+                done = False
+                while not done:
+                    _, done = downloader.next_chunk()
+        except BaseException:
+            os.remove(spool_path)
+            raise
+        return spool_path
+
+    def _thread_service(self):
+        # googleapiclient services wrap a non thread-safe httplib2 connection, so each worker gets its own
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = build('drive', 'v3', credentials=self.creds, cache_discovery=False)
+            self._local.service = service
+        return service
+
+    def _download_with_retry(self, file):
+        download_config = self.config['download']
+        for attempt in range(download_config['max_retries'] + 1):
+            try:
+                with span("download"):
+                    if self.config['download']['spool']:
+                        result = {'path': self.spool_file_content(file, service=self._thread_service())}
+                        BYTES_DOWNLOADED.inc(os.path.getsize(result['path']))
+                    else:
+                        result = {'content': self.get_file_content(file['id'], file['mimeType'], service=self._thread_service())}
+                        BYTES_DOWNLOADED.inc(result['content'].getbuffer().nbytes)
+                return result
+            except (HttpError, *RETRYABLE_ERRORS) as e:
+                retryable = e.resp.status in RETRYABLE_STATUSES if isinstance(e, HttpError) else True
+                if not retryable or attempt == download_config['max_retries']:
+                    raise
+                reason = e.resp.status if isinstance(e, HttpError) else repr(e)
+                delay = download_config['backoff_base'] * (2 ** attempt) + random.uniform(0, 1)
+                print(f"Download of {file['name']} failed with {reason}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def download_files(self, files, path_index=None, max_workers=None, on_error=None):
+        """
+        Download files concurrently on a bounded thread pool
+
+        Args:
+            files (iterable): File records, e.g. a list or the iter_files generator
+            path_index (FolderPathIndex): Index used to resolve file paths, built from the files if not given
+            max_workers (int): Number of concurrent downloads, defaults to the configured max_workers
+            on_error (callable): Called with the metadata and the exception of each file whose
+                download failed after its retries, such files are skipped
+
+        Yields:
+            File data dicts in completion order, holding 'metadata' and either the spooled
+            file 'path' or, when download.spool is disabled, an in-memory 'content' BytesIO
+        """
+        max_workers = max_workers or self.config['download']['max_workers']
+        if path_index is None:
+            path_index = self.build_path_index(files if isinstance(files, list) else None)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            def submit(file):
+                path_index.add(file)
+                # Path resolution may call the Drive API, so it stays on the calling thread
+                metadata = self.get_file_metadata(path_index, file)
+                return executor.submit(self._download_with_retry, file), metadata
+
+            # A bounded number of downloads stays in flight so a streamed listing is consumed lazily,
+            # and each one is yielded as soon as it is done, while the listing waits for its next page
+            for metadata, future in iter_completed(files, submit, 2 * max_workers):
+                try:
+                    yield {**future.result(), 'metadata': metadata}
+                except Exception as e:
+                    print(f"Error downloading file '{metadata['file_name']}': {e}")
+                    if on_error:
+                        on_error(metadata, e)
     
     def get_experts(self, file):
         return [{
@@ -87,36 +227,35 @@ class GoogleDriveConnecter:
                 'image':file['lastModifyingUser']['photoLink']
             }]
     
-    def get_file_path(self, files, file_id, current_path=None):
-        if current_path is None:
-            current_path = []
-        
-        # Search for the file in the current level
-        for file in files:
-            if file['id'] == file_id:
-                # Found the file, return its path
-                path_elements = current_path + [file['name']]
-                return '/'.join(path_elements)
-            
-            # If this is a folder, search inside it
-            if file['mimeType'] == 'application/vnd.google-apps.folder':
-                # Create a list of files that are children of this folder
-                folder_id = file['id']
-                folder_children = [f for f in files if 'parents' in f and folder_id in f['parents']]
-                
-                # Recursively search in this folder
-                nested_path = self.get_file_path(
-                    folder_children, 
-                    file_id, 
-                    current_path + [file['name']]
-                )
-                
-                if nested_path:
-                    return nested_path
-        
-        # File not found
-        return None
+    def build_path_index(self, files=None):
+        path_index = FolderPathIndex(files, lookup=self._get_folder)
+        # One paged listing of the folders instead of a files().get per parent folder
+        try:
+            for folder in self.iter_folders():
+                path_index.add(folder)
+        except Exception as e:
+            print(f"Warning: Could not list folders, resolving parent folders one by one: {e}")
+        return path_index
+
+    def _get_folder(self, folder_id):
+        try:
+            # Path resolution can run on a pipeline thread while listing runs on another
+            return self._thread_service().files().get(
+                fileId=folder_id,
+                fields="id, name, parents",
+                supportsAllDrives=True
+            ).execute()
+        except Exception as e:
+            print(f"Warning: Could not resolve parent folder {folder_id}: {e}")
+            return None
 
+    def get_file_path(self, files, file_id):
+        # Reuse the index built for this listing instead of rescanning it for every file
+        if not isinstance(files, FolderPathIndex):
+            if self._path_index is None or self._path_index.files is not files:
+                self._path_index = self.build_path_index(files)
+            files = self._path_index
+        return files.resolve(file_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+class FolderPathIndex:
+    """Parent/child index used to resolve Drive file paths in linear time.
+
+    The index is built once per listing. Each folder's path is resolved at most
+    once and memoized, so resolving the paths of every listed file costs O(n)
+    overall. The connecter adds every folder from one listing of the drive's
+    folders; a parent missing from it (created after that listing, or
+    shared without its folders) is fetched once through ``lookup`` and cached.
+    """
+
+    def __init__(self, files=None, lookup=None):
+        self.files = files
+        self.lookup = lookup
+        self.nodes = {}
+        self.folder_paths = {}
+        for file in files or []:
+            self.add(file)
+
+    def add(self, file):
+        self.nodes[file['id']] = (file['name'], file.get('parents') or [])
+
+    def _node(self, file_id):
+        if file_id not in self.nodes:
+            folder = self.lookup(file_id) if self.lookup else None
+            # An unreachable parent (no access, shared drive root...) ends the path
+            self.nodes[file_id] = (folder['name'], folder.get('parents') or []) if folder else None
+        return self.nodes[file_id]
+
+    def _folder_path(self, folder_id):
+        # Walk up until a memoized ancestor or a root, then fill the memo on the way back down
+        chain = []
+        current = folder_id
+        while current is not None and current not in self.folder_paths:
+            node = self._node(current)
+            if node is None or current in chain:
+                self.folder_paths[current] = []
+                break
+            chain.append(current)
+            _, parents = node
+            current = parents[0] if parents else None
+
+        path = self.folder_paths.get(current, []) if current is not None else []
+        for ancestor_id in reversed(chain):
+            path = path + [self.nodes[ancestor_id][0]]
+            self.folder_paths[ancestor_id] = path
+        return self.folder_paths[folder_id]
+
+    def resolve(self, file_id):
+        node = self.nodes.get(file_id)
+        if node is None:
+            return None
+        name, parents = node
+        folder_path = self._folder_path(parents[0]) if parents else []
+        return '/'.join(folder_path + [name])
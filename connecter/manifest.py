@@ -0,0 +1,75 @@
+import os, json
+
+
+class SyncManifest:
+    """Local record of what has already been ingested from Google Drive.
+
+    Maps each Drive ``file_id`` to the ``modifiedTime``, ``md5Checksum`` and
+    ``size`` it had when it was last indexed, so that a re-sync only has to
+    fetch, parse and index the files that are new or changed since then.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read sync manifest {self.manifest_path}, starting from scratch: {e}")
+            return {}
+
+    @staticmethod
+    def fingerprint(file):
+        # Google Workspace files have no md5Checksum/size, their modifiedTime changes on every edit
+        return {
+            'modifiedTime': file.get('modifiedTime'),
+            'md5Checksum': file.get('md5Checksum'),
+            'size': file.get('size'),
+        }
+
+    def __contains__(self, file_id):
+        return file_id in self.entries
+
+    def is_changed(self, file):
+        return self.entries.get(file['id']) != self.fingerprint(file)
+
+    def diff(self, files):
+        """
+        Compare a Drive listing against the manifest
+
+        Args:
+            files (list): A complete listing, e.g. ``list(GoogleDriveConnecter.iter_files())``.
+                ``list_files`` returns [] when listing fails, so an empty listing is not
+                trusted to report deletions.
+
+        Returns:
+            Tuple of (files that are new or changed, ids of files that were deleted)
+        """
+        changed = [file for file in files if self.is_changed(file)]
+        if not files and self.entries:
+            print("Warning: The Drive listing is empty, no file is considered deleted")
+            return changed, []
+        listed_ids = {file['id'] for file in files}
+        deleted = [file_id for file_id in self.entries if file_id not in listed_ids]
+        return changed, deleted
+
+    def update(self, file):
+        self.entries[file['id']] = self.fingerprint(file)
+
+    def remove(self, file_id):
+        self.entries.pop(file_id, None)
+
+    def save(self):
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated manifest
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.manifest_path)
@@ -1,22 +1,51 @@
-from connecter.connecter import GoogleDriveConnecter
-from rag.parser import Parser
-from rag.indexer import Indexer
-from llama_index.llms.gemini import Gemini
-from rag.retriever import RouterQueryWorkflow
-from llama_index.core.query_engine import RetrieverQueryEngine
-from fastapi import FastAPI, HTTPException
+from rag.jobs import JobManager
+from rag.service import QueryService
+from rag.metrics import start_trace, trace_summary
+from rag.scheduler import get_scheduler, set_priority, INTERACTIVE
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
 from pydantic import BaseModel
 import nest_asyncio
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import os
+import shutil
 
 # Apply nest_asyncio to allow nested async event loops
 nest_asyncio.apply()
 
 class Query(BaseModel):
     message: str
-counter = 0  
-print(counter)
-app = FastAPI(title="CtrlF API")
+
+
+async def watch_index_version(service):
+    # another worker may have re-indexed, rebuild on its version without restarting
+    while True:
+        await asyncio.sleep(service.config["serving"]["poll_seconds"])
+        try:
+            await asyncio.to_thread(service.sync_index_version)
+        except Exception as e:
+            print(f"Warning: Could not load the latest index version: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # build and warm up the query stack before serving the first request
+    service = await asyncio.to_thread(QueryService)
+    await asyncio.to_thread(service.warm_up)
+    app.state.service = service
+    app.state.jobs = JobManager(state=service.state, publish_interval=service.config["serving"]["job_publish_seconds"])
+    watcher = asyncio.create_task(watch_index_version(service))
+    yield
+    watcher.cancel()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+app = FastAPI(title="CtrlF API", lifespan=lifespan)
 
 # Add this near the top of your file after creating the FastAPI app
 app.add_middleware(
@@ -25,83 +54,140 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Trace-Id", "X-Index-Version"],
 )
 
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # every request gets a trace id, taken from the caller when it sends one, and the spans of its stages
+    trace_id = start_trace(request.headers.get("X-Trace-Id"))
+    # model calls made while serving a request go ahead of the ingestion running in the background
+    set_priority(INTERACTIVE)
+    response = await call_next(request)
+    response.headers["X-Trace-Id"] = trace_id
+    # with several workers, tells which index version answered
+    response.headers["X-Index-Version"] = str(app.state.service.index_version)
+    return response
+
 
-@app.get("/connect", status_code=200)
-async def connection_endpoint():
-    global counter
-    counter = 0
+
+def run_sync(job, full):
+    # the Drive, LlamaParse and ingestion modules are only loaded by the worker that syncs
+    from connecter.connecter import GoogleDriveConnecter
+    from connecter.manifest import SyncManifest
+    from rag.parser import Parser
+    from rag.summarizer import Summarizer
+    from rag.dedup import PageDeduplicator
+    from rag.pipeline import IngestionPipeline
+
+    # connect to Google Drive and stream files through the ingestion pipeline
+    connecter = GoogleDriveConnecter(service_account_file = 'connecter/service-account.json', extensions = ['pdf', 'pptx', 'docx','gdoc','gslides'])
+    manifest = SyncManifest(connecter.config['sync']['manifest_path'])
+    parser = Parser()
+    # share the query service's indexer, and its database pool, with the ingestion
+    service = app.state.service
+    indexer = service.indexer
+    summarizer = Summarizer(llm=service.llm) if service.config["summaries"]["enabled"] else None
+    deduplicator = PageDeduplicator() if service.config["dedup"]["enabled"] else None
+    changed_file_ids = set()
+
+    def on_change(file_ids):
+        changed_file_ids.update(file_ids)
+        service.invalidate_files(file_ids)
+
+    job.pipeline = IngestionPipeline(connecter, parser, indexer, manifest, on_change=on_change, summarizer=summarizer, deduplicator=deduplicator)
+
+    # only the delta since the last sync is fetched, unless a full re-ingest is requested
     try:
-        # connect to Google Drive and parse files
-        connecter = GoogleDriveConnecter(service_account_file = 'connecter/service-account.json', extensions = ['pdf', 'pptx', 'docx','gdoc','gslides'])
-        files = connecter.list_files()
-        parser = Parser()
-        global all_data
-        all_data = []
-        for file in files:
-            data = connecter.fetch_file_data(files, file)
-            file_chunks = parser.parse_bytes_io(data)
-            all_data.extend(file_chunks)
-        global index
-        indexer = Indexer()
-        index = indexer.index_document(all_data)
-        if not files:
-            return {"message": "No files found."}
-        else:
-            return {"message": "Successfully connected to Google Drive."}
+        progress = job.pipeline.run(full=full)
+    finally:
+        # files indexed before a failure are in the store too, the other workers must see them
+        if changed_file_ids:
+            service.publish_index(changed_file_ids)
+    print(f"Sync done: {progress}")
+    print(f"Parse cache: {parser.cache.stats()}")
+    print(f"Parsed pages: {parser.tier_stats}")
+    print(f"Embedding cache: {indexer.embedding_cache.stats()}")
+    if summarizer:
+        print(f"Summary cache: {summarizer.cache.stats()}, {summarizer.llm_calls} LLM calls")
+    if deduplicator:
+        print(f"Near-duplicate pages: {deduplicator.stats()}")
+    print(f"Scheduler: {get_scheduler().stats()}")
+    return progress
+
+
+@app.get("/connect", status_code=202)
+async def connection_endpoint(full: bool = False):
+    try:
+        # the sync runs on a worker thread, poll /connect/{job_id} for its progress
+        job = app.state.jobs.submit(lambda job: run_sync(job, full))
+        return {"message": "Google Drive sync started.", "job_id": job.id}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/connect/{job_id}", status_code=200)
+async def connection_status_endpoint(job_id: str):
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job.to_dict()
+
   
 @app.post("/query", status_code=200)
 async def query_endpoint(query: Query):
     try:
-
-        # retrieve the index and run the query
-        global counter
-        global index
-        if counter == 0:
-            indexer = Indexer()
-            index = indexer.retrieve_index()
-
-        
-            llm = Gemini(model = "models/gemini-2.0-flash")
-
-            doc_retriever = index.as_retriever(
-                retrieval_mode="files_via_content", 
-                files_top_k=5,
-            )
-            query_engine_doc = RetrieverQueryEngine.from_args(
-                doc_retriever, 
-                llm=llm, 
-                response_mode="tree_summarize",
-            )
-
-            chunk_retriever = index.as_retriever(
-                retrieval_mode="chunks", 
-                rerank_top_n=10,
-            )
-            query_engine_chunk = RetrieverQueryEngine.from_args(
-                chunk_retriever, 
-                llm=llm, 
-                response_mode="tree_summarize"
-            )
-            global router_query_workflow
-            router_query_workflow = RouterQueryWorkflow(
-                query_engines=[query_engine_doc, query_engine_chunk],
-                verbose=True,
-                llm=llm,
-                timeout=60
-            )
-            counter += 1
-        rag_response = await router_query_workflow.run(query_str=query.message)
+        # run the query on the query stack built at startup
+        rag_response = await app.state.service.run(query.message)
         return {"response": rag_response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        print(f"Trace: {trace_summary()}")
+
+
+@app.post("/query/stream", status_code=200)
+async def query_stream_endpoint(query: Query):
+    async def sse_events():
+        # the retrieved sources come first, then the answer tokens, then the full /query payload
+        try:
+            async for event, data in app.state.service.stream(query.message):
+                if event == "done":
+                    data = {"response": data}
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            print(f"Trace: {trace_summary()}")
+
+    return StreamingResponse(
+        sse_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
     
+@app.get("/metrics")
+async def metrics_endpoint():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # with several workers, each one writes its metrics to the shared directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="localhost", port=8000, reload=True)
\ No newline at end of file
+    with open(os.path.join(os.path.dirname(__file__), 'rag', 'config.json'), 'r') as f:
+        serving = json.load(f)["serving"]
+    workers = serving["workers"] or os.cpu_count()
+    if workers > 1:
+        # the workers are fresh processes, they read this before importing prometheus_client
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.abspath(".cache/prometheus"))
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+        uvicorn.run("main:app", host=serving["host"], port=serving["port"], workers=workers)
+    else:
+        uvicorn.run("main:app", host=serving["host"], port=serving["port"], reload=True)
\ No newline at end of file
@@ -0,0 +1,233 @@
+from collections import Counter, defaultdict
+import asyncio
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+
+# dropped from queries: they match most chunks, cost a walk of their whole postings and barely move the ranking
+STOPWORDS = frozenset(
+    "a about above after again against all am an and any are as at be because been before being below between "
+    "both but by can could did do does doing down during each few for from further had has have having he her "
+    "here hers him his how i if in into is it its itself just me more most my no nor not of off on once only or "
+    "other our ours out over own same she should so some such than that the their theirs them then there these "
+    "they this those through to too under until up very was we were what when where which while who whom why "
+    "will with would you your yours".split()
+)
+# score of chunks only BM25 found with a weak match: past any vector score, so they are never cited as sources
+LEXICAL_ONLY_SCORE = 1.0
+
+
+def tokenize(text):
+    """Lower-cased word tokens; numbers and codes like "q3" or "2024" are kept whole."""
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """In-process BM25 inverted index over the indexed chunks.
+
+    Postings and document lengths live in memory so lexical lookups never
+    leave the process. Each chunk's text and metadata are persisted in SQLite,
+    which is used to rebuild the postings at startup and to load the nodes of
+    the top hits. The Indexer keeps it in sync with the vector store: every
+    upserted node is added and every deleted vector id is removed.
+
+    Searches run off the event loop and only hold the lock to copy the
+    postings of the query terms. Stopwords are dropped from queries, and so
+    are terms found in more than ``max_df`` of the chunks: their idf is
+    below log(2), walking their postings would cost more than it ranks.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75, max_df=0.5):
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bm25_nodes (node_id TEXT PRIMARY KEY, text TEXT NOT NULL, node TEXT NOT NULL)"
+            )
+        self.postings, self.doc_lengths = self._read_postings()
+        self.total_length = sum(self.doc_lengths.values())
+
+    def _read_postings(self):
+        postings = defaultdict(dict)
+        doc_lengths = {}
+        for node_id, text in self.conn.execute("SELECT node_id, text FROM bm25_nodes"):
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                postings[term][node_id] = tf
+            doc_lengths[node_id] = sum(terms.values())
+        return postings, doc_lengths
+
+    def reload(self):
+        """Rebuild the postings from the chunks persisted by another process, searches go on meanwhile."""
+        postings, doc_lengths = self._read_postings()
+        with self._lock:
+            self.postings = postings
+            self.doc_lengths = doc_lengths
+            self.total_length = sum(doc_lengths.values())
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _add_postings(self, node_id, text):
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings[term][node_id] = tf
+        length = sum(terms.values())
+        self.doc_lengths[node_id] = length
+        self.total_length += length
+
+    def _remove_postings(self, node_id, text):
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(node_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(node_id)
+
+    def add(self, nodes):
+        """Add or replace nodes, indexing the same text the embedding model saw."""
+        rows = [
+            (node.node_id, node.get_content(metadata_mode=MetadataMode.EMBED),
+             json.dumps(node_to_metadata_dict(node, remove_text=False)))
+            for node in nodes
+        ]
+        with self.conn:
+            for node_id, text, node in rows:
+                # locked per node, so a search waits for one chunk and not for the whole batch
+                with self._lock:
+                    self._remove(node_id)
+                    self._add_postings(node_id, text)
+                    self.conn.execute(
+                        "INSERT INTO bm25_nodes (node_id, text, node) VALUES (?, ?, ?)", (node_id, text, node)
+                    )
+
+    def _remove(self, node_id):
+        row = self.conn.execute("SELECT text FROM bm25_nodes WHERE node_id = ?", (node_id,)).fetchone()
+        if row is None:
+            return
+        self._remove_postings(node_id, row[0])
+        self.conn.execute("DELETE FROM bm25_nodes WHERE node_id = ?", (node_id,))
+
+    def delete(self, node_ids):
+        with self.conn:
+            for node_id in node_ids:
+                with self._lock:
+                    self._remove(node_id)
+
+    def search(self, query_str, top_k=10):
+        """
+        Score the indexed chunks against a query with BM25
+
+        Scores are normalized by the score of an average-length chunk holding
+        each query term once, so a chunk matching only a common term of a
+        longer query scores low.
+
+        Returns:
+            (node_id, score) pairs of the best matches, highest score first
+        """
+        terms = set(tokenize(query_str)) - STOPWORDS or set(tokenize(query_str))
+        with self._lock:
+            n = len(self.doc_lengths)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            # copies, so the postings can be walked while chunks are added
+            postings = {term: dict(self.postings[term]) for term in terms if term in self.postings}
+        if not postings:
+            return []
+        idfs = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in postings.items()}
+        max_score = sum(idfs.values())
+        scores = defaultdict(float)
+        doc_lengths = self.doc_lengths
+        base, per_length = self.k1 * (1 - self.b), self.k1 * self.b / avg_length
+        for term in [term for term, p in postings.items() if len(p) <= self.max_df * n]:
+            weight = idfs[term] * (self.k1 + 1) / max_score
+            for node_id, tf in postings[term].items():
+                # a chunk deleted since the copy scores with the average length
+                scores[node_id] += weight * tf / (tf + base + per_length * doc_lengths.get(node_id, avg_length))
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def get_nodes(self, node_ids):
+        """Rebuild the stored nodes, keyed by node id."""
+        if not node_ids:
+            return {}
+        placeholders = ",".join("?" * len(node_ids))
+        rows = self.conn.execute(
+            f"SELECT node_id, node FROM bm25_nodes WHERE node_id IN ({placeholders})", list(node_ids)
+        ).fetchall()
+        return {node_id: metadata_dict_to_node(json.loads(node)) for node_id, node in rows}
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses dense vector retrieval with BM25 using reciprocal rank fusion.
+
+    Both retrievers produce a ranked candidate list and each chunk scores
+    sum(1 / (rrf_k + rank)) over the lists it appears in, so exact-term hits
+    (client names, project codes, figures) surface even when their embedding
+    is not among the nearest neighbours.
+
+    Returned nodes are ordered by the fused rank but keep the vector store's
+    relevance score, which the workflow thresholds on when citing sources.
+    Chunks found only by BM25 get the best score of the fused list when their
+    normalized BM25 score reaches ``min_lexical_score``, as a verbatim match
+    of the query's rare terms is as relevant as the top vector hit. Weaker
+    lexical-only hits still reach the LLM but are never cited.
+    """
+
+    def __init__(self, vector_retriever, bm25_index, bm25_top_k=10, top_k=10, rrf_k=60, min_lexical_score=0.5):
+        super().__init__()
+        self.vector_retriever = vector_retriever
+        self.bm25_index = bm25_index
+        self.bm25_top_k = bm25_top_k
+        self.top_k = top_k
+        self.rrf_k = rrf_k
+        self.min_lexical_score = min_lexical_score
+
+    def _fuse(self, vector_nodes, bm25_hits):
+        fused = defaultdict(float)
+        for rank, node in enumerate(vector_nodes):
+            fused[node.node.node_id] += 1 / (self.rrf_k + rank + 1)
+        for rank, (node_id, _) in enumerate(bm25_hits):
+            fused[node_id] += 1 / (self.rrf_k + rank + 1)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:self.top_k]
+
+        by_id = {node.node.node_id: node for node in vector_nodes}
+        bm25_scores = dict(bm25_hits)
+        lexical_nodes = self.bm25_index.get_nodes([node_id for node_id in ranked if node_id not in by_id])
+        vector_scores = [node.score for node in vector_nodes if node.score is not None]
+        best_score = min(vector_scores) if vector_scores else 0.0
+
+        results = []
+        for node_id in ranked:
+            if node_id in by_id:
+                results.append(by_id[node_id])
+            elif node_id in lexical_nodes:
+                score = best_score if bm25_scores[node_id] >= self.min_lexical_score else LEXICAL_ONLY_SCORE
+                results.append(NodeWithScore(node=lexical_nodes[node_id], score=score))
+        return results
+
+    def _retrieve(self, query_bundle):
+        vector_nodes = self.vector_retriever.retrieve(query_bundle)
+        bm25_hits = self.bm25_index.search(query_bundle.query_str, self.bm25_top_k)
+        return self._fuse(vector_nodes, bm25_hits)
+
+    async def _aretrieve(self, query_bundle):
+        # the lexical lookup runs on a thread while the vector query is in flight, the event loop keeps serving
+        vector_task = asyncio.ensure_future(self.vector_retriever.aretrieve(query_bundle))
+        bm25_hits = await asyncio.to_thread(self.bm25_index.search, query_bundle.query_str, self.bm25_top_k)
+        return self._fuse(await vector_task, bm25_hits)
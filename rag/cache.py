@@ -0,0 +1,332 @@
+import copy
+import hashlib
+import json
+from array import array
+from collections import OrderedDict
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from rag.metrics import CACHE_LOOKUPS
+
+
+class SqliteLRUCache:
+    """Persistent key/value cache stored in SQLite, bounded in size with LRU eviction.
+
+    The total size of the entries is kept in memory, loaded once when the
+    cache is opened, so a write never scans the table. size and last_used sit
+    ahead of the value BLOB, so eviction, which walks the last_used index,
+    never reads the values' overflow pages.
+    """
+
+    # label of the cache in the ctrlf_cache_lookups metric
+    metric_name = "sqlite"
+    # SQLite caps the number of parameters of a statement
+    MAX_VARIABLES = 500
+    # entries read per query while evicting
+    EVICT_BATCH = 256
+
+    def __init__(self, path, max_bytes):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL, value BLOB NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_last_used ON cache_entries (last_used)")
+            # entries written with the value ahead of size and last_used are carried over once
+            if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone():
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO cache_entries (key, size, last_used, value) "
+                    "SELECT key, size, last_used, value FROM entries"
+                )
+                self._conn.execute("DROP TABLE entries")
+            self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+
+    def _batches(self, keys):
+        return [keys[i:i + self.MAX_VARIABLES] for i in range(0, len(keys), self.MAX_VARIABLES)]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Look several keys up in one transaction
+
+        Returns:
+            A dict of the values found, by key
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock, self._conn:
+            for batch in self._batches(keys):
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT key, value FROM cache_entries WHERE key IN ({placeholders})", batch
+                ))
+            now = time.time()
+            self._conn.executemany("UPDATE cache_entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        hits = len(found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        if hits:
+            CACHE_LOOKUPS.labels(cache=self.metric_name, result="hit").inc(hits)
+        if len(keys) > hits:
+            CACHE_LOOKUPS.labels(cache=self.metric_name, result="miss").inc(len(keys) - hits)
+        return found
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """Write several (key, value) pairs in one transaction."""
+        items = dict(items)
+        if not items:
+            return
+        with self._lock, self._conn:
+            for batch in self._batches(list(items)):
+                placeholders = ",".join("?" * len(batch))
+                # replaced entries give their size back
+                self._bytes -= self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (key, size, last_used, value) VALUES (?, ?, ?, ?)",
+                [(key, len(value), now, value) for key, value in items.items()]
+            )
+            self._bytes += sum(len(value) for value in items.values())
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits again
+        while self._bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM cache_entries ORDER BY last_used LIMIT ?", (self.EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                self._bytes = 0
+                return
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self._bytes -= size
+                if self._bytes <= self.max_bytes:
+                    break
+            self._conn.executemany("DELETE FROM cache_entries WHERE key = ?", evicted)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+            size = self._bytes
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+class ParseCache(SqliteLRUCache):
+    """Parsed markdown pages keyed by the SHA-256 of the file bytes and the parser configuration."""
+
+    metric_name = "parse"
+
+    def key_for(self, file_path, parser_config):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        digest.update(json.dumps(parser_config, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get_pages(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_pages(self, key, pages):
+        self.set(key, json.dumps(pages).encode())
+
+
+class EmbeddingCache(SqliteLRUCache):
+    """Embeddings keyed by the hash of the embedding model name and the embedded text."""
+
+    metric_name = "embedding"
+
+    def __init__(self, path, max_bytes, tokenizer=None):
+        super().__init__(path, max_bytes)
+        self.tokenizer = tokenizer
+        self.tokens_saved = 0
+
+    def key_for(self, model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode()).hexdigest()
+
+    def get_embedding(self, model_name, text):
+        value = self.get(self.key_for(model_name, text))
+        if value is None:
+            return None
+        if self.tokenizer:
+            self.tokens_saved += len(self.tokenizer(text))
+        return array('f', value).tolist()
+
+    def set_embedding(self, model_name, text, embedding):
+        self.set(self.key_for(model_name, text), array('f', embedding).tobytes())
+
+    def get_embeddings(self, model_name, texts):
+        """Cached embeddings of several texts, read in one query, None for the missing ones."""
+        keys = [self.key_for(model_name, text) for text in texts]
+        found = self.get_many(keys)
+        if self.tokenizer:
+            self.tokens_saved += sum(len(self.tokenizer(text)) for text, key in zip(texts, keys) if key in found)
+        return [array('f', found[key]).tolist() if key in found else None for key in keys]
+
+    def set_embeddings(self, model_name, texts, embeddings):
+        self.set_many(
+            (self.key_for(model_name, text), array('f', embedding).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        )
+
+    def stats(self):
+        return {**super().stats(), "tokens_saved": self.tokens_saved}
+
+
+class SummaryCache(SqliteLRUCache):
+    """LLM summaries keyed by the hash of the model, the prompt and the summarized text."""
+
+    metric_name = "summary"
+
+    def key_for(self, model_name, prompt, text):
+        return hashlib.sha256(f"{model_name}\0{prompt}\0{text}".encode()).hexdigest()
+
+    def get_summary(self, key):
+        value = self.get(key)
+        return value.decode() if value is not None else None
+
+    def set_summary(self, key, summary):
+        self.set(key, summary.encode())
+
+
+# question words that start a query capitalized without naming anything
+QUESTION_WORDS = {
+    "what", "which", "who", "whom", "whose", "how", "when", "where", "why", "is", "are", "was", "were",
+    "do", "does", "did", "can", "could", "should", "would", "will", "has", "have", "had", "the", "a", "an",
+    "in", "on", "for", "of", "to", "list", "show", "give", "tell", "find", "summarize", "describe", "i", "please",
+}
+NEGATIONS = {"not", "no", "never", "without", "nor", "none"}
+
+
+def query_terms(query_str):
+    """
+    Numbers, names and negation of a query, which must match for a cached answer to be reused
+
+    Embeddings score "revenue in 2012" and "revenue in 2013", or the same question
+    about two clients, as near-identical, although their answers differ.
+
+    Returns:
+        A frozenset of the terms
+    """
+    terms = set()
+    for word in re.findall(r"[\w'-]+", query_str):
+        word = re.sub(r"'s$", "", word)
+        lower = word.lower()
+        if any(c.isdigit() for c in word):
+            terms.add(lower)
+        elif lower in NEGATIONS or lower.endswith("n't"):
+            terms.add("not")
+        elif word[0].isupper() and lower not in QUESTION_WORDS:
+            terms.add(lower)
+    return frozenset(terms)
+
+
+class AnswerCache:
+    """In-memory semantic cache of query responses.
+
+    A response is reused when a new query's embedding has a cosine similarity
+    of at least ``similarity_threshold`` with a cached query's, and both
+    queries have the same numbers, names and negation (see query_terms). Entries expire
+    after ``ttl`` seconds, the least recently used ones are evicted beyond
+    ``max_entries``, and invalidate_files drops every entry citing a file that
+    was re-indexed or deleted.
+    """
+
+    def __init__(self, similarity_threshold=0.92, ttl=3600, max_entries=1000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl]:
+            del self._entries[key]
+
+    def lookup(self, query_str, embedding):
+        terms = query_terms(query_str)
+        with self._lock:
+            self._expire()
+            keys = [key for key, entry in self._entries.items() if entry["terms"] == terms]
+            if keys:
+                matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+                similarities = matrix @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.hits += 1
+                    CACHE_LOOKUPS.labels(cache="answer", result="hit").inc()
+                    self._entries.move_to_end(keys[best])
+                    return copy.deepcopy(self._entries[keys[best]]["payload"])
+            self.misses += 1
+            CACHE_LOOKUPS.labels(cache="answer", result="miss").inc()
+            return None
+
+    def store(self, query_str, embedding, payload):
+        file_ids = {doc["file_id"] for doc in payload.get("documents", []) if doc.get("file_id")}
+        with self._lock:
+            self._entries[query_str] = {
+                "embedding": embedding,
+                "payload": copy.deepcopy(payload),
+                "file_ids": file_ids,
+                "terms": query_terms(query_str),
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(query_str)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_files(self, file_ids):
+        file_ids = set(file_ids)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["file_ids"] & file_ids]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            print(f"Invalidated {len(stale)} cached answers citing re-indexed files")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,87 @@
+"""Bounded fan-out over a lazily consumed, possibly blocking, iterator.
+
+The ingestion stages hand each other work through generators that block until
+the upstream stage produces its next item, e.g. while the Drive listing waits
+for its next page. Fetching that next item must not hold back results that
+are already done, so the fetch runs as one more pending future, waited on
+together with the work in flight, and results are yielded in completion order.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+
+_END = object()
+
+
+def iter_completed(items, submit, max_pending):
+    """
+    Submit work for each item, at most max_pending at a time, and yield it as it completes
+
+    Args:
+        items (iterable): Items, consumed lazily on a thread of their own
+        submit (callable): Called with each item on the calling thread, returns
+            a (future, tag) tuple
+        max_pending (int): Maximum number of submitted futures not yet yielded
+
+    Yields:
+        (tag, future) tuples of done futures, in completion order
+    """
+    items = iter(items)
+    pending = {}
+    fetch = None
+    exhausted = False
+    fetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetch")
+    try:
+        while pending or not exhausted:
+            if fetch is None and not exhausted and len(pending) < max_pending:
+                fetch = fetcher.submit(next, items, _END)
+            done, _ = wait([*pending, *([fetch] if fetch else [])], return_when=FIRST_COMPLETED)
+            if fetch in done:
+                item = fetch.result()
+                fetch = None
+                if item is _END:
+                    exhausted = True
+                else:
+                    future, tag = submit(item)
+                    pending[future] = tag
+            for future in done:
+                if future in pending:
+                    yield pending.pop(future), future
+    finally:
+        # a fetch still blocked on the iterator is abandoned with it
+        fetcher.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_completed(items, start, max_in_flight):
+    """
+    Run a coroutine for each item, at most max_in_flight at a time, and yield them as they finish
+
+    The event loop version of iter_completed: the next item is fetched with
+    asyncio.to_thread as one more task, awaited together with the running ones.
+
+    Args:
+        items (iterable): Items, consumed lazily off the event loop
+        start (callable): Called with each item, returns a (coroutine, tag) tuple
+        max_in_flight (int): Maximum number of started coroutines not yet yielded
+
+    Yields:
+        (tag, task) tuples of done tasks, in completion order
+    """
+    items = iter(items)
+    pending = {}
+    fetch = None
+    exhausted = False
+    while pending or not exhausted:
+        if fetch is None and not exhausted and len(pending) < max_in_flight:
+            fetch = asyncio.ensure_future(asyncio.to_thread(next, items, _END))
+        done, _ = await asyncio.wait([*pending, *([fetch] if fetch else [])], return_when=asyncio.FIRST_COMPLETED)
+        if fetch in done:
+            item = fetch.result()
+            fetch = None
+            if item is _END:
+                exhausted = True
+            else:
+                coroutine, tag = start(item)
+                pending[asyncio.ensure_future(coroutine)] = tag
+        for task in done:
+            if task in pending:
+                yield pending.pop(task), task
@@ -0,0 +1,244 @@
+from llama_index.core import Document
+import numpy as np
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+import zlib
+
+# a prime above 2**32, for the universal hashes of the MinHash permutations
+MINHASH_PRIME = 4294967311
+SOURCE_KEYS = ('file_id', 'file_name', 'url', 'page_number', 'experts')
+
+
+class PageDeduplicator:
+    """Near-duplicate page detection between parsing and indexing, with MinHash signatures and LSH.
+
+    Decks derived from one another repeat the same boilerplate slides,
+    disclaimers and appendix pages. Each page gets a MinHash signature of its
+    word shingles; pages whose estimated Jaccard similarity with a cluster's
+    canonical page reaches ``threshold`` join that cluster, candidates being
+    found through the LSH bands of the signature. Only the canonical page of
+    a cluster is embedded and stored, with a 'sources' metadata entry listing
+    every file and page of the cluster, so citations and experts still cover
+    them all. 'sources' is left out of the embedded and LLM text.
+
+    Clusters persist in SQLite across syncs, with the text of every page: when
+    a file is re-indexed or deleted, its pages leave their clusters, and a
+    cluster that lost its canonical page promotes another member, which is
+    then indexed from the stored text. A cluster whose members changed has its
+    canonical page upserted again with the new 'sources'. As the embedded text
+    is unchanged, the embedding cache serves it without an API call.
+    """
+
+    def __init__(self):
+        self.config = self._load_configs()["dedup"]
+        self.threshold = self.config["threshold"]
+        self.num_perm = self.config["num_perm"]
+        self.bands = self.config["bands"]
+        self.shingle_size = self.config["shingle_size"]
+        if self.num_perm % self.bands:
+            raise ValueError(f"dedup.num_perm ({self.num_perm}) must be a multiple of dedup.bands ({self.bands})")
+        self.rows = self.num_perm // self.bands
+        # fixed seed: signatures are persisted, they must be computed the same way on every run
+        rng = np.random.default_rng(self.config["seed"])
+        self._a = rng.integers(1, 2 ** 32, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 2 ** 32, size=self.num_perm, dtype=np.uint64)
+
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.config["path"]) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.config["path"], check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages (file_id TEXT NOT NULL, page_number INTEGER NOT NULL, "
+                "cluster_id TEXT NOT NULL, signature BLOB NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL, "
+                "PRIMARY KEY (file_id, page_number))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS pages_cluster ON pages (cluster_id)")
+            # the canonical page of each cluster, and the signature new pages are compared against
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS clusters (cluster_id TEXT PRIMARY KEY, file_id TEXT NOT NULL, "
+                "page_number INTEGER NOT NULL, signature BLOB NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, hash INTEGER NOT NULL, cluster_id TEXT NOT NULL, "
+                "PRIMARY KEY (band, hash, cluster_id))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS bands_cluster ON bands (cluster_id)")
+
+    def _load_configs(self):
+        """Load deduplication settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    def signature(self, text):
+        """MinHash signature of the word shingles of a text, None if it has no words."""
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return None
+        size = min(self.shingle_size, len(words))
+        shingles = {zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)}
+        x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        # a and x are below 2**32, so the product fits in 64 bits
+        hashes = (self._a[:, None] * x[None, :] % MINHASH_PRIME + self._b[:, None]) % MINHASH_PRIME
+        return hashes.min(axis=1)
+
+    def similarity(self, signature, other):
+        """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+        return float(np.mean(signature == other))
+
+    def _band_hashes(self, signature):
+        return [
+            (band, zlib.crc32(signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+            for band in range(self.bands)
+        ]
+
+    def _find_cluster(self, signature):
+        candidates = set()
+        for band, band_hash in self._band_hashes(signature):
+            candidates.update(row[0] for row in self.conn.execute(
+                "SELECT cluster_id FROM bands WHERE band = ? AND hash = ?", (band, band_hash)
+            ))
+        best, best_similarity = None, self.threshold
+        for cluster_id in candidates:
+            canonical = np.frombuffer(self.conn.execute(
+                "SELECT signature FROM clusters WHERE cluster_id = ?", (cluster_id,)
+            ).fetchone()[0], dtype=np.uint64)
+            similarity = self.similarity(signature, canonical)
+            if similarity >= best_similarity:
+                best, best_similarity = cluster_id, similarity
+        return best
+
+    def _set_canonical(self, cluster_id, file_id, page_number, signature):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO clusters (cluster_id, file_id, page_number, signature) VALUES (?, ?, ?, ?)",
+            (cluster_id, file_id, page_number, signature.tobytes()),
+        )
+        self.conn.execute("DELETE FROM bands WHERE cluster_id = ?", (cluster_id,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO bands (band, hash, cluster_id) VALUES (?, ?, ?)",
+            [(band, band_hash, cluster_id) for band, band_hash in self._band_hashes(signature)],
+        )
+
+    def _remove_pages(self, file_ids):
+        # the clusters keep their canonical signature for now, a new version of the page may join it again
+        touched = set()
+        for file_id in file_ids:
+            touched.update(row[0] for row in self.conn.execute(
+                "SELECT cluster_id FROM pages WHERE file_id = ?", (file_id,)
+            ))
+            self.conn.execute("DELETE FROM pages WHERE file_id = ?", (file_id,))
+        return touched
+
+    def _repair(self, cluster_ids):
+        """Drop the clusters left without pages, promote a new canonical page where it was removed."""
+        alive = set()
+        for cluster_id in cluster_ids:
+            members = self.conn.execute(
+                "SELECT file_id, page_number, signature FROM pages WHERE cluster_id = ? ORDER BY file_id, page_number",
+                (cluster_id,),
+            ).fetchall()
+            if not members:
+                self.conn.execute("DELETE FROM clusters WHERE cluster_id = ?", (cluster_id,))
+                self.conn.execute("DELETE FROM bands WHERE cluster_id = ?", (cluster_id,))
+                continue
+            canonical = self.conn.execute(
+                "SELECT file_id, page_number FROM clusters WHERE cluster_id = ?", (cluster_id,)
+            ).fetchone()
+            if canonical not in [(file_id, page_number) for file_id, page_number, _ in members]:
+                file_id, page_number, signature = members[0]
+                self._set_canonical(cluster_id, file_id, page_number, np.frombuffer(signature, dtype=np.uint64))
+            alive.add(cluster_id)
+        return alive
+
+    def _canonical_document(self, cluster_id, batch_pages):
+        file_id, page_number = self.conn.execute(
+            "SELECT file_id, page_number FROM clusters WHERE cluster_id = ?", (cluster_id,)
+        ).fetchone()
+        members = self.conn.execute(
+            "SELECT file_id, page_number, metadata FROM pages WHERE cluster_id = ? ORDER BY file_id, page_number",
+            (cluster_id,),
+        ).fetchall()
+        document = batch_pages.get((file_id, page_number))
+        if document is None:
+            # the canonical page belongs to a file outside this batch, rebuild it from the stored text
+            text, metadata = self.conn.execute(
+                "SELECT text, metadata FROM pages WHERE file_id = ? AND page_number = ?", (file_id, page_number)
+            ).fetchone()
+            document = Document(id_=f"{file_id}_part_{page_number - 1}", text=text, metadata=json.loads(metadata))
+        document.metadata.pop('sources', None)
+        if len(members) > 1:
+            # the canonical page first, so the citation of a single source stays the same
+            sources = [json.loads(metadata) for member_file_id, member_page, metadata in members
+                       if (member_file_id, member_page) == (file_id, page_number)]
+            sources += [json.loads(metadata) for member_file_id, member_page, metadata in members
+                        if (member_file_id, member_page) != (file_id, page_number)]
+            document.metadata['sources'] = [{key: source[key] for key in SOURCE_KEYS if key in source} for source in sources]
+        for excluded in (document.excluded_embed_metadata_keys, document.excluded_llm_metadata_keys):
+            if 'sources' not in excluded:
+                excluded.append('sources')
+        return document
+
+    def update(self, files):
+        """
+        Cluster the pages of parsed files, replacing the pages recorded for earlier versions of them
+
+        Args:
+            files (list): (file_id, pages) tuples, pages being the page documents returned by the parser
+
+        Returns:
+            (documents, duplicates): the page documents to upsert (the canonical page of every
+            cluster this changed, with its 'sources', and the pages without text), and the
+            (file_id, page_number) keys of the pages of these files stored under another page
+        """
+        batch_pages = {}
+        documents = []
+        with self._lock, self.conn:
+            touched = self._remove_pages([file_id for file_id, _ in files])
+            for file_id, pages in files:
+                for page in pages:
+                    signature = self.signature(page.text)
+                    if signature is None:
+                        documents.append(page)
+                        continue
+                    page_number = page.metadata['page_number']
+                    cluster_id = self._find_cluster(signature)
+                    if cluster_id is None:
+                        cluster_id = uuid.uuid4().hex
+                        self._set_canonical(cluster_id, file_id, page_number, signature)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO pages (file_id, page_number, cluster_id, signature, text, metadata) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (file_id, page_number, cluster_id, signature.tobytes(), page.text,
+                         json.dumps({key: value for key, value in page.metadata.items() if key != 'sources'})),
+                    )
+                    batch_pages[(file_id, page_number)] = page
+                    touched.add(cluster_id)
+            canonical = []
+            for cluster_id in self._repair(touched):
+                document = self._canonical_document(cluster_id, batch_pages)
+                canonical.append((document.metadata['file_id'], document.metadata['page_number']))
+                documents.append(document)
+        duplicates = set(batch_pages) - set(canonical)
+        return documents, duplicates
+
+    def remove_files(self, file_ids):
+        """
+        Forget the pages of deleted files
+
+        Returns:
+            The canonical page documents to upsert: those promoted in place of a deleted
+            page, and those whose 'sources' lost a member
+        """
+        with self._lock, self.conn:
+            touched = self._repair(self._remove_pages(file_ids))
+            return [self._canonical_document(cluster_id, {}) for cluster_id in touched]
+
+    def stats(self):
+        pages, clusters = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT cluster_id) FROM pages"
+        ).fetchone()
+        return {"pages": pages, "clusters": clusters, "pages_deduplicated": pages - clusters}
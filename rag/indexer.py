@@ -1,9 +1,25 @@
-from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core import StorageContext, VectorStoreIndex
-from llama_index.vector_stores.supabase import SupabaseVectorStore
-from supabase import create_client
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+from rag.cache import EmbeddingCache
+from rag.vector_store import LocalVectorStore
+from rag.bm25 import BM25Index
+from rag.metrics import span, TOKENS_EMBEDDED
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 import os
+import json
+import uuid
+
+
+def chunk_node_id(chunk_index, document):
+    """Deterministic node id from the Drive file, page and chunk index, so re-indexing a file overwrites its vectors."""
+    file_id = document.metadata.get("file_id")
+    if file_id is None:
+        return str(uuid.uuid4())
+    return f"{file_id}_p{document.metadata.get('page_number', 0)}_c{chunk_index}"
+
 
 class Indexer:
     def __init__(self):
@@ -14,32 +30,220 @@ class Indexer:
         self.SUPABASE_CONNECTION_STRING = os.getenv("SUPABASE_CONNECTION_STRING")
         self.OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-        self.supabase = create_client(self.SUPABASE_URL, self.SUPABASE_KEY)
-        self.embed_model = OpenAIEmbedding(model="text-embedding-ada-002", api_key=self.OPENAI_API_KEY)
-        self.vector_store = SupabaseVectorStore(
-            postgres_connection_string=self.SUPABASE_CONNECTION_STRING,
-            collection_name="base_demo",
+        self.config = self._load_configs()
+        self.embedding_config = self.config["embedding"]
+        self.vector_store_config = self.config["vector_store"]
+        cache_config = self.config["cache"]["embedding"]
+
+        # every embedding request, ingestion batches and query embeddings alike, goes through the shared scheduler
+        from rag.scheduler import ScheduledOpenAIEmbedding
+        self.embed_model = ScheduledOpenAIEmbedding(
+            model=self.embedding_config["model"],
+            api_key=self.OPENAI_API_KEY,
+            embed_batch_size=self.embedding_config["batch_size"]
         )
+        self.embedding_cache = EmbeddingCache(cache_config["path"], cache_config["max_bytes"], tokenizer=get_tokenizer())
+        self.backend = self.vector_store_config["backend"]
+        # one vecs client, and Postgres pool, for the chunk and the summary collections
+        self._vecs_client = None
+        self.vector_store = self._build_vector_store()
+        # page and document summaries live in a store of their own, beside the chunks
+        self.summary_store = self._build_vector_store(suffix="_summaries") if self.config["summaries"]["enabled"] else None
+        bm25_config = self.config["hybrid"]
+        self.bm25 = BM25Index(
+            bm25_config["path"], k1=bm25_config["k1"], b=bm25_config["b"], max_df=bm25_config["max_df"]
+        ) if bm25_config["enabled"] else None
+        self.node_parser = SentenceSplitter(id_func=chunk_node_id)
         
         self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
 
+    def _load_configs(self):
+        """Load indexing settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    def _build_vector_store(self, suffix=""):
+        # "local" keeps the vectors in-process, memory-mapped under .cache, with no database round-trip
+        if self.backend == "local":
+            local_config = self.vector_store_config["local"]
+            return LocalVectorStore(
+                path=local_config["path"] + suffix,
+                dim=local_config["dim"],
+                dtype=local_config["dtype"],
+            )
+        if self.backend == "supabase":
+            # imported here so the local backend starts without loading the vecs client
+            import vecs
+            from rag.supabase_store import AsyncSupabaseVectorStore
+            if self._vecs_client is None:
+                self._vecs_client = vecs.create_client(self.SUPABASE_CONNECTION_STRING)
+            return AsyncSupabaseVectorStore(
+                self._vecs_client,
+                collection_name=self.vector_store_config["collection_name"] + suffix,
+            )
+        raise ValueError(f"Unknown vector store backend '{self.backend}'")
+
+    def _delete_from(self, store, filters):
+        # both backends take the same vecs style filters and return the deleted ids
+        if self.backend == "local":
+            return store.delete_where(filters)
+        return store._collection.delete(filters=filters)
+
+    def _delete_where(self, filters):
+        deleted = self._delete_from(self.vector_store, filters)
+        if self.bm25 is not None:
+            self.bm25.delete(deleted)
+        # summaries carry the same file_id and last_modified_date as the chunks they summarize
+        if self.summary_store is not None:
+            self._delete_from(self.summary_store, filters)
+        return deleted
+
     def index_document(self, documents):
-        index = VectorStoreIndex.from_documents(
-            documents,
-            storage_context=self.storage_context, 
-            embed_model=self.embed_model,
-            include_metadata=True
+        self.upsert_documents(documents)
+        index = VectorStoreIndex.from_vector_store(
+            vector_store=self.vector_store,
+            embed_model=self.embed_model
         )
-        print("✅ Documents successfully indexed and stored in Supabase!")
+        print(f"✅ Documents successfully indexed and stored in the {self.backend} vector store!")
         return index
+
+    def upsert_documents(self, documents, replace_file_ids=()):
+        """
+        Split, embed and upsert a batch of documents into the vector store
+
+        Unlike index_document this does not build an index object, so the
+        ingestion pipeline can call it for every batch as chunks arrive. Node
+        ids are deterministic, so upserting a file again overwrites its vectors
+        instead of adding copies.
+
+        Args:
+            documents (list): Page documents to index
+            replace_file_ids (iterable): Files already in the store whose vectors
+                from an older version, not overwritten by this batch, are removed
+
+        Returns:
+            The nodes written to the vector store
+        """
+        nodes = self.node_parser.get_nodes_from_documents(documents)
+        embeddings = self.embed_texts(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        )
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+
+        batch_size = self.vector_store_config["upsert_batch_size"]
+        with span("upsert"):
+            for start in range(0, len(nodes), batch_size):
+                self.vector_store.add(nodes[start:start + batch_size])
+            if self.bm25 is not None:
+                self.bm25.add(nodes)
+
+        replace_file_ids = set(replace_file_ids)
+        versions = {
+            node.metadata["file_id"]: node.metadata.get("last_modified_date")
+            for node in nodes if node.metadata.get("file_id") in replace_file_ids
+        }
+        for file_id, version in versions.items():
+            self.delete_stale(file_id, version)
+        return nodes
+
+    def upsert_summaries(self, nodes):
+        """
+        Embed and upsert page and document summary nodes into the summary store
+
+        Summaries of an older version of a file are pruned by the next
+        upsert_documents call for the file, so upsert its summaries first.
+
+        Returns:
+            The summary nodes written
+        """
+        if self.summary_store is None or not nodes:
+            return []
+        embeddings = self.embed_texts([node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes])
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        with span("upsert"):
+            self.summary_store.add(nodes)
+        return nodes
+
+    def replace_file(self, file_id, documents):
+        """Upsert the new version of a file and drop the vectors left over from the previous one."""
+        return self.upsert_documents(documents, replace_file_ids=[file_id])
+
+    def delete_stale(self, file_id, version):
+        """Remove the vectors of a file left over from versions other than the given one."""
+        # Every vector of the new version was just upserted, anything else for this file is stale
+        deleted = self._delete_where({"$and": [
+            {"file_id": {"$eq": file_id}},
+            {"last_modified_date": {"$ne": version}},
+        ]})
+        if deleted:
+            print(f"🗑️ Removed {len(deleted)} stale vectors for file {file_id}")
+        return deleted
     
+    def reload(self):
+        """Pick up the index written by another process: the local stores and BM25 live in this one's memory."""
+        if self.backend == "local":
+            self.vector_store.reload()
+            if self.summary_store is not None:
+                self.summary_store.reload()
+        if self.bm25 is not None:
+            self.bm25.reload()
+
+    def embed_texts(self, texts):
+        """
+        Embed texts, only sending the ones missing from the embedding cache to the API
+
+        Cache misses are sent in batches of embedding.batch_size, with up to
+        embedding.max_parallel_requests batches in flight at once.
+
+        Returns:
+            Embeddings in the same order as the texts
+        """
+        model_name = self.embedding_config["model"]
+        embeddings = self.embedding_cache.get_embeddings(model_name, texts)
+        # Identical texts within the batch are only embedded once
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if not missing:
+            return embeddings
+
+        batch_size = self.embedding_config["batch_size"]
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        new_embeddings = {}
+        with span("embed"), ThreadPoolExecutor(max_workers=self.embedding_config["max_parallel_requests"]) as executor:
+            # each batch is cached in one write as soon as it is embedded
+            for batch, batch_embeddings in zip(batches, executor.map(self.embed_model.get_text_embedding_batch, batches)):
+                self.embedding_cache.set_embeddings(model_name, batch, batch_embeddings)
+                new_embeddings.update(zip(batch, batch_embeddings))
+        if self.embedding_cache.tokenizer:
+            TOKENS_EMBEDDED.inc(sum(len(self.embedding_cache.tokenizer(text)) for text in missing))
+
+        print(f"Embedded {len(missing)} new texts, {sum(e is not None for e in embeddings)} served from cache")
+        return [embedding if embedding is not None else new_embeddings[text] for text, embedding in zip(texts, embeddings)]
+
+    def delete_file(self, file_id):
+        # Every chunk carries the Drive file_id in its metadata, so one filtered delete removes them all
+        deleted = self._delete_where({"file_id": {"$eq": file_id}})
+        print(f"🗑️ Removed {len(deleted)} vectors for file {file_id}")
+        return deleted
+
+    def retrieve_summary_index(self):
+        """Index over the page and document summaries, None when summaries are disabled."""
+        if self.summary_store is None:
+            return None
+        return VectorStoreIndex.from_vector_store(
+            vector_store=self.summary_store,
+            embed_model=self.embed_model
+        )
+
     def retrieve_index(self):
         # Retrieve the index from the storage context
         index = VectorStoreIndex.from_vector_store(
             vector_store=self.vector_store,
             embed_model=self.embed_model
         )
-        print("✅ Index successfully retrieved from Supabase!")
+        print(f"✅ Index successfully retrieved from the {self.backend} vector store!")
         return index
 
 # Example usage:
@@ -0,0 +1,158 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IngestionJob:
+    """A Drive sync running in the background, with its progress counters."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.pipeline = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.sync_lock = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        progress = dict(self.pipeline.progress) if self.pipeline else {}
+        elapsed = None
+        throughput = None
+        eta = None
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            processed = progress.get("files_indexed", 0) + progress.get("files_failed", 0)
+            throughput = processed / elapsed if elapsed > 0 else 0.0
+            # The number of files to process is only known once listing is done, and
+            # the pipeline is only set once the sync has built its connecter and parser
+            if self.status == "running" and self.pipeline is not None and self.pipeline.listing_complete and throughput:
+                eta = (progress["files_changed"] - processed) / throughput
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "progress": progress,
+            "elapsed_seconds": elapsed,
+            "files_per_second": throughput,
+            "eta_seconds": eta,
+        }
+
+
+class SharedJob:
+    """A job started by another worker process, as last published in the shared state."""
+
+    def __init__(self, record):
+        self.id = record["job_id"]
+        self.record = record
+
+    @property
+    def active(self):
+        return self.record["status"] in ("queued", "running")
+
+    def to_dict(self):
+        return dict(self.record)
+
+
+class JobManager:
+    """Runs ingestion jobs on a worker thread so the event loop keeps serving queries.
+
+    With a SharedState, only one worker process of the API syncs at a time,
+    and the jobs' progress is published every publish_interval seconds so
+    any worker can report it.
+    """
+
+    def __init__(self, max_workers=1, state=None, publish_interval=1.0):
+        self.jobs = {}
+        self.state = state
+        self.publish_interval = publish_interval
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+
+    def submit(self, run):
+        """
+        Start a job, or return the sync already queued or running
+
+        Args:
+            run (callable): Called with the job on the worker thread. It must set
+                job.pipeline before running it and return the run's summary.
+
+        Returns:
+            The IngestionJob tracking the sync, or a SharedJob when another
+            worker process is already syncing
+        """
+        with self._lock:
+            for job in self.jobs.values():
+                if job.active:
+                    return job
+            sync_lock = None
+            if self.state is not None:
+                sync_lock = self.state.try_lock_sync()
+                if sync_lock is None:
+                    record = self.state.active_job()
+                    if record is None:
+                        raise RuntimeError("A sync is starting in another worker, try again shortly")
+                    return SharedJob(record)
+            job = IngestionJob()
+            job.sync_lock = sync_lock
+            self.jobs[job.id] = job
+            if self.state is not None:
+                self.state.save_job(job.to_dict())
+                self.state.set_active_job(job.id)
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _publish(self, job):
+        if self.state is None:
+            return
+        # a failed publish is retried on the next interval, it must not stop the publisher thread
+        try:
+            self.state.save_job(job.to_dict())
+        except Exception as e:
+            print(f"Warning: Could not publish the progress of job {job.id}: {e}")
+
+    def _publish_progress(self, job, done):
+        while not done.wait(self.publish_interval):
+            self._publish(job)
+
+    def _run(self, job, run):
+        job.status = "running"
+        job.started_at = time.time()
+        done = threading.Event()
+        if self.state is not None:
+            threading.Thread(target=self._publish_progress, args=(job, done), daemon=True).start()
+        try:
+            job.result = run(job)
+            job.status = "succeeded"
+        except Exception as e:
+            print(f"Ingestion job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            done.set()
+            self._publish(job)
+            if job.sync_lock is not None:
+                self.state.unlock_sync(job.sync_lock)
+                job.sync_lock = None
+
+    def get(self, job_id):
+        """The job with this id, whichever worker process started it, None if unknown."""
+        job = self.jobs.get(job_id)
+        if job is not None or self.state is None:
+            return job
+        record = self.state.load_job(job_id)
+        if record is None:
+            return None
+        job = SharedJob(record)
+        if job.active and not self.state.sync_running():
+            # the lock is released when its process exits, a job still marked running has lost its worker
+            job.record.update(status="failed", error="The worker running this sync exited")
+        return job
@@ -0,0 +1,137 @@
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+NAMESPACES = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+# path construction operators of a PDF content stream, many of them means vector graphics (charts, diagrams)
+PDF_PATH_OPERATORS = re.compile(rb"\s(?:re|l|c|v|y)\s")
+
+
+class LocalExtractor:
+    """Fast local text extraction with a visual-content score per page.
+
+    Reads the PDF text layer (with pypdf) and the docx/pptx XML directly, so
+    most pages never leave the process. Each page is returned with counts of
+    its images, charts and vector drawing operations, which needs_multimodal
+    uses to decide whether the page has to go to the multimodal parser.
+    """
+
+    def __init__(self, min_text_chars=200, max_vector_ops=300):
+        self.min_text_chars = min_text_chars
+        self.max_vector_ops = max_vector_ops
+
+    def supports(self, file_extension):
+        if file_extension == '.pdf':
+            return PdfReader is not None
+        return file_extension in ('.docx', '.pptx')
+
+    def extract(self, file_path, file_extension):
+        """
+        Extract the text of each page of a file
+
+        Returns:
+            Page dicts with 'page_number' (1-based), 'text', 'images', 'charts' and
+            'vector_ops', in page order
+        """
+        if file_extension == '.pdf':
+            return self._extract_pdf(file_path)
+        if file_extension == '.docx':
+            return self._extract_docx(file_path)
+        if file_extension == '.pptx':
+            return self._extract_pptx(file_path)
+        raise ValueError(f"Local extraction is not supported for '{file_extension}' files")
+
+    def needs_multimodal(self, page):
+        """A page goes to the multimodal parser when it holds images or charts, or too little text to stand alone."""
+        return (
+            page['images'] > 0
+            or page['charts'] > 0
+            or page['vector_ops'] > self.max_vector_ops
+            or len(page['text'].strip()) < self.min_text_chars
+        )
+
+    def _extract_pdf(self, file_path):
+        pages = []
+        for index, page in enumerate(PdfReader(file_path).pages):
+            images = 0
+            resources = page.get('/Resources')
+            xobjects = resources.get_object().get('/XObject') if resources else None
+            if xobjects:
+                xobjects = xobjects.get_object()
+                images = sum(1 for name in xobjects if xobjects[name].get_object().get('/Subtype') == '/Image')
+            contents = page.get_contents()
+            pages.append({
+                'page_number': index + 1,
+                'text': page.extract_text() or '',
+                'images': images,
+                'charts': 0,
+                'vector_ops': len(PDF_PATH_OPERATORS.findall(contents.get_data())) if contents is not None else 0,
+            })
+        return pages
+
+    def _extract_pptx(self, file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            presentation = ET.fromstring(archive.read('ppt/presentation.xml'))
+            rels = ET.fromstring(archive.read('ppt/_rels/presentation.xml.rels'))
+            targets = {rel.get('Id'): rel.get('Target') for rel in rels.findall('rel:Relationship', NAMESPACES)}
+            # slides in presentation order, which is not the order of the slideN.xml file names
+            slide_ids = presentation.findall('p:sldIdLst/p:sldId', NAMESPACES)
+            pages = []
+            for index, slide_id in enumerate(slide_ids):
+                target = targets[slide_id.get(f"{{{NAMESPACES['r']}}}id")]
+                slide = ET.fromstring(archive.read(posixpath.normpath(posixpath.join('ppt', target))))
+                paragraphs = [
+                    "".join(run.text or '' for run in paragraph.iter(f"{{{NAMESPACES['a']}}}t"))
+                    for paragraph in slide.iter(f"{{{NAMESPACES['a']}}}p")
+                ]
+                graphic_uris = [data.get('uri', '') for data in slide.iter(f"{{{NAMESPACES['a']}}}graphicData")]
+                pages.append({
+                    'page_number': index + 1,
+                    'text': "\n".join(paragraph for paragraph in paragraphs if paragraph),
+                    'images': len(slide.findall('.//p:pic', NAMESPACES)),
+                    # charts and SmartArt diagrams are graphic frames, tables are plain text
+                    'charts': sum(1 for uri in graphic_uris if 'chart' in uri or 'diagram' in uri),
+                    'vector_ops': 0,
+                })
+        return pages
+
+    def _extract_docx(self, file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            document = ET.fromstring(archive.read('word/document.xml'))
+        w = f"{{{NAMESPACES['w']}}}"
+        pages = [{'page_number': 1, 'text': '', 'images': 0, 'charts': 0, 'vector_ops': 0}]
+        body = document.find('w:body', NAMESPACES)
+        for paragraph in body.iter(f"{w}p"):
+            line = []
+            for element in paragraph.iter():
+                # docx has no pages, split on the page breaks Word recorded when the file was last saved
+                if (element.tag == f"{w}br" and element.get(f"{w}type") == 'page') or element.tag == f"{w}lastRenderedPageBreak":
+                    pages[-1]['text'] += "".join(line)
+                    if not pages[-1]['text'].strip() and len(pages) > 1:
+                        # a manual break is followed by the rendered one, they are the same page break
+                        line = []
+                        continue
+                    line = []
+                    pages.append({'page_number': len(pages) + 1, 'text': '', 'images': 0, 'charts': 0, 'vector_ops': 0})
+                elif element.tag == f"{w}t":
+                    line.append(element.text or '')
+                elif element.tag == f"{{{NAMESPACES['a']}}}graphicData":
+                    uri = element.get('uri', '')
+                    if 'chart' in uri or 'diagram' in uri:
+                        pages[-1]['charts'] += 1
+                    else:
+                        pages[-1]['images'] += 1
+            pages[-1]['text'] += "".join(line) + "\n"
+        return pages
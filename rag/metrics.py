@@ -0,0 +1,113 @@
+"""Prometheus metrics, timing spans and the per-query trace id.
+
+Every stage of ingestion and querying is timed with ``span(stage)``, which
+observes the ``ctrlf_stage_seconds`` histogram. While a query is being served
+the spans are also collected under its trace id (see ``start_trace``), so a
+slow request can be broken down stage by stage in the logs.
+"""
+from contextlib import contextmanager
+import contextvars
+import json
+import time
+import uuid
+
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events.llm import LLMChatStartEvent, LLMCompletionStartEvent
+from prometheus_client import Counter, Gauge, Histogram
+
+# spans last from milliseconds (routing, lexical lookups) to minutes (multimodal parsing)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "ctrlf_stage_seconds", "Duration of each ingestion and query stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+ENGINE_SECONDS = Histogram(
+    "ctrlf_engine_seconds", "Duration of the retrieve and synthesize phases of each query engine",
+    ["engine", "phase"], buckets=LATENCY_BUCKETS
+)
+QUERY_SECONDS = Histogram(
+    "ctrlf_query_seconds", "End-to-end duration of a query", ["endpoint", "cached"], buckets=LATENCY_BUCKETS
+)
+BYTES_DOWNLOADED = Counter("ctrlf_bytes_downloaded", "Bytes downloaded from Google Drive")
+PAGES_PARSED = Counter("ctrlf_pages_parsed", "Pages parsed, by parsing tier", ["tier"])
+TOKENS_EMBEDDED = Counter("ctrlf_tokens_embedded", "Tokens sent to the embedding API")
+LLM_CALLS = Counter("ctrlf_llm_calls", "LLM calls, by model", ["model"])
+CACHE_LOOKUPS = Counter("ctrlf_cache_lookups", "Cache lookups, by cache and result", ["cache", "result"])
+ROUTER_DECISIONS = Counter(
+    "ctrlf_router_decisions", "Query routing decisions, by router: memo (a recent decision), local or llm", ["router"]
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "ctrlf_scheduler_wait_seconds", "Time upstream calls waited for a scheduler slot", ["provider", "priority"],
+    buckets=LATENCY_BUCKETS
+)
+SCHEDULER_CONCURRENCY = Gauge(
+    "ctrlf_scheduler_concurrency", "Adaptive concurrency limit, by provider", ["provider"], multiprocess_mode="liveall"
+)
+RATE_LIMITED = Counter("ctrlf_rate_limited", "Upstream calls rejected for quota (HTTP 429), by provider", ["provider"])
+
+_trace = contextvars.ContextVar("ctrlf_trace", default=None)
+
+
+def start_trace(trace_id=None):
+    """
+    Start collecting the spans of the current request
+
+    Returns:
+        The trace id, a new one unless given
+    """
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace.set({"trace_id": trace_id, "spans": []})
+    return trace_id
+
+
+def current_trace_id():
+    trace = _trace.get()
+    return trace["trace_id"] if trace else None
+
+
+def trace_summary():
+    """Trace id and span durations of the current request, as a JSON line for the logs."""
+    trace = _trace.get()
+    if trace is None:
+        return None
+    return json.dumps(trace)
+
+
+@contextmanager
+def span(stage, histogram=None, **labels):
+    """Time a block, observing it in the stage histogram (or the given one) and in the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if histogram is None:
+            STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        else:
+            histogram.labels(**labels).observe(elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace["spans"].append({"stage": stage, **labels, "ms": round(elapsed * 1000, 2)})
+
+
+class _LLMCallCounter(BaseEventHandler):
+    """Counts every LLM call made through llama_index: routing, synthesis and summaries alike."""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMCallCounter"
+
+    def handle(self, event, **kwargs):
+        if isinstance(event, (LLMCompletionStartEvent, LLMChatStartEvent)):
+            LLM_CALLS.labels(model=event.model_dict.get("model", event.model_dict.get("model_name", "unknown"))).inc()
+
+
+_llm_counter_installed = False
+
+
+def install_llm_call_counter():
+    global _llm_counter_installed
+    if not _llm_counter_installed:
+        get_dispatcher().add_event_handler(_LLMCallCounter())
+        _llm_counter_installed = True
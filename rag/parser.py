@@ -1,32 +1,66 @@
 from llama_cloud_services import LlamaParse
-from llama_index.core import SimpleDirectoryReader
+from llama_index.core import Document, SimpleDirectoryReader
+from rag.cache import ParseCache
+from rag.concurrency import aiter_completed
+from rag.local_extractor import LocalExtractor
+from rag.metrics import span, PAGES_PARSED
+from rag.scheduler import get_scheduler
 from dotenv import load_dotenv
 import os
+import json
+import asyncio
 import time
 import tempfile
+import shutil
 
 class Parser:
     def __init__(self):
         load_dotenv()
         self.llama_cloud_api_key = os.getenv("LLAMA_CLOUD_API_KEY")
+        self.config = self._load_configs()
+        self.parser_config = self.config["parser"]
+        # Only the settings that change the parsed output are part of the cache key
+        self.cache_settings = {
+            key: self.parser_config[key]
+            for key in ("vendor_multimodal_model_name", "system_prompt_append", "result_type")
+        }
         self.parser = self._initialize_parser()
+        self.extractor = None
+        tiered_config = self.parser_config["tiered"]
+        if tiered_config["enabled"]:
+            # pages without visual content are extracted locally, only the others go to LlamaParse
+            self.extractor = LocalExtractor(
+                min_text_chars=tiered_config["min_text_chars"],
+                max_vector_ops=tiered_config["max_vector_ops"],
+            )
+            self.cache_settings["tiered"] = tiered_config
+        self.tier_stats = {"pages_local": 0, "pages_multimodal": 0}
+        cache_config = self.config["cache"]["parse"]
+        self.cache = ParseCache(cache_config["path"], cache_config["max_bytes"])
+
+    def _load_configs(self):
+        """Load parser settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
         
     def _initialize_parser(self):
         return LlamaParse(
             api_key=self.llama_cloud_api_key,
             use_vendor_multimodal_model=True,
-            vendor_multimodal_model_name="gemini-2.0-flash-001",
-            system_prompt_append="give me an exhaustive description of every chart. Include everything: layout, text, images, graphs, etc. You also need to give me an explanation of the slide: what is the overall message that is conveyed.",
-            result_type="markdown",
+            vendor_multimodal_model_name=self.parser_config["vendor_multimodal_model_name"],
+            system_prompt_append=self.parser_config["system_prompt_append"],
+            result_type=self.parser_config["result_type"],
             
         )
     
     def parse_document(self, file_path):
         file_extractor = {os.path.splitext(file_path)[1]: self.parser}
-        chunks = SimpleDirectoryReader(
+        reader = SimpleDirectoryReader(
             input_files=[file_path],
             file_extractor=file_extractor
-        ).load_data()
+        )
+        chunks = get_scheduler().call("llamaparse", reader.load_data)
         
         # Extraire et incrémenter le numéro de page à partir du doc_id
         for chunk in chunks:
@@ -66,19 +100,7 @@ class Parser:
     def preview_text(self, documents, preview_length=500):
         return documents[0].text[:preview_length]
     
-    def parse_bytes_io(self, data):
-        """
-        Parse a document from a BytesIO object
-        
-        Args:
-            data (dict): Dictionary containing 'content' (BytesIO) and 'metadata'
-        
-        Returns:
-            List of chunks from the parsed document
-        """
-        # Extract content and metadata
-        bytes_io_content = data['content']
-        cloud_metadata = data['metadata']
+    def _resolve_extension(self, cloud_metadata):
         file_name = cloud_metadata['file_name']
         file_type = cloud_metadata['file_type']
         
@@ -98,34 +120,110 @@ class Parser:
                 print(f"Warning: Unusual file extension '{file_extension}' for file '{file_name}'. Treating as PDF.")
                 file_extension = '.pdf'
                 temp_file_name = f"{os.path.splitext(file_name)[0]}.pdf"
+        return file_extension, temp_file_name
+
+    def _prepare_file(self, data, file_extension, temp_file_name):
+        """Return a file on disk for this job, private to it so that files sharing a name never collide."""
+        if 'path' in data:
+            # Spooled file: parse it in place, only renaming it if the extension needs fixing
+            temp_file_path = data['path']
+            if not temp_file_path.endswith(file_extension):
+                renamed_path = os.path.splitext(temp_file_path)[0] + file_extension
+                os.replace(temp_file_path, renamed_path)
+                temp_file_path = renamed_path
+            return temp_file_path
+
+        # Keep the original file name, inside a directory unique to this job
+        temp_file_path = os.path.join(tempfile.mkdtemp(prefix='ctrlf-'), temp_file_name)
+        # Write content to the temporary file, streaming it instead of copying it with .read()
+        bytes_io_content = data['content']
+        with open(temp_file_path, 'wb') as temp_file:
+            bytes_io_content.seek(0)  # Ensure we're at the start of the BytesIO
+            shutil.copyfileobj(bytes_io_content, temp_file)
+        return temp_file_path
+
+    def _cleanup_file(self, data, temp_file_path):
+        # Clean up the temporary file
+        try:
+            if temp_file_path and os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            if temp_file_path and 'path' not in data:
+                os.rmdir(os.path.dirname(temp_file_path))
+        except Exception as e:
+            print(f"Warning: Could not remove temporary file {temp_file_path}: {e}")
+
+    def _from_cache(self, cache_key, cloud_metadata):
+        # Byte-identical files (copies, moves, renames, re-runs) are served from the parse cache
+        pages = self.cache.get_pages(cache_key)
+        if pages is None:
+            return None
+        chunks = [
+            Document(
+                id_=f"{cloud_metadata['file_id']}_part_{page['page_number'] - 1}",
+                text=page['text'],
+                metadata={**cloud_metadata, 'page_number': page['page_number']}
+            )
+            for page in pages
+        ]
+        print(f"Parse cache hit for document {cloud_metadata['file_name']} ({len(chunks)} pages)")
+        return chunks
+
+    def _to_cache(self, cache_key, chunks):
+        if chunks:
+            self.cache.set_pages(cache_key, [
+                {'page_number': chunk.metadata['page_number'], 'text': chunk.text} for chunk in chunks
+            ])
+
+    def parse_bytes_io(self, data):
+        """
+        Parse a document from a BytesIO object or a spooled file
         
-        temp_dir = tempfile.gettempdir()
-        temp_file_path = os.path.join(temp_dir, temp_file_name)
+        Args:
+            data (dict): Dictionary containing 'metadata' and either 'content' (BytesIO)
+                or 'path' (file spooled on disk by the connecter, removed once parsed)
+        
+        Returns:
+            List of chunks from the parsed document
+        """
+        # Extract content and metadata
+        cloud_metadata = data['metadata']
+        file_name = cloud_metadata['file_name']
+        file_type = cloud_metadata['file_type']
+        file_extension, temp_file_name = self._resolve_extension(cloud_metadata)
         
+        temp_file_path = None
         try:
-            # Write content to the temporary file
-            with open(temp_file_path, 'wb') as temp_file:
-                bytes_io_content.seek(0)  # Ensure we're at the start of the BytesIO
-                temp_file.write(bytes_io_content.read())
+            temp_file_path = self._prepare_file(data, file_extension, temp_file_name)
             
+            cache_key = self.cache.key_for(temp_file_path, self.cache_settings)
+            chunks = self._from_cache(cache_key, cloud_metadata)
+            if chunks is not None:
+                return chunks
+
             # Parse the temporary file
             file_extractor = {file_extension: self.parser}
 
-            chunks = SimpleDirectoryReader(
+            reader = SimpleDirectoryReader(
                 input_files=[temp_file_path],
                 file_extractor=file_extractor,
                 filename_as_id=True
-            ).load_data()
+            )
+            chunks = get_scheduler().call("llamaparse", reader.load_data)
             
             # Extract and increment page number from doc_id
             for chunk in chunks:
+                # Copy the metadata so pages don't share (and overwrite) a single page_number
+                chunk.metadata = dict(cloud_metadata)
                 try:
                     page_str = chunk.doc_id.split('_')[-1]
-                    chunk.metadata = cloud_metadata
                     chunk.metadata['page_number'] = int(page_str) + 1
+                    # The temp file path in the doc_id changes on every run, key it on the Drive file instead
+                    chunk.id_ = f"{cloud_metadata['file_id']}_part_{page_str}"
                 except (ValueError, IndexError):
                     print(f"Warning: Could not extract page number from doc_id: {chunk.doc_id}")
                     chunk.metadata['page_number'] = 0
+
+            self._to_cache(cache_key, chunks)
             
             print(f"Parsed {len(chunks)} chunks for document {file_name}")
             
@@ -135,13 +233,111 @@ class Parser:
             # Return an empty list instead of failing completely
             return []
         finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except Exception as e:
-                    print(f"Warning: Could not remove temporary file {temp_file_path}: {e}")
+            self._cleanup_file(data, temp_file_path)
+
+    async def aparse_bytes_io(self, data):
+        """
+        Async counterpart of parse_bytes_io, submitting the file through LlamaParse's async API
+
+        Returns:
+            List of chunks from the parsed document, empty if parsing failed
+        """
+        with span("parse"):
+            return await self._aparse_bytes_io(data)
+
+    async def _aparse_bytes_io(self, data):
+        cloud_metadata = data['metadata']
+        file_name = cloud_metadata['file_name']
+        file_extension, temp_file_name = self._resolve_extension(cloud_metadata)
+
+        temp_file_path = None
+        try:
+            # Writing and hashing the file are blocking, keep them off the event loop
+            temp_file_path = await asyncio.to_thread(self._prepare_file, data, file_extension, temp_file_name)
+            cache_key = await asyncio.to_thread(self.cache.key_for, temp_file_path, self.cache_settings)
+            chunks = self._from_cache(cache_key, cloud_metadata)
+            if chunks is not None:
+                return chunks
+
+            chunks = None
+            if self.extractor and self.extractor.supports(file_extension):
+                chunks = await self._aparse_tiered(temp_file_path, file_extension, cloud_metadata)
+            if chunks is None:
+                # LlamaParse splits the result by page, in page order
+                chunks = await get_scheduler().acall("llamaparse", self.parser.aload_data, temp_file_path)
+                for page_index, chunk in enumerate(chunks):
+                    chunk.id_ = f"{cloud_metadata['file_id']}_part_{page_index}"
+                    chunk.metadata = {**cloud_metadata, 'page_number': page_index + 1}
+                self.tier_stats["pages_multimodal"] += len(chunks)
+                PAGES_PARSED.labels(tier="multimodal").inc(len(chunks))
+
+            self._to_cache(cache_key, chunks)
+            print(f"Parsed {len(chunks)} chunks for document {file_name}")
+            return chunks
+        except Exception as e:
+            print(f"Error parsing file '{file_name}' with type '{cloud_metadata['file_type']}': {e}")
+            return []
+        finally:
+            self._cleanup_file(data, temp_file_path)
+
+    async def _aparse_tiered(self, file_path, file_extension, cloud_metadata):
+        """
+        Extract text locally, sending only the pages with visual content (or too little text) to LlamaParse
 
+        Returns:
+            Page documents merged in page order, or None when the whole file should go to LlamaParse
+        """
+        try:
+            pages = await asyncio.to_thread(self.extractor.extract, file_path, file_extension)
+        except Exception as e:
+            print(f"Warning: Local extraction failed for '{cloud_metadata['file_name']}', parsing it with LlamaParse: {e}")
+            return None
+        escalated = [page['page_number'] for page in pages if self.extractor.needs_multimodal(page)]
+        if not pages or (escalated and file_extension == '.docx'):
+            # docx page breaks need not match the pages LlamaParse renders, so target_pages can't address them
+            return None
+
+        texts = {}
+        if escalated:
+            parser = self.parser.model_copy(update={"target_pages": ",".join(str(n - 1) for n in escalated)})
+            parsed = await get_scheduler().acall("llamaparse", parser.aload_data, file_path)
+            if len(parsed) != len(escalated):
+                print(f"Warning: LlamaParse returned {len(parsed)} of {len(escalated)} target pages for '{cloud_metadata['file_name']}', parsing the whole file")
+                return None
+            texts = {page_number: document.text for page_number, document in zip(escalated, parsed)}
+
+        self.tier_stats["pages_local"] += len(pages) - len(escalated)
+        self.tier_stats["pages_multimodal"] += len(escalated)
+        PAGES_PARSED.labels(tier="local").inc(len(pages) - len(escalated))
+        PAGES_PARSED.labels(tier="multimodal").inc(len(escalated))
+        return [
+            Document(
+                id_=f"{cloud_metadata['file_id']}_part_{page['page_number'] - 1}",
+                text=texts.get(page['page_number'], page['text']),
+                metadata={**cloud_metadata, 'page_number': page['page_number']}
+            )
+            for page in pages
+        ]
+
+    async def aparse_many(self, datas, max_in_flight=None):
+        """
+        Parse many downloaded files concurrently
+
+        Args:
+            datas (iterable): File data dicts as produced by the connecter. A plain (possibly
+                blocking) iterator is fine, it is consumed lazily off the event loop.
+            max_in_flight (int): Maximum number of concurrent LlamaParse jobs, defaults to
+                the configured parser max_in_flight
+
+        Yields:
+            (metadata, chunks) tuples, in the order the parses finish
+        """
+        max_in_flight = max_in_flight or self.parser_config["max_in_flight"]
+        # a finished parse is yielded at once, even while the next download is still awaited
+        async for metadata, task in aiter_completed(
+            datas, lambda data: (self.aparse_bytes_io(data), data['metadata']), max_in_flight
+        ):
+            yield metadata, task.result()
 
 if __name__ == "__main__":
     from connector.connector import GoogleDriveConnector
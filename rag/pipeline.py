@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class IngestionPipeline:
+    """Streaming Drive ingestion: list -> download -> parse -> summarize -> embed/upsert.
+
+    Each stage runs on its own thread and hands its output to the next one
+    through a bounded queue, so a slow stage applies backpressure upstream
+    instead of letting work pile up in memory. Chunks are embedded and
+    upserted in batches as they arrive, which makes documents queryable
+    progressively while the rest of the drive is still being processed.
+
+    Stage concurrency comes from the components: ``download.max_workers`` in
+    the connecter config and ``parser.max_in_flight`` in the rag config. The
+    ``ingestion`` section sets the queue size, the indexing batch size and
+    ``flush_seconds``, the longest a parsed file waits for its batch to fill.
+    The summarize stage only runs when a summarizer is given, with
+    ``summaries.max_in_flight`` concurrent LLM calls. With a deduplicator,
+    near-duplicate pages are stored once, under the page that cites them all.
+    """
+
+    def __init__(self, connecter, parser, indexer, manifest, on_change=None, summarizer=None, deduplicator=None):
+        self.connecter = connecter
+        self.parser = parser
+        self.summarizer = summarizer
+        self.deduplicator = deduplicator
+        self.indexer = indexer
+        self.manifest = manifest
+        # Called with the ids of files whose vectors were (re)written or deleted
+        self.on_change = on_change
+        self.config = self._load_configs()["ingestion"]
+
+        self.progress = {
+            "files_listed": 0,
+            "files_changed": 0,
+            "files_downloaded": 0,
+            "files_parsed": 0,
+            "files_summarized": 0,
+            "files_failed": 0,
+            "files_indexed": 0,
+            "files_deleted": 0,
+            "chunks_indexed": 0,
+            "pages_deduplicated": 0,
+        }
+        self._listed_files = {}
+        self._listing_complete = False
+        self._full = False
+        self._errors = []
+        self._stop = threading.Event()
+
+    @property
+    def listing_complete(self):
+        return self._listing_complete
+
+    def _load_configs(self):
+        """Load pipeline settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    def _put(self, q, item):
+        # Wait for room in the queue, giving up if another stage failed
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _drain(self, q, idle=False):
+        # With idle, None is yielded whenever nothing arrived for 0.1s
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if idle:
+                    yield None
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _run_stage(self, target, out_queue):
+        try:
+            target()
+        except Exception as e:
+            print(f"Error in ingestion stage {target.__name__}: {e}")
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._put(out_queue, _DONE)
+
+    def _list_stage(self, full, download_queue):
+        def list_files():
+            for file in self.connecter.iter_files():
+                self._listed_files[file['id']] = file
+                self.progress["files_listed"] += 1
+                if full or self.manifest.is_changed(file):
+                    self.progress["files_changed"] += 1
+                    self._put(download_queue, file)
+            self._listing_complete = True
+        return list_files
+
+    def _download_stage(self, download_queue, parse_queue):
+        def on_error(metadata, error):
+            # left out of the manifest so the next sync retries it, and counted so the ETA converges
+            self.progress["files_failed"] += 1
+
+        def download_files():
+            for data in self.connecter.download_files(self._drain(download_queue), on_error=on_error):
+                self.progress["files_downloaded"] += 1
+                self._put(parse_queue, data)
+        return download_files
+
+    def _parse_stage(self, parse_queue, index_queue):
+        async def parse_files():
+            async for metadata, chunks in self.parser.aparse_many(self._drain(parse_queue)):
+                self.progress["files_parsed"] += 1
+                item = (metadata, chunks) if self.summarizer else (metadata, chunks, [])
+                await asyncio.to_thread(self._put, index_queue, item)
+        return self._in_event_loop(parse_files)
+
+    def _summarize_stage(self, summary_queue, index_queue):
+        async def summarize_files():
+            async for metadata, chunks, summaries in self.summarizer.asummarize_many(self._drain(summary_queue)):
+                if summaries:
+                    self.progress["files_summarized"] += 1
+                await asyncio.to_thread(self._put, index_queue, (metadata, chunks, summaries))
+        return self._in_event_loop(summarize_files)
+
+    def _in_event_loop(self, coroutine_function):
+        def run():
+            # A fresh loop for this thread, asyncio.run is patched by nest_asyncio in the app
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(coroutine_function())
+            finally:
+                loop.close()
+        run.__name__ = coroutine_function.__name__
+        return run
+
+    def _flush(self, batch):
+        documents = [chunk for _, chunks, _ in batch for chunk in chunks]
+        summaries = [summary for _, _, summaries in batch for summary in summaries]
+        if self.deduplicator:
+            # Duplicate pages are left out, the canonical page of their cluster is (re)written with them as sources
+            documents, duplicates = self.deduplicator.update([(metadata['file_id'], chunks) for metadata, chunks, _ in batch])
+            summaries = [
+                summary for summary in summaries
+                if (summary.metadata['file_id'], summary.metadata.get('page_number')) not in duplicates
+            ]
+            self.progress["pages_deduplicated"] += len(duplicates)
+        # Summaries go first, upserting the chunks prunes whatever an older version of the file left behind
+        self.indexer.upsert_summaries(summaries)
+        # Files indexed by an earlier sync are replaced: overwritten in place, then pruned of stale chunks
+        replace_file_ids = [metadata['file_id'] for metadata, _, _ in batch if metadata['file_id'] in self.manifest]
+        nodes = self.indexer.upsert_documents(documents, replace_file_ids=replace_file_ids)
+        indexed_file_ids = {node.metadata['file_id'] for node in nodes}
+        for metadata, _, _ in batch:
+            if metadata['file_id'] in replace_file_ids and metadata['file_id'] not in indexed_file_ids:
+                # every page of the new version is a duplicate, nothing overwrote the old one
+                self.indexer.delete_stale(metadata['file_id'], metadata.get('last_modified_date'))
+            self.manifest.update(self._listed_files[metadata['file_id']])
+        self.manifest.save()
+        self.progress["files_indexed"] += len(batch)
+        self.progress["chunks_indexed"] += len(nodes)
+        self._notify_change(list({metadata['file_id'] for metadata, _, _ in batch} | indexed_file_ids))
+
+    def _notify_change(self, file_ids):
+        if self.on_change and file_ids:
+            self.on_change(file_ids)
+
+    def _index_stage(self, index_queue):
+        batch = []
+        batch_chunks = 0
+        batch_started = None
+        for item in self._drain(index_queue, idle=True):
+            if item is not None:
+                metadata, chunks, summaries = item
+                if not chunks:
+                    # leave it out of the manifest so the next sync retries it
+                    self.progress["files_failed"] += 1
+                    continue
+                if self._full:
+                    # A full re-ingest starts each file from a clean slate, whatever was stored before
+                    self.indexer.delete_file(metadata['file_id'])
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append((metadata, chunks, summaries))
+                batch_chunks += len(chunks)
+            # A small change set is made queryable after flush_seconds instead of at the end of the run
+            if batch and (
+                batch_chunks >= self.config["index_batch_size"]
+                or time.monotonic() - batch_started >= self.config["flush_seconds"]
+            ):
+                self._flush(batch)
+                batch = []
+                batch_chunks = 0
+        if batch:
+            self._flush(batch)
+
+    def _delete_removed_files(self):
+        # diff does not trust an empty listing to report deletions
+        _, removed = self.manifest.diff(list(self._listed_files.values()))
+        for file_id in removed:
+            self.indexer.delete_file(file_id)
+            self.manifest.remove(file_id)
+            self.progress["files_deleted"] += 1
+        self.manifest.save()
+        if self.deduplicator and removed:
+            # Pages the deleted files shared with others are now cited (or stored) without them
+            documents = self.deduplicator.remove_files(removed)
+            if documents:
+                nodes = self.indexer.upsert_documents(documents)
+                removed = list(set(removed) | {node.metadata['file_id'] for node in nodes})
+        self._notify_change(removed)
+
+    def run(self, full=False):
+        """
+        Run a sync of the drive through the pipeline
+
+        Args:
+            full (bool): Re-ingest every file instead of only new or changed ones
+
+        Returns:
+            Progress counters of the run
+        """
+        self._full = full
+        queue_size = self.config["queue_size"]
+        download_queue = queue.Queue(maxsize=queue_size)
+        parse_queue = queue.Queue(maxsize=queue_size)
+        index_queue = queue.Queue(maxsize=queue_size)
+
+        stages = [
+            (self._list_stage(full, download_queue), download_queue),
+            (self._download_stage(download_queue, parse_queue), parse_queue),
+        ]
+        if self.summarizer:
+            summary_queue = queue.Queue(maxsize=queue_size)
+            stages.append((self._parse_stage(parse_queue, summary_queue), summary_queue))
+            stages.append((self._summarize_stage(summary_queue, index_queue), index_queue))
+        else:
+            stages.append((self._parse_stage(parse_queue, index_queue), index_queue))
+        threads = [
+            threading.Thread(target=self._run_stage, args=stage, daemon=True)
+            for stage in stages
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            self._index_stage(index_queue)
+        except Exception as e:
+            self._errors.append(e)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        # Only a complete listing tells which files were removed from the drive
+        if self._listing_complete:
+            self._delete_removed_files()
+        return dict(self.progress)
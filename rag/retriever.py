@@ -3,18 +3,19 @@ from llama_index.core.bridge.pydantic import BaseModel
 from llama_index.core.query_engine import (
     BaseQueryEngine
 )
-from llama_index.core import PromptTemplate
-from llama_index.llms.gemini import Gemini
+from llama_index.core import PromptTemplate, QueryBundle
 from llama_index.core.llms import LLM
 from llama_index.core.response_synthesizers import TreeSummarize
 from llama_index.core.workflow import (
     Workflow,
+    Context,
     Event,
     StartEvent,
     StopEvent,
     step,
 )
-import os, json
+from rag.metrics import span, ENGINE_SECONDS, ROUTER_DECISIONS
+import os, json, asyncio
 
 class Answer(BaseModel):
     """Answer model."""
@@ -32,12 +33,28 @@ class ChooseQueryEngineEvent(Event):
 
     answers: Answers
     query_str: str
+    query_embedding: Optional[List[float]] = None
+    stream: bool = False
 
 class SynthesizeAnswersEvent(Event):
     """Synthesize answers event."""
 
     responses: List[Any]
     query_str: str
+    documents: List[Any]
+    experts: List[Any]
+    stream: bool = False
+
+class SourcesEvent(Event):
+    """Retrieved documents and experts, streamed as soon as retrieval completes."""
+
+    documents: List[Any]
+    experts: List[Any]
+
+class TokenEvent(Event):
+    """Token of the synthesized answer, streamed as it is generated."""
+
+    delta: str
 
 class RouterQueryWorkflow(Workflow):
     """Router query workflow."""
@@ -48,10 +65,14 @@ class RouterQueryWorkflow(Workflow):
         choice_descriptions: Optional[List[str]] = None,
         router_prompt: Optional[PromptTemplate] = None,
         timeout: Optional[float] = 10.0,
+        engine_timeout: Optional[float] = 30.0,
         disable_validation: bool = False,
         verbose: bool = False,
         llm: Optional[LLM] = None,
         summarizer: Optional[TreeSummarize] = None,
+        streaming_summarizer: Optional[TreeSummarize] = None,
+        router: Optional[Any] = None,
+        engine_names: Optional[List[str]] = None,
     ):
         """Constructor"""
 
@@ -73,12 +94,22 @@ class RouterQueryWorkflow(Workflow):
         
         # Store query engines
         self.query_engines = query_engines
+        self.engine_timeout = engine_timeout
+        # labels of the engines in the metrics
+        self.engine_names = engine_names or [f"engine_{idx + 1}" for idx in range(len(query_engines))]
         
         # Use provided values or defaults
         self.router_prompt = router_prompt or self._default_router_prompt
         self.choice_descriptions = choice_descriptions or [self._default_tool_doc_desc, self._default_tool_chunk_desc]
-        self.llm = llm or Gemini(temperature=0, model="gemini-2.0-flash-001")
-        self.summarizer = summarizer or TreeSummarize()
+        if llm is None:
+            from rag.scheduler import ScheduledGemini
+            llm = ScheduledGemini(temperature=0, model="gemini-2.0-flash-001")
+        self.llm = llm
+        # synthesis uses the workflow's LLM, so its calls are scheduled with the routing ones
+        self.summarizer = summarizer or TreeSummarize(llm=self.llm)
+        self.streaming_summarizer = streaming_summarizer or TreeSummarize(llm=self.llm, streaming=True)
+        # Optional local router (see rag.router.EmbeddingRouter), the LLM only decides low-confidence queries
+        self.router = router
 
 
     def _load_configs(self):
@@ -93,22 +124,26 @@ class RouterQueryWorkflow(Workflow):
         choices_str = "\n\n".join([f"{idx+1}. {c}" for idx, c in enumerate(choices)])
         return choices_str
 
-    async def _query(self, query_str: str, choice_idx: int):
+    async def _query(self, query_str: str, choice_idx: int, query_embedding: Optional[List[float]] = None):
         """Query using query engine"""
 
         query_engine = self.query_engines[choice_idx]
-        response = await query_engine.aquery(query_str)
-        return response
+        engine = self.engine_names[choice_idx]
+        if not hasattr(query_engine, "aretrieve"):
+            with span("engine", ENGINE_SECONDS, engine=engine, phase="query"):
+                return await query_engine.aquery(query_str)
 
+        # retrieval and synthesis are timed apart, to tell slow lookups from slow LLM calls
+        # the embedding computed by the caller is reused by the retrievers instead of embedding the query again
+        query_bundle = QueryBundle(query_str, embedding=query_embedding)
+        with span("retrieve", ENGINE_SECONDS, engine=engine, phase="retrieve"):
+            nodes = await query_engine.aretrieve(query_bundle)
+        with span("engine_synthesize", ENGINE_SECONDS, engine=engine, phase="synthesize"):
+            return await query_engine.asynthesize(query_bundle, nodes)
 
-    @step()
-    async def choose_query_engine(self, ev: StartEvent) -> ChooseQueryEngineEvent:
-        """Choose query engine."""
 
-        # get query str
-        query_str = ev.get("query_str")
-        if query_str is None:
-            raise ValueError("'query_str' is required.")
+    async def _llm_route(self, query_str: str) -> Answers:
+        """Choose query engines with the LLM router."""
 
         # partially format prompt with number of choices and max outputs
         router_prompt1 = self.router_prompt.partial_format(
@@ -118,50 +153,84 @@ class RouterQueryWorkflow(Workflow):
 
         # get choices selected by LLM
         choices_str = self._get_choice_str(self.choice_descriptions)
-        output = self.llm.structured_predict(
+        return await self.llm.astructured_predict(
             Answers,
             router_prompt1,
             context_list=choices_str,
             query_str=query_str
         )
 
+    @step()
+    async def choose_query_engine(self, ev: StartEvent) -> ChooseQueryEngineEvent:
+        """Choose query engine."""
+
+        # get query str
+        query_str = ev.get("query_str")
+        if query_str is None:
+            raise ValueError("'query_str' is required.")
+
+        query_embedding = ev.get("query_embedding")
+        with span("route"):
+            # a recent decision is reused, then the local router answers most queries without an LLM round-trip
+            output = self.router.lookup(query_str) if self.router else None
+            if output is not None:
+                ROUTER_DECISIONS.labels(router="memo").inc()
+            else:
+                output = self.router.route(query_str, query_embedding) if self.router else None
+                ROUTER_DECISIONS.labels(router="local" if output is not None else "llm").inc()
+                if output is None:
+                    output = await self._llm_route(query_str)
+                if self.router:
+                    self.router.remember(query_str, output)
+
         if self._verbose:
             print(f"Selected choice(s):")
             for answer in output.answers:
                 print(f"Choice: {answer.choice}, Reason: {answer.reason}")
 
-        return ChooseQueryEngineEvent(answers=output, query_str=query_str)
+        return ChooseQueryEngineEvent(
+            answers=output, query_str=query_str, query_embedding=query_embedding, stream=bool(ev.get("stream", False))
+        )
 
     @step()
-    async def query_each_engine(self, ev: ChooseQueryEngineEvent) -> SynthesizeAnswersEvent:
+    async def query_each_engine(self, ctx: Context, ev: ChooseQueryEngineEvent) -> SynthesizeAnswersEvent:
         """Query each engine."""
 
         query_str = ev.query_str
         answers = ev.answers
 
-        # query using corresponding query engine given in Answers list
-        responses = []
-
-        for answer in answers.answers:
-            choice_idx = answer.choice - 1
-            response = await self._query(query_str, choice_idx)
-            responses.append(response)
-        
-        return SynthesizeAnswersEvent(responses=responses, query_str=query_str)
-
-    @step()
-    async def synthesize_response(self, ev: SynthesizeAnswersEvent) -> StopEvent:
-        """Synthesizes response."""
-        responses = ev.responses
-        query_str = ev.query_str
+        # query the selected engines concurrently, each bounded by engine_timeout
+        choice_idxs = list(dict.fromkeys(answer.choice - 1 for answer in answers.answers))
+        results = await asyncio.gather(
+            *(asyncio.wait_for(self._query(query_str, idx, ev.query_embedding), self.engine_timeout) for idx in choice_idxs),
+            return_exceptions=True
+        )
 
+        responses = []
+        for choice_idx, result in zip(choice_idxs, results):
+            if isinstance(result, BaseException):
+                reason = "timed out" if isinstance(result, asyncio.TimeoutError) else f"failed: {result}"
+                print(f"Warning: Query engine {choice_idx + 1} {reason}")
+                continue
+            responses.append(result)
+        if not responses:
+            raise RuntimeError("All selected query engines failed or timed out.")
+
+        # sources are known as soon as retrieval is done, stream them before synthesis starts
+        documents, experts = self._extract_sources(responses)
+        if ev.stream:
+            ctx.write_event_to_stream(SourcesEvent(documents=documents, experts=experts))
         
-        response_strs = [str(r) for r in responses]
-        text = self.summarizer.get_response(
-            query_str, 
-            response_strs,
-            include_metadata=True
+        return SynthesizeAnswersEvent(
+            responses=responses,
+            query_str=query_str,
+            documents=documents,
+            experts=experts,
+            stream=ev.stream
         )
+
+    def _extract_sources(self, responses):
+        """Documents and experts cited by the source nodes of the responses."""
         # Extract documents from source nodes
         documents = []
         experts_map = {}  # Use a dictionary to track experts by email
@@ -172,42 +241,79 @@ class RouterQueryWorkflow(Workflow):
                     if hasattr(source_node, 'node'):
                         node = source_node.node
                         score = source_node.score
-                        print(f"Score: {score}")
                         if score < 0.2:  # Your relevance threshold
                             if hasattr(node, 'metadata'):
-                                metadata = node.metadata
-                                doc = {
-                                    "title": metadata.get("file_name", "Untitled"),
-                                    "url": metadata.get("url", ""),
-                                    "page": metadata.get("page_number", "")
-                                }
-                                documents.append(doc)
+                                # A page stored once for its near-duplicates cites every file and page it appears in
+                                for metadata in node.metadata.get("sources") or [node.metadata]:
+                                    doc = {
+                                        "file_id": metadata.get("file_id", ""),
+                                        "title": metadata.get("file_name", "Untitled"),
+                                        "url": metadata.get("url", ""),
+                                        "page": metadata.get("page_number", "")
+                                    }
+                                    documents.append(doc)
                                 
-                                # Process experts and associate them with documents
-                                expert_list = metadata.get("experts", [])
-                                for expert in expert_list:
-                                    name = expert.get("name")
-                                    if name not in experts_map:
-                                        # Create new expert entry with documents list
-                                        experts_map[name] = {
-                                            "name": name,
-                                            "email": expert.get("email", ""),
-                                            "image": expert.get("image", ""),
-                                            "documents": [doc["title"]]
-                                        }
-                                    else:
-                                        # Add document to existing expert if not already there
-                                        if doc["title"] not in experts_map[name]["documents"]:
-                                            experts_map[name]["documents"].append(doc["title"])
+                                    # Process experts and associate them with documents
+                                    expert_list = metadata.get("experts", [])
+                                    for expert in expert_list:
+                                        name = expert.get("name")
+                                        if name not in experts_map:
+                                            # Create new expert entry with documents list
+                                            experts_map[name] = {
+                                                "name": name,
+                                                "email": expert.get("email", ""),
+                                                "image": expert.get("image", ""),
+                                                "documents": [doc["title"]]
+                                            }
+                                        else:
+                                            # Add document to existing expert if not already there
+                                            if doc["title"] not in experts_map[name]["documents"]:
+                                                experts_map[name]["documents"].append(doc["title"])
         
         # Convert experts map to list
         experts = list(experts_map.values())
+        return documents, experts
+
+    async def _stream_response(self, ctx: Context, query_str: str, response_strs: List[str]) -> str:
+        """Synthesize with the streaming summarizer, writing each token to the event stream."""
+        response = await self.streaming_summarizer.aget_response(
+            query_str,
+            response_strs,
+            include_metadata=True
+        )
+        if isinstance(response, str):
+            ctx.write_event_to_stream(TokenEvent(delta=response))
+            return response
+
+        tokens = []
+        async for token in response:
+            tokens.append(token)
+            ctx.write_event_to_stream(TokenEvent(delta=token))
+        return "".join(tokens)
+
+    @step()
+    async def synthesize_response(self, ctx: Context, ev: SynthesizeAnswersEvent) -> StopEvent:
+        """Synthesizes response."""
+        responses = ev.responses
+        query_str = ev.query_str
+
+        
+        response_strs = [str(r) for r in responses]
+        with span("synthesize"):
+            if ev.stream:
+                text = await self._stream_response(ctx, query_str, response_strs)
+            else:
+                text = await self.summarizer.aget_response(
+                    query_str, 
+                    response_strs,
+                    include_metadata=True
+                )
     
         # Return formatted response
         message = {
             "text": text,
-            "documents": documents,
-            "experts": experts
+            "documents": ev.documents,
+            "experts": ev.experts
         }
         
         return StopEvent(result=message)
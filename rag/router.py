@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from rag.retriever import Answer, Answers
+
+
+class EmbeddingRouter:
+    """Routes a query between query engines by embedding similarity, without an LLM call.
+
+    Each choice is represented by its tool description and optional labeled
+    example queries, embedded once with the configured embedding model (the
+    indexer's embed_texts, so they are served from the embedding cache on
+    later starts). A query goes to the choice holding its most similar
+    reference, compared with the query embedding computed for retrieval;
+    when the best two choices are closer than ``min_margin`` the decision is
+    considered low confidence and ``route`` returns None so the caller can
+    fall back to the LLM router. Decisions, whichever router made them, are
+    memoized in an LRU keyed by the normalized query, see lookup and remember.
+    """
+
+    def __init__(self, choice_descriptions, embed_fn, examples=None, min_margin=0.05, cache_size=1024):
+        # embed_fn takes a list of texts and returns their embeddings
+        self.embed_fn = embed_fn
+        self.min_margin = min_margin
+        self.cache_size = cache_size
+        self._memo = OrderedDict()
+
+        texts = []
+        labels = []
+        for idx, description in enumerate(choice_descriptions):
+            for text in [description] + list((examples or {}).get(idx, [])):
+                texts.append(text)
+                labels.append(idx)
+        self.num_choices = len(choice_descriptions)
+        self.references = np.stack([self._normalize(embedding) for embedding in self.embed_fn(texts)])
+        self.labels = np.array(labels)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _key(self, query_str):
+        return " ".join(query_str.lower().split())
+
+    def scores(self, query_str, embedding=None):
+        """Best cosine similarity of the query to each choice's references."""
+        if embedding is None:
+            embedding = self.embed_fn([query_str])[0]
+        similarities = self.references @ self._normalize(embedding)
+        scores = np.full(self.num_choices, -np.inf)
+        np.maximum.at(scores, self.labels, similarities)
+        return scores
+
+    def lookup(self, query_str):
+        """The memoized decision for the query, None if it was not routed recently."""
+        key = self._key(query_str)
+        if key not in self._memo:
+            return None
+        self._memo.move_to_end(key)
+        return self._memo[key]
+
+    def route(self, query_str, embedding=None):
+        """
+        Choose a query engine locally
+
+        Args:
+            query_str (str): The query
+            embedding (list): Its embedding, computed with embed_fn when not given
+
+        Returns:
+            Answers with a single choice, or None when the decision is low confidence
+        """
+        scores = self.scores(query_str, embedding)
+        ranked = np.argsort(scores)[::-1]
+        margin = scores[ranked[0]] - scores[ranked[1]] if self.num_choices > 1 else np.inf
+        if margin < self.min_margin:
+            return None
+        return Answers(answers=[Answer(
+            choice=int(ranked[0]) + 1,
+            reason=f"Local router: similarity {scores[ranked[0]]:.2f}, margin {margin:.2f}"
+        )])
+
+    def remember(self, query_str, answers):
+        self._memo[self._key(query_str)] = answers
+        self._memo.move_to_end(self._key(query_str))
+        while len(self._memo) > self.cache_size:
+            self._memo.popitem(last=False)
@@ -0,0 +1,490 @@
+"""Process-wide scheduler for every upstream model call.
+
+LlamaParse jobs, OpenAI embeddings and Gemini completions all draw on
+provider quotas shared by the whole process. Each provider gets a limiter
+with token buckets for its requests and tokens per minute and an adaptive
+concurrency limit (AIMD: it grows by one slot per round of successful calls
+and halves on a 429, pausing the provider for a cooldown). Waiting calls are
+granted in priority order, and background ingestion keeps
+``interactive_reserve`` slots free, so a user's query never queues behind a
+bulk sync.
+
+The priority is a context variable: requests served by the API run as
+INTERACTIVE, everything else (the ingestion threads) as BACKGROUND.
+"""
+from contextlib import contextmanager
+import asyncio
+import contextvars
+import heapq
+import inspect
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from typing import ClassVar
+
+from rag.metrics import RATE_LIMITED, SCHEDULER_CONCURRENCY, SCHEDULER_WAIT_SECONDS
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority = contextvars.ContextVar("ctrlf_priority", default=BACKGROUND)
+# providers whose slot the current call already holds, so nested calls (chat built on complete) don't queue twice
+_held = contextvars.ContextVar("ctrlf_held_providers", default=frozenset())
+
+
+def set_priority(priority):
+    """Mark the calls made from the current context (and the tasks it starts) as INTERACTIVE or BACKGROUND."""
+    _priority.set(priority)
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_rate_limited(error):
+    """Whether an upstream error is a quota rejection, whichever client raised it."""
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if status == 429:
+            return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "resource exhausted" in message or "resource_exhausted" in message
+
+
+def estimate_tokens(text):
+    # about four characters per token, close enough for budgeting against a per-minute quota
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Refills at rate_per_minute, holding at most burst_seconds worth of it."""
+
+    def __init__(self, rate_per_minute, burst_seconds):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available, 0 if it is now. Requests larger than the bucket wait for a full one."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class _Waiter:
+    def __init__(self, priority, tokens, notify):
+        self.priority = priority
+        self.tokens = tokens
+        self.notify = notify
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+
+class ProviderLimiter:
+    """Rate and concurrency limits of one provider, shared by threads and event loops alike."""
+
+    def __init__(self, name, config, interactive_reserve=1, burst_seconds=10):
+        self.name = name
+        self.min_concurrency = config["min_concurrency"]
+        self.max_concurrency = config["max_concurrency"]
+        self.concurrency = float(config["initial_concurrency"])
+        self.cooldown_seconds = config["cooldown_seconds"]
+        self.interactive_reserve = interactive_reserve
+        self.requests = TokenBucket(config["rpm"], burst_seconds) if config.get("rpm") else None
+        self.tokens = TokenBucket(config["tpm"], burst_seconds) if config.get("tpm") else None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_deadline = None
+        SCHEDULER_CONCURRENCY.labels(provider=name).set(self.concurrency)
+
+    def _slots(self, priority):
+        limit = max(1, math.floor(self.concurrency))
+        if priority == INTERACTIVE:
+            return limit
+        # background work leaves room for queries, but is never starved completely
+        return max(1, limit - self.interactive_reserve)
+
+    def _dispatch(self):
+        # called with the lock held: grant queued calls in priority order while slots and quota allow
+        now = time.monotonic()
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if now < self.paused_until:
+                self._wake_at(self.paused_until - now)
+                return
+            if self.in_flight >= self._slots(waiter.priority):
+                return
+            wait = max(
+                self.requests.wait_time(1, now) if self.requests else 0.0,
+                self.tokens.wait_time(waiter.tokens, now) if self.tokens and waiter.tokens else 0.0,
+            )
+            if wait > 0:
+                self._wake_at(wait)
+                return
+            heapq.heappop(self._queue)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens and waiter.tokens:
+                self.tokens.take(waiter.tokens)
+            self.in_flight += 1
+            waiter.granted = True
+            SCHEDULER_WAIT_SECONDS.labels(provider=self.name, priority=PRIORITY_NAMES[waiter.priority]).observe(now - waiter.enqueued)
+            waiter.notify()
+
+    def _wake_at(self, delay):
+        deadline = time.monotonic() + delay
+        if self._timer is not None and self._timer_deadline <= deadline:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer_deadline = deadline
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _enqueue(self, tokens, notify):
+        waiter = _Waiter(_priority.get(), tokens, notify)
+        with self._lock:
+            heapq.heappush(self._queue, (waiter.priority, next(self._sequence), waiter))
+            self._dispatch()
+        return waiter
+
+    def acquire(self, tokens=0):
+        """Block the calling thread until the call may go out."""
+        granted = threading.Event()
+        self._enqueue(tokens, granted.set)
+        granted.wait()
+
+    async def aacquire(self, tokens=0):
+        """Wait, without blocking the event loop, until the call may go out."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        waiter = self._enqueue(tokens, lambda: loop.call_soon_threadsafe(resolve))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                self.release()
+            raise
+
+    def release(self, rate_limited=False, succeeded=True):
+        """Free the slot of a finished call, adapting the concurrency to its outcome (other failures leave it as is)."""
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if rate_limited:
+                RATE_LIMITED.labels(provider=self.name).inc()
+                # the calls in flight when the quota ran out all fail together, back off once for them
+                if now >= self.paused_until:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self.paused_until = now + self.cooldown_seconds
+            elif succeeded:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            SCHEDULER_CONCURRENCY.labels(provider=self.name).set(self.concurrency)
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency": round(self.concurrency, 2),
+                "in_flight": self.in_flight,
+                "queued": sum(not waiter.cancelled for _, _, waiter in self._queue),
+            }
+
+
+class Scheduler:
+    """One ProviderLimiter per upstream provider, with retries of the calls they reject for quota."""
+
+    def __init__(self):
+        self.config = self._load_configs()["scheduler"]
+        self.max_retries = self.config["max_retries"]
+        self.limiters = {
+            name: ProviderLimiter(
+                name,
+                provider_config,
+                interactive_reserve=self.config["interactive_reserve"],
+                burst_seconds=self.config["burst_seconds"],
+            )
+            for name, provider_config in self.config["providers"].items()
+        }
+
+    def _load_configs(self):
+        """Load scheduler settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    def limiter(self, provider):
+        if provider not in self.limiters:
+            raise ValueError(f"No scheduler limits configured for provider '{provider}'")
+        return self.limiters[provider]
+
+    def call(self, provider, fn, *args, tokens=0, **kwargs):
+        """
+        Run a blocking upstream call once the provider's limits allow it
+
+        Args:
+            provider (str): Key of scheduler.providers in the config
+            fn (callable): The call to make
+            tokens (int): Estimated tokens of the request, counted against the provider's tpm
+
+        Returns:
+            The result of fn, retried up to scheduler.max_retries times on a 429
+        """
+        if provider in _held.get():
+            return fn(*args, **kwargs)
+        limiter = self.limiter(provider)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire(tokens)
+            held = _held.set(_held.get() | {provider})
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                rate_limited = is_rate_limited(e)
+                limiter.release(rate_limited, succeeded=False)
+                if not rate_limited or attempt == self.max_retries:
+                    raise
+                continue
+            except BaseException:
+                limiter.release(succeeded=False)
+                raise
+            finally:
+                _held.reset(held)
+            limiter.release()
+            return result
+
+    async def acall(self, provider, fn, *args, tokens=0, **kwargs):
+        """Async counterpart of call, fn returns an awaitable."""
+        if provider in _held.get():
+            return await fn(*args, **kwargs)
+        limiter = self.limiter(provider)
+        for attempt in range(self.max_retries + 1):
+            await limiter.aacquire(tokens)
+            held = _held.set(_held.get() | {provider})
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                rate_limited = is_rate_limited(e)
+                limiter.release(rate_limited, succeeded=False)
+                if not rate_limited or attempt == self.max_retries:
+                    raise
+                continue
+            except BaseException:
+                limiter.release(succeeded=False)
+                raise
+            finally:
+                _held.reset(held)
+            limiter.release()
+            return result
+
+    def stream(self, provider, fn, *args, tokens=0, **kwargs):
+        """Start a streaming call, holding its slot until the stream is consumed or closed."""
+        if provider in _held.get():
+            return fn(*args, **kwargs)
+        limiter = self.limiter(provider)
+        limiter.acquire(tokens)
+        held = _held.set(_held.get() | {provider})
+        try:
+            stream = fn(*args, **kwargs)
+        except Exception as e:
+            limiter.release(is_rate_limited(e), succeeded=False)
+            raise
+        finally:
+            _held.reset(held)
+
+        def held_stream():
+            failure = None
+            try:
+                yield from stream
+            except Exception as e:
+                failure = e
+                raise
+            finally:
+                limiter.release(failure is not None and is_rate_limited(failure), succeeded=failure is None)
+
+        return held_stream()
+
+    async def astream(self, provider, fn, *args, tokens=0, **kwargs):
+        """Async counterpart of stream, fn returns an async generator or an awaitable of one."""
+        if provider in _held.get():
+            stream = fn(*args, **kwargs)
+            return await stream if inspect.isawaitable(stream) else stream
+        limiter = self.limiter(provider)
+        await limiter.aacquire(tokens)
+        held = _held.set(_held.get() | {provider})
+        try:
+            stream = fn(*args, **kwargs)
+            if inspect.isawaitable(stream):
+                stream = await stream
+        except BaseException as e:
+            limiter.release(isinstance(e, Exception) and is_rate_limited(e), succeeded=False)
+            raise
+        finally:
+            _held.reset(held)
+
+        async def held_stream():
+            failure = None
+            try:
+                async for item in stream:
+                    yield item
+            except Exception as e:
+                failure = e
+                raise
+            finally:
+                limiter.release(failure is not None and is_rate_limited(failure), succeeded=failure is None)
+
+        return held_stream()
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The scheduler shared by the whole process, created on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def _messages_tokens(messages):
+    return sum(estimate_tokens(str(message.content or "")) for message in messages)
+
+
+class ScheduledLLM:
+    """Routes every completion and chat call of an LLM through the scheduler, streaming ones included.
+
+    Mix it in ahead of the LLM class and set provider to a key of scheduler.providers.
+    """
+
+    provider: ClassVar[str] = None
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        return get_scheduler().call(self.provider, super().complete, prompt, formatted, tokens=estimate_tokens(prompt), **kwargs)
+
+    async def acomplete(self, prompt, formatted=False, **kwargs):
+        return await get_scheduler().acall(self.provider, super().acomplete, prompt, formatted, tokens=estimate_tokens(prompt), **kwargs)
+
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        return get_scheduler().stream(self.provider, super().stream_complete, prompt, formatted, tokens=estimate_tokens(prompt), **kwargs)
+
+    async def astream_complete(self, prompt, formatted=False, **kwargs):
+        return await get_scheduler().astream(self.provider, super().astream_complete, prompt, formatted, tokens=estimate_tokens(prompt), **kwargs)
+
+    def chat(self, messages, **kwargs):
+        return get_scheduler().call(self.provider, super().chat, messages, tokens=_messages_tokens(messages), **kwargs)
+
+    async def achat(self, messages, **kwargs):
+        return await get_scheduler().acall(self.provider, super().achat, messages, tokens=_messages_tokens(messages), **kwargs)
+
+    def stream_chat(self, messages, **kwargs):
+        return get_scheduler().stream(self.provider, super().stream_chat, messages, tokens=_messages_tokens(messages), **kwargs)
+
+    async def astream_chat(self, messages, **kwargs):
+        return await get_scheduler().astream(self.provider, super().astream_chat, messages, tokens=_messages_tokens(messages), **kwargs)
+
+
+class ScheduledEmbedding:
+    """Routes every embedding request of an embedding model through the scheduler, one call per API batch."""
+
+    provider: ClassVar[str] = None
+
+    def _get_query_embedding(self, query):
+        return get_scheduler().call(self.provider, super()._get_query_embedding, query, tokens=estimate_tokens(query))
+
+    async def _aget_query_embedding(self, query):
+        return await get_scheduler().acall(self.provider, super()._aget_query_embedding, query, tokens=estimate_tokens(query))
+
+    def _get_text_embedding(self, text):
+        return get_scheduler().call(self.provider, super()._get_text_embedding, text, tokens=estimate_tokens(text))
+
+    async def _aget_text_embedding(self, text):
+        return await get_scheduler().acall(self.provider, super()._aget_text_embedding, text, tokens=estimate_tokens(text))
+
+    def _get_text_embeddings(self, texts):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return get_scheduler().call(self.provider, super()._get_text_embeddings, texts, tokens=tokens)
+
+    async def _aget_text_embeddings(self, texts):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        return await get_scheduler().acall(self.provider, super()._aget_text_embeddings, texts, tokens=tokens)
+
+
+_client_classes_lock = threading.Lock()
+
+
+def _client_classes():
+    # the Gemini and OpenAI clients (google.generativeai, googleapiclient, openai) take seconds to
+    # import, so they are only loaded by the code that builds a client, not when the app starts
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    from llama_index.llms.gemini import Gemini
+
+    class ScheduledGemini(ScheduledLLM, Gemini):
+        provider: ClassVar[str] = "gemini"
+
+    class ScheduledOpenAIEmbedding(ScheduledEmbedding, OpenAIEmbedding):
+        provider: ClassVar[str] = "openai"
+
+        def __init__(self, **kwargs):
+            # 429s must reach the scheduler: retried inside the client they would hold the slot through the
+            # client's backoff, and the limiter would never halve its concurrency or pause the provider
+            kwargs.setdefault("max_retries", 0)
+            super().__init__(**kwargs)
+
+    return {"ScheduledGemini": ScheduledGemini, "ScheduledOpenAIEmbedding": ScheduledOpenAIEmbedding}
+
+
+def __getattr__(name):
+    """ScheduledGemini and ScheduledOpenAIEmbedding, defined on first access."""
+    if name not in ("ScheduledGemini", "ScheduledOpenAIEmbedding"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _client_classes_lock:
+        if name not in globals():
+            globals().update(_client_classes())
+    return globals()[name]
@@ -0,0 +1,248 @@
+from llama_index.core.query_engine import RetrieverQueryEngine
+from rag.indexer import Indexer
+from rag.retriever import RouterQueryWorkflow, SourcesEvent, TokenEvent
+from rag.router import EmbeddingRouter
+from rag.cache import AnswerCache
+from rag.metrics import install_llm_call_counter, QUERY_SECONDS
+from rag.bm25 import HybridRetriever
+from rag.summarizer import SummaryRetriever
+from rag.state import SharedState
+import numpy as np
+import json
+import os
+import threading
+import time
+
+
+class QueryService:
+    """Query stack built once and shared by every request.
+
+    The Indexer (and with it the Postgres pool and embedding client), the
+    Gemini client, both retrievers and the RouterQueryWorkflow are created at
+    startup and reused across requests. After a reindex, refresh() builds a
+    new workflow and swaps it in with a single reference assignment, so
+    in-flight queries finish on the old one and new queries never wait for a
+    rebuild.
+
+    Each worker process of the API has its own QueryService. The worker that
+    ran a sync publishes a new index version in the SharedState, and the
+    others pick it up with sync_index_version, reloading what they keep in
+    memory before rebuilding their workflow.
+    """
+
+    def __init__(self, indexer=None):
+        self.config = self._load_configs()
+        install_llm_call_counter()
+        self.indexer = indexer or Indexer()
+        self.state = SharedState()
+        self._version_lock = threading.Lock()
+        # read before the workflow is built, so a version published meanwhile is picked up by the next poll
+        self.index_version = self.state.index_version()["version"]
+        # the Gemini client is imported here, once the app is up, instead of by import main
+        from rag.scheduler import ScheduledGemini
+        self.llm = ScheduledGemini(model=self.config["models"]["llm"])
+        self.router = None
+        self.answer_cache = self._build_answer_cache()
+        self.workflow = self._build_workflow()
+
+    def _load_configs(self):
+        """Load model settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    def _build_workflow(self):
+        index = self.indexer.retrieve_index()
+
+        summary_index = self.indexer.retrieve_summary_index()
+        if summary_index is not None:
+            # answers from the summaries computed at ingest, usually fitting in a single LLM call
+            summary_config = self.config["summaries"]
+            doc_retriever = SummaryRetriever(
+                summary_index,
+                index,
+                files_top_k=summary_config["files_top_k"],
+                pages_top_k=summary_config["pages_top_k"],
+                drill_pages=summary_config["drill_pages"],
+                drill_top_k=summary_config["drill_top_k"],
+            )
+            doc_response_mode = "compact"
+        else:
+            doc_retriever = index.as_retriever(
+                retrieval_mode="files_via_content",
+                files_top_k=5,
+            )
+            doc_response_mode = "tree_summarize"
+        query_engine_doc = RetrieverQueryEngine.from_args(
+            doc_retriever,
+            llm=self.llm,
+            response_mode=doc_response_mode,
+        )
+
+        hybrid_config = self.config["hybrid"]
+        if self.indexer.bm25 is not None:
+            # exact terms (client names, project codes, figures) are matched by BM25 and fused with the vector hits
+            chunk_retriever = HybridRetriever(
+                index.as_retriever(similarity_top_k=hybrid_config["vector_top_k"]),
+                self.indexer.bm25,
+                bm25_top_k=hybrid_config["bm25_top_k"],
+                top_k=hybrid_config["top_k"],
+                rrf_k=hybrid_config["rrf_k"],
+                min_lexical_score=hybrid_config["min_lexical_score"],
+            )
+        else:
+            chunk_retriever = index.as_retriever(
+                retrieval_mode="chunks",
+                rerank_top_n=10,
+            )
+        query_engine_chunk = RetrieverQueryEngine.from_args(
+            chunk_retriever,
+            llm=self.llm,
+            response_mode="tree_summarize"
+        )
+        self.chunk_retriever = chunk_retriever
+        workflow = RouterQueryWorkflow(
+            query_engines=[query_engine_doc, query_engine_chunk],
+            verbose=True,
+            llm=self.llm,
+            timeout=60,
+            engine_timeout=30,
+            engine_names=["doc_query_engine", "chunk_query_engine"]
+        )
+        if self.config["router"]["mode"] == "local":
+            # built once so its memo of routing decisions survives refreshes
+            if self.router is None:
+                try:
+                    self.router = self._build_router(workflow.choice_descriptions)
+                except Exception as e:
+                    # retried on the next refresh, the LLM routes every query meanwhile
+                    print(f"Warning: Could not embed the router's references, routing with the LLM: {e}")
+            workflow.router = self.router
+        return workflow
+
+    def _build_router(self, choice_descriptions, embed_fn=None):
+        router_config = self.config["router"]
+        examples = router_config["examples"]
+        return EmbeddingRouter(
+            choice_descriptions,
+            # the retrieval embedding model, with the references cached like any other embedded text
+            embed_fn or self.indexer.embed_texts,
+            # same order as the query engines: doc level first, then chunk level
+            examples={0: examples["doc_query_engine"], 1: examples["chunk_query_engine"]},
+            min_margin=router_config["min_margin"],
+            cache_size=router_config["cache_size"],
+        )
+
+    def _build_answer_cache(self):
+        cache_config = self.config["answer_cache"]
+        if not cache_config["enabled"]:
+            return None
+        return AnswerCache(
+            similarity_threshold=cache_config["similarity_threshold"],
+            ttl=cache_config["ttl_seconds"],
+            max_entries=cache_config["max_entries"],
+        )
+
+    async def _embed_query(self, query_str):
+        embedding = np.array(await self.indexer.embed_model.aget_query_embedding(query_str), dtype=np.float32)
+        return embedding / np.linalg.norm(embedding)
+
+    def warm_up(self):
+        """Open the database and embedding connections before the first user query."""
+        try:
+            self.chunk_retriever.retrieve("warm up")
+            print("✅ Query service warmed up")
+        except Exception as e:
+            print(f"Warning: Query service warm-up failed: {e}")
+
+    def refresh(self):
+        # Build the new workflow fully before publishing it
+        workflow = self._build_workflow()
+        self.workflow = workflow
+
+    def publish_index(self, file_ids):
+        """
+        Rebuild after a sync run by this worker, then tell the other workers the index changed
+
+        Args:
+            file_ids (iterable): Drive files re-indexed or deleted by the sync
+        """
+        with self._version_lock:
+            self.refresh()
+            self.index_version = self.state.publish_index_version(file_ids)
+
+    def sync_index_version(self):
+        """
+        Rebuild on the latest index version if another worker published one
+
+        Returns:
+            True if the query stack was rebuilt
+        """
+        with self._version_lock:
+            current = self.state.index_version()
+            if current["version"] <= self.index_version:
+                return False
+            changed = self.state.changed_since(current, self.index_version)
+            self.indexer.reload()
+            if self.answer_cache:
+                if changed is None:
+                    self.answer_cache.clear()
+                else:
+                    self.answer_cache.invalidate_files(changed)
+            self.refresh()
+            print(f"✅ Query service moved from index version {self.index_version} to {current['version']}")
+            self.index_version = current["version"]
+            return True
+
+    def invalidate_files(self, file_ids):
+        """Drop cached answers citing files that were re-indexed or deleted."""
+        if self.answer_cache:
+            self.answer_cache.invalidate_files(file_ids)
+
+    async def run(self, query_str):
+        start = time.perf_counter()
+        cached = None
+        # embedded once, for the answer cache, the router and retrieval
+        embedding = await self._embed_query(query_str)
+        if self.answer_cache:
+            cached = self.answer_cache.lookup(query_str, embedding)
+        if cached is not None:
+            result = cached
+        else:
+            result = await self.workflow.run(query_str=query_str, query_embedding=embedding.tolist())
+            if self.answer_cache:
+                self.answer_cache.store(query_str, embedding, result)
+        QUERY_SECONDS.labels(endpoint="query", cached=str(cached is not None).lower()).observe(time.perf_counter() - start)
+        return result
+
+    async def stream(self, query_str):
+        """
+        Run a query, streaming its progress
+
+        Yields:
+            (event, data) tuples: "sources" with the documents and experts once retrieval
+            is done, "token" for each token of the answer, then "done" with the same
+            payload /query returns
+        """
+        start = time.perf_counter()
+        embedding = await self._embed_query(query_str)
+        if self.answer_cache:
+            cached = self.answer_cache.lookup(query_str, embedding)
+            if cached is not None:
+                yield "sources", {"documents": cached["documents"], "experts": cached["experts"]}
+                yield "token", {"delta": cached["text"]}
+                QUERY_SECONDS.labels(endpoint="stream", cached="true").observe(time.perf_counter() - start)
+                yield "done", cached
+                return
+
+        handler = self.workflow.run(query_str=query_str, query_embedding=embedding.tolist(), stream=True)
+        async for ev in handler.stream_events():
+            if isinstance(ev, SourcesEvent):
+                yield "sources", {"documents": ev.documents, "experts": ev.experts}
+            elif isinstance(ev, TokenEvent):
+                yield "token", {"delta": ev.delta}
+        result = await handler
+        if self.answer_cache:
+            self.answer_cache.store(query_str, embedding, result)
+        QUERY_SECONDS.labels(endpoint="stream", cached="false").observe(time.perf_counter() - start)
+        yield "done", result
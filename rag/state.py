@@ -0,0 +1,149 @@
+"""Serving state shared by every worker process of the API.
+
+Each uvicorn worker builds its own query stack, so they agree on what is
+indexed through files under ``serving.state_path``:
+
+- ``index_version.json``: a counter bumped by the worker that finishes a sync,
+  with a short log of the files each version changed. The other workers poll
+  it and rebuild their query stack (and drop the cached answers citing those
+  files) when it moves.
+- ``jobs/<job_id>.json``: the progress of each ingestion job, so any worker can
+  answer ``/connect/{job_id}``.
+- ``sync.lock``: held by the worker running a sync, so two workers never
+  ingest at once. The lock dies with its process, which is how a job left
+  "running" by a crashed worker is told apart from a live one.
+
+Writes go to a temporary file renamed over the old one, so readers never see
+a partial file.
+"""
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SharedState:
+    """Index version, job records and sync lock, kept in files every worker of the API reads."""
+
+    def __init__(self):
+        self.config = self._load_configs()["serving"]
+        self.path = self.config["state_path"]
+        self.max_versions = self.config["max_version_log"]
+        os.makedirs(os.path.join(self.path, "jobs"), exist_ok=True)
+
+    def _load_configs(self):
+        """Load serving settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _write_json(self, file_path, data):
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, file_path)
+
+    def _read_json(self, file_path, default=None):
+        try:
+            with open(file_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    @contextmanager
+    def _locked(self, name):
+        with open(self._file(f"{name}.lock"), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def index_version(self):
+        """The current index version, with the log of the files changed by the latest ones."""
+        return self._read_json(self._file("index_version.json"), {"version": 0, "updated_at": None, "changes": []})
+
+    def publish_index_version(self, file_ids):
+        """
+        Record that the index changed, so the other workers rebuild their query stack
+
+        Args:
+            file_ids (iterable): Drive files re-indexed or deleted since the previous version
+
+        Returns:
+            The new version number
+        """
+        with self._locked("index_version"):
+            current = self.index_version()
+            version = current["version"] + 1
+            changes = current["changes"] + [{"version": version, "file_ids": sorted(set(file_ids))}]
+            self._write_json(self._file("index_version.json"), {
+                "version": version,
+                "updated_at": time.time(),
+                "changes": changes[-self.max_versions:],
+            })
+        return version
+
+    @staticmethod
+    def changed_since(index_version, version):
+        """
+        Files changed between version and the given index version
+
+        Returns:
+            The set of file ids, or None when the log no longer goes back to version
+        """
+        changes = [change for change in index_version["changes"] if change["version"] > version]
+        if index_version["version"] > version and (not changes or changes[0]["version"] != version + 1):
+            return None
+        return {file_id for change in changes for file_id in change["file_ids"]}
+
+    def try_lock_sync(self):
+        """
+        Take the sync lock without waiting
+
+        Returns:
+            The lock handle to pass to unlock_sync, None if another sync holds it
+        """
+        handle = open(self._file("sync.lock"), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+        return handle
+
+    def unlock_sync(self, handle):
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        handle.close()
+
+    def sync_running(self):
+        """Whether any process, this one included, holds the sync lock."""
+        handle = self.try_lock_sync()
+        if handle is None:
+            return True
+        self.unlock_sync(handle)
+        return False
+
+    def save_job(self, record):
+        self._write_json(self._file(os.path.join("jobs", f"{record['job_id']}.json")), record)
+
+    def load_job(self, job_id):
+        if not JOB_ID.match(job_id):
+            return None
+        return self._read_json(self._file(os.path.join("jobs", f"{job_id}.json")))
+
+    def set_active_job(self, job_id):
+        self._write_json(self._file("active_job.json"), {"job_id": job_id})
+
+    def active_job(self):
+        """The record of the last job started by any worker, None if there is none."""
+        pointer = self._read_json(self._file("active_job.json"))
+        return self.load_job(pointer["job_id"]) if pointer else None
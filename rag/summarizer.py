@@ -0,0 +1,185 @@
+from llama_index.core import PromptTemplate
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+from rag.cache import SummaryCache
+from rag.concurrency import aiter_completed
+from rag.metrics import span
+import asyncio
+import json
+import os
+
+
+class Summarizer:
+    """Hierarchical summaries computed once at ingest time: one per page, then one per document.
+
+    Page summaries are generated concurrently (short pages are kept verbatim
+    rather than summarized), and the document summary is written from the page
+    summaries in a single call. The summaries are stored as nodes next to the
+    chunks so the doc-level engine answers from them instead of summarizing
+    whole documents at query time. Summaries are cached by the hash of the
+    summarized text, so re-syncing an unchanged page costs no LLM call.
+    """
+
+    def __init__(self, llm=None):
+        self.config = self._load_configs()
+        self.summary_config = self.config["summaries"]
+        self.model_name = self.config["models"]["llm"]
+        if llm is None:
+            from rag.scheduler import ScheduledGemini
+            llm = ScheduledGemini(model=self.model_name)
+        self.llm = llm
+        self.page_prompt = PromptTemplate(self.summary_config["page_prompt"])
+        self.document_prompt = PromptTemplate(self.summary_config["document_prompt"])
+        cache_config = self.config["cache"]["summary"]
+        self.cache = SummaryCache(cache_config["path"], cache_config["max_bytes"])
+        self.llm_calls = 0
+
+    def _load_configs(self):
+        """Load summary settings from JSON config file."""
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    async def _summarize(self, prompt, text, semaphore):
+        key = self.cache.key_for(self.model_name, prompt.template, text)
+        summary = self.cache.get_summary(key)
+        if summary is not None:
+            return summary
+        async with semaphore:
+            response = await self.llm.acomplete(prompt.format(text=text[:self.summary_config["max_input_chars"]]))
+        self.llm_calls += 1
+        summary = response.text.strip()
+        self.cache.set_summary(key, summary)
+        return summary
+
+    async def _summarize_page(self, chunk, semaphore):
+        if len(chunk.text) <= self.summary_config["verbatim_page_chars"]:
+            return chunk.text
+        return await self._summarize(self.page_prompt, chunk.text, semaphore)
+
+    async def asummarize_file(self, chunks, semaphore=None):
+        """
+        Summarize each page of a parsed file, then the whole file
+
+        Args:
+            chunks (list): Page documents of one file, as returned by the parser
+            semaphore (asyncio.Semaphore): Bounds the concurrent LLM calls, defaults to
+                summaries.max_in_flight
+
+        Returns:
+            Page summary nodes followed by the document summary node
+        """
+        with span("summarize"):
+            return await self._asummarize_file(chunks, semaphore)
+
+    async def _asummarize_file(self, chunks, semaphore):
+        semaphore = semaphore or asyncio.Semaphore(self.summary_config["max_in_flight"])
+        pages = [chunk for chunk in chunks if chunk.text.strip()]
+        if not pages:
+            return []
+        page_summaries = await asyncio.gather(*(self._summarize_page(chunk, semaphore) for chunk in pages))
+
+        metadata = {key: value for key, value in pages[0].metadata.items() if key != 'page_number'}
+        file_id = metadata['file_id']
+        nodes = [
+            TextNode(
+                id_=f"{file_id}_p{chunk.metadata['page_number']}_summary",
+                text=summary,
+                metadata={**metadata, 'page_number': chunk.metadata['page_number'], 'node_type': 'page_summary'},
+            )
+            for chunk, summary in zip(pages, page_summaries)
+        ]
+        outline = "\n\n".join(
+            f"Page {chunk.metadata['page_number']}: {summary}" for chunk, summary in zip(pages, page_summaries)
+        )
+        document_summary = await self._summarize(self.document_prompt, outline, semaphore)
+        nodes.append(TextNode(
+            id_=f"{file_id}_summary",
+            text=document_summary,
+            metadata={**metadata, 'node_type': 'document_summary'},
+        ))
+        return nodes
+
+    async def asummarize_many(self, items):
+        """
+        Summarize parsed files as they arrive, several at once
+
+        Args:
+            items (iterable): (metadata, chunks) tuples, consumed lazily off the event loop
+
+        Yields:
+            (metadata, chunks, summaries) tuples, in the order the summaries finish
+        """
+        semaphore = asyncio.Semaphore(self.summary_config["max_in_flight"])
+        # files are summarized concurrently, the semaphore bounds the LLM calls across all of them
+        async for (metadata, chunks), task in aiter_completed(
+            items, lambda item: (self.asummarize_file(item[1], semaphore), item), self.summary_config["max_in_flight"]
+        ):
+            try:
+                summaries = task.result()
+            except Exception as e:
+                # the chunks are still indexed, the file is only missing from the doc-level engine
+                print(f"Warning: Could not summarize '{metadata['file_name']}': {e}")
+                summaries = []
+            yield metadata, chunks, summaries
+
+
+class SummaryRetriever(BaseRetriever):
+    """Doc-level retrieval over the precomputed summaries.
+
+    Returns the best matching document summaries together with the best
+    matching page summaries. Only when a page summary matches the query better
+    than every document summary, i.e. the question is about a specific part of
+    a file, does it drill into that page and add its full chunks.
+    Scores follow the vector store convention, lower is closer.
+    """
+
+    def __init__(self, summary_index, chunk_index, files_top_k=5, pages_top_k=5, drill_pages=2, drill_top_k=4):
+        super().__init__()
+        self.document_retriever = summary_index.as_retriever(
+            similarity_top_k=files_top_k,
+            filters=MetadataFilters(filters=[ExactMatchFilter(key="node_type", value="document_summary")]),
+        )
+        self.page_retriever = summary_index.as_retriever(
+            similarity_top_k=pages_top_k,
+            filters=MetadataFilters(filters=[ExactMatchFilter(key="node_type", value="page_summary")]),
+        )
+        self.chunk_index = chunk_index
+        self.drill_pages = drill_pages
+        self.drill_top_k = drill_top_k
+
+    def _pages_to_drill(self, documents, pages):
+        best_document = min((node.score for node in documents if node.score is not None), default=float("inf"))
+        closer = [node for node in pages if node.score is not None and node.score < best_document]
+        return closer[:self.drill_pages]
+
+    def _page_retriever(self, page):
+        return self.chunk_index.as_retriever(
+            similarity_top_k=self.drill_top_k,
+            filters=MetadataFilters(filters=[
+                ExactMatchFilter(key="file_id", value=page.node.metadata["file_id"]),
+                ExactMatchFilter(key="page_number", value=page.node.metadata["page_number"]),
+            ]),
+        )
+
+    def _retrieve(self, query_bundle):
+        documents = self.document_retriever.retrieve(query_bundle)
+        pages = self.page_retriever.retrieve(query_bundle)
+        chunks = [
+            chunk
+            for page in self._pages_to_drill(documents, pages)
+            for chunk in self._page_retriever(page).retrieve(query_bundle)
+        ]
+        return documents + pages + chunks
+
+    async def _aretrieve(self, query_bundle):
+        documents, pages = await asyncio.gather(
+            self.document_retriever.aretrieve(query_bundle),
+            self.page_retriever.aretrieve(query_bundle),
+        )
+        drilled = await asyncio.gather(*(
+            self._page_retriever(page).aretrieve(query_bundle)
+            for page in self._pages_to_drill(documents, pages)
+        ))
+        return documents + pages + [chunk for chunks in drilled for chunk in chunks]
@@ -0,0 +1,25 @@
+from llama_index.core.constants import DEFAULT_EMBEDDING_DIM
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from llama_index.vector_stores.supabase import SupabaseVectorStore
+from vecs.collection import CollectionNotFound
+import asyncio
+
+
+class AsyncSupabaseVectorStore(SupabaseVectorStore):
+    """SupabaseVectorStore whose async query runs in a worker thread instead of blocking the event loop.
+
+    It takes a vecs client rather than a connection string, so the chunk and
+    summary collections share one client and its Postgres connection pool.
+    """
+
+    def __init__(self, client, collection_name, dimension=DEFAULT_EMBEDDING_DIM):
+        # SupabaseVectorStore.__init__ would open a client of its own
+        BasePydanticVectorStore.__init__(self)
+        self._client = client
+        try:
+            self._collection = client.get_collection(name=collection_name)
+        except CollectionNotFound:
+            self._collection = client.create_collection(name=collection_name, dimension=dimension)
+
+    async def aquery(self, query, **kwargs):
+        return await asyncio.to_thread(self.query, query, **kwargs)
@@ -0,0 +1,409 @@
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# rows scored per matrix product, so the float32 temporary of an int8 block stays small
+BLOCK_ROWS = 4096
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """In-process vector store on a memory-mapped, optionally quantized matrix.
+
+    Embeddings are L2-normalized and stored row by row in a memory-mapped file
+    as float32, float16, or int8 with a per-row scale. Node ids and metadata
+    live in a SQLite sidecar and are kept in memory for filtering. Upserts
+    overwrite a node's row in place, deletes free rows for reuse, and queries
+    are a matrix product followed by a partial sort.
+
+    Queries score the rows in contiguous blocks straight from the memory map,
+    with no copy for float32 and a small float32 temporary per block for int8
+    and float16. int8 is a quarter of the size of float32 for a small scoring
+    overhead; numpy has no fast half-precision kernels, so float16 halves the
+    size but scores several times slower than the other two.
+
+    Filtered keys get a column of integer value codes, one per row, built on
+    their first use and kept up to date by upserts, so a filter mask is a few
+    vectorized comparisons instead of a Python pass over every row's metadata.
+
+    Metadata is stored in the same shape as SupabaseVectorStore, and filters use
+    the same vecs dialect ({"key": {"$eq": value}}, "$ne", "$in", "$and", "$or"),
+    so the Indexer drives both backends the same way.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+
+    path: str
+    dim: int
+    dtype: str
+
+    _lock: Any = PrivateAttr()
+    _conn: Any = PrivateAttr()
+    _vectors: Any = PrivateAttr()
+    _scales: Any = PrivateAttr()
+    _capacity: int = PrivateAttr(default=0)
+    _node_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _metadata: List[Optional[dict]] = PrivateAttr(default_factory=list)
+    _rows: dict = PrivateAttr(default_factory=dict)
+    _free_rows: List[int] = PrivateAttr(default_factory=list)
+    _alive: Any = PrivateAttr()
+    # metadata key -> int32 value code of every row, 0 for a missing key or None
+    _columns: dict = PrivateAttr(default_factory=dict)
+    # metadata key -> {value: code}
+    _codes: dict = PrivateAttr(default_factory=dict)
+
+    def __init__(self, path: str, dim: int = 1536, dtype: str = "float32", **kwargs: Any) -> None:
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {list(DTYPES)}")
+        super().__init__(path=path, dim=dim, dtype=dtype, **kwargs)
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(path, "nodes.sqlite"), check_same_thread=False)
+        # WAL lets the query workers read the sidecar while the ingesting one writes it
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (row INTEGER PRIMARY KEY, node_id TEXT UNIQUE NOT NULL, metadata TEXT NOT NULL)"
+            )
+        self._convert_dtype()
+        self._load()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    def _vectors_path(self):
+        return os.path.join(self.path, f"vectors.{self.dtype}")
+
+    def _convert_dtype(self):
+        """Rewrite vectors stored with another dtype, after vector_store.local.dtype was changed."""
+        if os.path.exists(self._vectors_path()):
+            return
+        previous = [dtype for dtype in DTYPES if os.path.exists(os.path.join(self.path, f"vectors.{dtype}"))]
+        if not previous:
+            return
+        source_path = os.path.join(self.path, f"vectors.{previous[0]}")
+        scales_path = os.path.join(self.path, "scales.float32")
+        rows = os.path.getsize(source_path) // (self.dim * np.dtype(DTYPES[previous[0]]).itemsize)
+        if rows:
+            source = np.memmap(source_path, dtype=DTYPES[previous[0]], mode="r", shape=(rows, self.dim))
+            source_scales = np.fromfile(scales_path, dtype=np.float32, count=rows)
+            with open(self._vectors_path(), "wb") as f:
+                for start in range(0, rows, BLOCK_ROWS):
+                    block = source[start:start + BLOCK_ROWS].astype(np.float32)
+                    if previous[0] == "int8":
+                        block *= source_scales[start:start + BLOCK_ROWS, None]
+                    if self.dtype == "int8":
+                        scales = np.abs(block).max(axis=1) / 127
+                        scales[scales == 0] = 1.0
+                        block = np.round(block / scales[:, None])
+                    else:
+                        scales = np.ones(len(block), dtype=np.float32)
+                    f.write(block.astype(DTYPES[self.dtype]).tobytes())
+                    source_scales[start:start + BLOCK_ROWS] = scales
+            source_scales.tofile(scales_path)
+            del source
+        else:
+            open(self._vectors_path(), "wb").close()
+        os.remove(source_path)
+        print(f"Converted the vectors of {self.path} from {previous[0]} to {self.dtype}")
+
+    def _open_matrix(self, capacity):
+        """Memory-map the vector and scale files, growing them to hold capacity rows."""
+        for file_path, row_bytes in (
+            (self._vectors_path(), self.dim * np.dtype(DTYPES[self.dtype]).itemsize),
+            (os.path.join(self.path, "scales.float32"), 4),
+        ):
+            with open(file_path, "ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        self._capacity = capacity
+        # grown with the capacity, rows past the last allocated one are not alive
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive[:capacity]
+        self._alive = alive
+        for key, column in self._columns.items():
+            self._columns[key] = np.zeros(capacity, dtype=np.int32)
+            self._columns[key][:len(column)] = column[:capacity]
+        if capacity == 0:
+            self._vectors = np.zeros((0, self.dim), dtype=DTYPES[self.dtype])
+            self._scales = np.zeros(0, dtype=np.float32)
+            return
+        self._vectors = np.memmap(self._vectors_path(), dtype=DTYPES[self.dtype], mode="r+", shape=(capacity, self.dim))
+        self._scales = np.memmap(os.path.join(self.path, "scales.float32"), dtype=np.float32, mode="r+", shape=(capacity,))
+
+    def _load(self):
+        rows = self._conn.execute("SELECT row, node_id, metadata FROM nodes").fetchall()
+        size = max((row for row, _, _ in rows), default=-1) + 1
+        self._node_ids = [None] * size
+        self._metadata = [None] * size
+        self._rows = {}
+        for row, node_id, metadata in rows:
+            self._node_ids[row] = node_id
+            self._metadata[row] = json.loads(metadata)
+            self._rows[node_id] = row
+        self._free_rows = [row for row in range(size) if self._node_ids[row] is None]
+        self._alive = np.array([node_id is not None for node_id in self._node_ids], dtype=bool)
+        # rebuilt from the reloaded metadata when next filtered on
+        self._columns = {}
+        self._codes = {}
+        self._open_matrix(size)
+
+    def _alive_rows(self):
+        return self._alive[:len(self._node_ids)]
+
+    def reload(self):
+        """Re-read the rows written by another process, the matrix is shared through the memory map already."""
+        with self._lock:
+            self._load()
+
+    def _allocate_row(self):
+        if self._free_rows:
+            return self._free_rows.pop()
+        row = len(self._node_ids)
+        if row >= self._capacity:
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+            self._open_matrix(max(1024, 2 * self._capacity))
+        self._node_ids.append(None)
+        self._metadata.append(None)
+        return row
+
+    def _normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _quantize(self, embedding):
+        vector = self._normalize(embedding)
+        if self.dtype == "int8":
+            scale = float(np.abs(vector).max()) / 127 or 1.0
+            return np.round(vector / scale).astype(np.int8), scale
+        return vector.astype(DTYPES[self.dtype]), 1.0
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """Upsert nodes: a node id already in the store overwrites its row in place."""
+        with self._lock, self._conn:
+            for node in nodes:
+                metadata = node_to_metadata_dict(node, remove_text=False, flat_metadata=self.flat_metadata)
+                row = self._rows.get(node.node_id)
+                if row is None:
+                    row = self._allocate_row()
+                self._vectors[row], self._scales[row] = self._quantize(node.get_embedding())
+                self._node_ids[row] = node.node_id
+                self._metadata[row] = metadata
+                for key, column in self._columns.items():
+                    column[row] = self._code(key, metadata.get(key), create=True)
+                self._rows[node.node_id] = row
+                self._alive[row] = True
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO nodes (row, node_id, metadata) VALUES (?, ?, ?)",
+                    (row, node.node_id, json.dumps(metadata)),
+                )
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+                self._scales.flush()
+        return [node.node_id for node in nodes]
+
+    def _delete_rows(self, rows):
+        with self._lock, self._conn:
+            for row in rows:
+                del self._rows[self._node_ids[row]]
+                self._node_ids[row] = None
+                self._metadata[row] = None
+                self._alive[row] = False
+                for column in self._columns.values():
+                    column[row] = 0
+                self._free_rows.append(row)
+            self._conn.executemany("DELETE FROM nodes WHERE row = ?", [(row,) for row in rows])
+        return rows
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self.delete_where({"doc_id": {"$eq": ref_doc_id}})
+
+    def delete_where(self, filters: dict) -> List[str]:
+        """
+        Delete every node whose metadata matches a vecs-style filter
+
+        Returns:
+            Ids of the deleted nodes
+        """
+        with self._lock:
+            rows = [int(row) for row in np.flatnonzero(self._filter_mask(filters))]
+            node_ids = [self._node_ids[row] for row in rows]
+            self._delete_rows(rows)
+        return node_ids
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        with self._lock:
+            mask = self._alive_rows().copy()
+            if node_ids is not None:
+                mask &= self._node_id_mask(node_ids)
+            if filters is not None:
+                mask &= self._filter_mask(self._to_vecs_filters(filters))
+            self._delete_rows([int(row) for row in np.flatnonzero(mask)])
+
+    def _to_vecs_filters(self, filters: MetadataFilters) -> dict:
+        operators = {
+            FilterOperator.EQ: "$eq",
+            FilterOperator.NE: "$ne",
+            FilterOperator.IN: "$in",
+            FilterOperator.NIN: "$nin",
+        }
+        clauses = []
+        for f in filters.filters:
+            if isinstance(f, MetadataFilters):
+                clauses.append(self._to_vecs_filters(f))
+            elif f.operator in operators:
+                clauses.append({f.key: {operators[f.operator]: f.value}})
+            else:
+                raise ValueError(f"Unsupported filter operator {f.operator}")
+        condition = "$or" if filters.condition == FilterCondition.OR else "$and"
+        return {condition: clauses}
+
+    @staticmethod
+    def _value_key(value):
+        # lists and dicts (e.g. experts) are compared by their JSON form
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return json.dumps(value, sort_keys=True)
+
+    def _code(self, key, value, create=False):
+        """Code of a value in the column of key, None for a value no row ever had."""
+        value_key = self._value_key(value)
+        if value_key is None:
+            return 0
+        codes = self._codes[key]
+        code = codes.get(value_key)
+        if code is None and create:
+            code = codes[value_key] = len(codes) + 1
+        return code
+
+    def _column(self, key):
+        column = self._columns.get(key)
+        if column is None:
+            values = [self._value_key(metadata.get(key)) if metadata is not None else None for metadata in self._metadata]
+            codes = self._codes[key] = {}
+            for value in values:
+                if value is not None and value not in codes:
+                    codes[value] = len(codes) + 1
+            column = np.zeros(self._capacity, dtype=np.int32)
+            column[:len(values)] = [codes.get(value, 0) for value in values]
+            self._columns[key] = column
+        return column[:len(self._node_ids)]
+
+    def _match_mask(self, filters):
+        size = len(self._node_ids)
+        mask = np.ones(size, dtype=bool)
+        for key, clause in filters.items():
+            if key in ("$and", "$or"):
+                masks = [self._match_mask(sub_filter) for sub_filter in clause]
+                if key == "$and":
+                    for sub_mask in masks:
+                        mask &= sub_mask
+                else:
+                    mask &= np.logical_or.reduce(masks) if masks else False
+                continue
+            (operator, value), = clause.items()
+            column = self._column(key)
+            if operator in ("$eq", "$ne"):
+                code = self._code(key, value)
+                matched = column == code if code is not None else np.zeros(size, dtype=bool)
+            elif operator in ("$in", "$nin"):
+                matched = np.isin(column, [code for code in (self._code(key, v) for v in value) if code is not None])
+            else:
+                raise ValueError(f"Unsupported filter operator {operator}")
+            mask &= ~matched if operator in ("$ne", "$nin") else matched
+        return mask
+
+    def _filter_mask(self, filters):
+        if not filters:
+            return self._alive_rows().copy()
+        return self._alive_rows() & self._match_mask(filters)
+
+    def _node_id_mask(self, node_ids):
+        mask = np.zeros(len(self._node_ids), dtype=bool)
+        mask[[self._rows[node_id] for node_id in set(node_ids) if node_id in self._rows]] = True
+        return mask
+
+    def _score_all(self, query_vector):
+        """Cosine similarity of the query with every allocated row, dead rows included."""
+        size = len(self._node_ids)
+        cosine = np.empty(size, dtype=np.float32)
+        for start in range(0, size, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, size)
+            np.dot(self._vectors[start:end].astype(np.float32, copy=False), query_vector, out=cosine[start:end])
+        if self.dtype == "int8":
+            cosine *= self._scales[:size]
+        return cosine
+
+    def _score_rows(self, rows, query_vector):
+        cosine = self._vectors[rows].astype(np.float32, copy=False) @ query_vector
+        if self.dtype == "int8":
+            cosine *= self._scales[rows]
+        return cosine
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        with self._lock:
+            if query.query_embedding is None:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            query_vector = self._normalize(query.query_embedding)
+            if query.filters or query.node_ids or query.doc_ids:
+                mask = self._filter_mask(self._to_vecs_filters(query.filters) if query.filters else None)
+                if query.node_ids:
+                    mask &= self._node_id_mask(query.node_ids)
+                if query.doc_ids:
+                    mask &= self._match_mask({"doc_id": {"$in": list(query.doc_ids)}})
+                candidates = np.flatnonzero(mask)
+                cosine = self._score_rows(candidates, query_vector)
+            else:
+                # no filter: every row is scored in place, the free ones can never make the top k
+                candidates = None
+                alive = self._alive_rows()
+                cosine = self._score_all(query_vector)
+                cosine[~alive] = -np.inf
+            count = len(candidates) if candidates is not None else int(np.count_nonzero(alive))
+            if not count:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+            k = min(query.similarity_top_k, count)
+            top = np.argpartition(-cosine, k - 1)[:k]
+            top = top[np.argsort(-cosine[top])]
+
+            nodes, similarities, ids = [], [], []
+            for idx in top:
+                row = int(candidates[idx]) if candidates is not None else int(idx)
+                metadata = dict(self._metadata[row])
+                text = metadata.pop("text", None)
+                node = metadata_dict_to_node(metadata, text=text)
+                nodes.append(node)
+                # Same score as SupabaseVectorStore (1 - exp(-cosine distance)), so
+                # relevance thresholds downstream behave identically on both backends
+                similarities.append(1.0 - math.exp(-(1.0 - float(cosine[idx]))))
+                ids.append(self._node_ids[row])
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    async def aquery(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        return await asyncio.to_thread(self.query, query, **kwargs)
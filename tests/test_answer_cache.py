@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from rag.cache import AnswerCache, query_terms
+
+
+def unit(seed):
+    vector = np.random.default_rng(seed).normal(size=64).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.mark.parametrize("cached_query, new_query", [
+    ("What was Acme's revenue growth in 2012?", "What was Acme's revenue growth in 2013?"),
+    ("Which projects were delivered on time?", "Which projects were not delivered on time?"),
+    ("Who led the pricing project for Acme?", "Who led the pricing project for Globex?"),
+])
+def test_different_numbers_names_or_negation_miss(cached_query, new_query):
+    cache = AnswerCache(similarity_threshold=0.92)
+    embedding = unit(0)
+    cache.store(cached_query, embedding, {"response": "cached answer", "documents": []})
+    # even an identical embedding must not return the other question's answer
+    assert cache.lookup(new_query, embedding) is None
+
+
+def test_paraphrase_with_same_terms_hits():
+    cache = AnswerCache(similarity_threshold=0.92)
+    embedding = unit(0)
+    cache.store("What was Acme's revenue growth in 2012?", embedding, {"response": "cached answer", "documents": []})
+    assert cache.lookup("what was the revenue growth of Acme in 2012", embedding)["response"] == "cached answer"
+
+
+def test_dissimilar_embedding_misses():
+    cache = AnswerCache(similarity_threshold=0.92)
+    cache.store("What was Acme's revenue growth in 2012?", unit(0), {"response": "cached answer", "documents": []})
+    assert cache.lookup("What was Acme's revenue growth in 2012?", unit(1)) is None
+
+
+def test_query_terms():
+    assert query_terms("What did Acme's CEO say in Q3 2012?") == {"acme", "ceo", "q3", "2012"}
+    assert query_terms("Why didn't the merger close?") == {"not"}
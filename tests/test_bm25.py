@@ -0,0 +1,85 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from rag.bm25 import LEXICAL_ONLY_SCORE, BM25Index, HybridRetriever
+
+
+def chunk(node_id, text):
+    return TextNode(id_=node_id, text=text, metadata={"file_id": node_id.split("_")[0]})
+
+
+CHUNKS = [
+    chunk("a_1", "Revenue of the media division grew in 2012"),
+    chunk("a_2", "The media market is consolidating around streaming"),
+    chunk("b_1", "Project ALPHA-12 reduced procurement costs for the client"),
+    chunk("b_2", "Procurement costs fell across every region"),
+]
+
+
+def ids(hits):
+    return [node_id for node_id, _ in hits]
+
+
+def test_rare_terms_rank_first_and_stopword_only_queries_still_match(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    index.add(CHUNKS)
+    assert ids(index.search("alpha 12", top_k=1)) == ["b_1"]
+    assert ids(index.search("revenue growth of the media division", top_k=2)) == ["a_1", "a_2"]
+    # a query of stopwords only still searches them, terms in most chunks are dropped
+    assert ids(index.search("for", top_k=4)) == ["b_1"]
+    assert index.search("the", top_k=4) == []
+    assert index.search("nothing matches", top_k=4) == []
+
+
+def test_index_persists_and_deletes_are_persisted(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    index = BM25Index(path)
+    index.add(CHUNKS)
+    index.delete(["b_1"])
+    # re-adding a chunk replaces its postings instead of doubling them
+    index.add([chunk("a_1", "Revenue of the media division grew in 2012")])
+    reopened = BM25Index(path)
+    assert len(reopened) == 3
+    assert reopened.search("alpha", top_k=4) == []
+    assert reopened.search("procurement", top_k=4) == index.search("procurement", top_k=4)
+    assert reopened.get_nodes(["a_2"])["a_2"].get_content() == CHUNKS[1].get_content()
+
+
+def test_reload_picks_up_another_instance_writes(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    index = BM25Index(path)
+    BM25Index(path).add(CHUNKS)
+    assert index.search("procurement") == []
+    index.reload()
+    assert set(ids(index.search("procurement"))) == {"b_1", "b_2"}
+
+
+class StaticRetriever:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def retrieve(self, query_bundle):
+        return self.nodes
+
+
+def test_fusion_keeps_vector_scores_and_scores_lexical_only_hits_by_strength(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    index.add(CHUNKS)
+    vector_nodes = [NodeWithScore(node=CHUNKS[0], score=0.1), NodeWithScore(node=CHUNKS[1], score=0.15)]
+    retriever = HybridRetriever(StaticRetriever(vector_nodes), index, top_k=4, min_lexical_score=0.5)
+
+    # found by both: ranked first, with its vector score
+    results = retriever._fuse(vector_nodes, [("a_2", 0.9), ("b_1", 0.8), ("b_2", 0.2)])
+    assert [result.node.node_id for result in results] == ["a_2", "a_1", "b_1", "b_2"]
+    scores = {result.node.node_id: result.score for result in results}
+    assert scores["a_2"] == 0.15
+    # a strong lexical-only hit is as relevant as the best vector hit, a weak one is never cited
+    assert scores["b_1"] == 0.1
+    assert scores["b_2"] == LEXICAL_ONLY_SCORE
+
+
+def test_retrieve_fuses_both_lists(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    index.add(CHUNKS)
+    retriever = HybridRetriever(StaticRetriever([NodeWithScore(node=CHUNKS[1], score=0.12)]), index, top_k=2)
+    results = retriever.retrieve("ALPHA-12")
+    assert {result.node.node_id for result in results} == {"a_2", "b_1"}
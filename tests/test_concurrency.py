@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rag.concurrency import aiter_completed, iter_completed
+
+
+def slow_listing(first, then_wait, release):
+    # the first item arrives at once, the next one only when released
+    yield first
+    release.wait(then_wait)
+    yield "late"
+
+
+def test_done_work_is_yielded_while_the_listing_blocks():
+    release = threading.Event()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = iter_completed(
+            slow_listing("early", 5, release), lambda item: (executor.submit(time.sleep, 0.05), item), max_pending=4
+        )
+        tag, future = next(results)
+        assert tag == "early"
+        assert time.monotonic() - start < 1
+        release.set()
+        assert [tag for tag, _ in results] == ["late"]
+
+
+def test_at_most_max_pending_items_are_taken_from_the_listing():
+    taken = []
+
+    def listing():
+        for i in range(10):
+            taken.append(i)
+            yield i
+
+    gates = {i: threading.Event() for i in range(10)}
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = iter_completed(listing(), lambda i: (executor.submit(gates[i].wait, 5), i), max_pending=3)
+        gates[1].set()
+        assert next(results)[0] == 1
+        # one slot freed, one more item taken
+        assert len(taken) <= 4
+        for gate in gates.values():
+            gate.set()
+        assert sorted(tag for tag, _ in results) == [0, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_listing_errors_are_raised():
+    def listing():
+        yield 1
+        raise RuntimeError("listing failed")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(RuntimeError, match="listing failed"):
+            list(iter_completed(listing(), lambda i: (executor.submit(lambda: i), i), max_pending=2))
+
+
+def test_finished_coroutines_are_yielded_while_the_next_item_is_awaited():
+    release = threading.Event()
+
+    async def work(item):
+        await asyncio.sleep(0.05)
+        return item
+
+    async def run():
+        start = time.monotonic()
+        results = aiter_completed(slow_listing("early", 5, release), lambda item: (work(item), item), max_in_flight=4)
+        tag, task = await results.__anext__()
+        elapsed = time.monotonic() - start
+        release.set()
+        rest = [task.result() async for _, task in results]
+        return tag, task.result(), elapsed, rest
+
+    tag, result, elapsed, rest = asyncio.run(run())
+    assert (tag, result) == ("early", "early")
+    assert elapsed < 1
+    assert rest == ["late"]
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+from connecter.connecter import GoogleDriveConnecter
+
+
+def connecter(failures):
+    # no credentials or Drive service, only the download retry loop is exercised
+    instance = GoogleDriveConnecter.__new__(GoogleDriveConnecter)
+    instance.config = {"download": {"max_retries": 2, "backoff_base": 0, "spool": False}}
+    instance.attempts = 0
+
+    def get_file_content(file_id, mime_type, service=None):
+        instance.attempts += 1
+        if instance.attempts <= len(failures):
+            raise failures[instance.attempts - 1]
+        return io.BytesIO(b"content")
+
+    instance.get_file_content = get_file_content
+    instance._thread_service = lambda: None
+    return instance
+
+
+FILE = {"id": "a", "name": "a.pdf", "mimeType": "application/pdf"}
+
+
+def test_transport_errors_are_retried(monkeypatch):
+    monkeypatch.setattr("connecter.connecter.random.uniform", lambda a, b: 0)
+    instance = connecter([ConnectionResetError("reset"), TimeoutError("timed out")])
+    assert instance._download_with_retry(FILE)["content"].read() == b"content"
+    assert instance.attempts == 3
+
+
+def test_errors_are_raised_once_retries_run_out(monkeypatch):
+    monkeypatch.setattr("connecter.connecter.random.uniform", lambda a, b: 0)
+    instance = connecter([TimeoutError()] * 3)
+    with pytest.raises(TimeoutError):
+        instance._download_with_retry(FILE)
+    assert instance.attempts == 3
+
+
+def test_other_errors_are_not_retried():
+    instance = connecter([ValueError("bad file")])
+    with pytest.raises(ValueError):
+        instance._download_with_retry(FILE)
+    assert instance.attempts == 1
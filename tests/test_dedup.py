@@ -0,0 +1,115 @@
+import pytest
+from llama_index.core import Document
+
+from rag.dedup import PageDeduplicator
+
+BOILERPLATE = (
+    "This document is confidential and intended solely for the use of the client. Any distribution, copying or "
+    "disclosure of its content without the prior written consent of the firm is strictly prohibited and may be unlawful."
+)
+
+
+def page(file_id, page_number, text):
+    return Document(
+        id_=f"{file_id}_part_{page_number - 1}",
+        text=text,
+        metadata={"file_id": file_id, "file_name": f"{file_id}.pdf", "url": f"https://drive/{file_id}", "page_number": page_number},
+    )
+
+
+def unique(file_id):
+    return f"Findings specific to {file_id}: revenue of {file_id} grew while costs in the {file_id} division fell sharply."
+
+
+@pytest.fixture
+def dedup(tmp_path, monkeypatch):
+    config = {"dedup": {
+        "enabled": True, "path": str(tmp_path / "dedup.sqlite"), "threshold": 0.85,
+        "num_perm": 128, "bands": 16, "shingle_size": 3, "seed": 1,
+    }}
+    monkeypatch.setattr(PageDeduplicator, "_load_configs", lambda self: config)
+    return PageDeduplicator()
+
+
+def keys(documents):
+    return sorted((document.metadata["file_id"], document.metadata["page_number"]) for document in documents)
+
+
+def sources(document):
+    return [(source["file_id"], source["page_number"]) for source in document.metadata.get("sources", [])]
+
+
+def test_duplicate_pages_are_stored_once_under_the_first_with_every_source(dedup):
+    documents, duplicates = dedup.update([("a", [page("a", 1, BOILERPLATE), page("a", 2, unique("a"))])])
+    assert keys(documents) == [("a", 1), ("a", 2)]
+    assert duplicates == set()
+
+    documents, duplicates = dedup.update([("b", [page("b", 1, unique("b")), page("b", 2, BOILERPLATE)])])
+    # the canonical page is rewritten with its new sources, the duplicate is left out
+    assert keys(documents) == [("a", 1), ("b", 1)]
+    assert duplicates == {("b", 2)}
+    canonical = next(document for document in documents if document.metadata["file_id"] == "a")
+    assert sources(canonical) == [("a", 1), ("b", 2)]
+    assert "sources" in canonical.excluded_embed_metadata_keys
+    assert dedup.stats() == {"pages": 4, "clusters": 3, "pages_deduplicated": 1}
+
+
+def test_near_duplicates_join_the_cluster_and_distinct_pages_do_not(dedup):
+    dedup.update([("a", [page("a", 1, BOILERPLATE)])])
+    _, duplicates = dedup.update([("b", [page("b", 1, BOILERPLATE + " Page 1")])])
+    assert duplicates == {("b", 1)}
+    _, duplicates = dedup.update([("c", [page("c", 1, unique("c"))])])
+    assert duplicates == set()
+
+
+def test_deleting_the_canonical_file_promotes_another_member_from_its_stored_text(dedup):
+    dedup.update([("a", [page("a", 1, BOILERPLATE), page("a", 2, unique("a"))])])
+    dedup.update([("b", [page("b", 1, BOILERPLATE)])])
+
+    documents = dedup.remove_files(["a"])
+    # a's own page left with it, the shared page is now stored under b with b's text and metadata
+    assert keys(documents) == [("b", 1)]
+    assert documents[0].text == BOILERPLATE
+    assert documents[0].metadata["url"] == "https://drive/b"
+    assert sources(documents[0]) == []
+    assert dedup.stats() == {"pages": 1, "clusters": 1, "pages_deduplicated": 0}
+
+    # the promoted page is the one new duplicates now join
+    documents, duplicates = dedup.update([("c", [page("c", 1, BOILERPLATE)])])
+    assert keys(documents) == [("b", 1)]
+    assert sources(documents[0]) == [("b", 1), ("c", 1)]
+
+
+def test_reindexing_a_member_whose_page_changed_removes_it_from_the_sources(dedup):
+    dedup.update([("a", [page("a", 1, BOILERPLATE)])])
+    dedup.update([("b", [page("b", 1, BOILERPLATE)])])
+
+    documents, duplicates = dedup.update([("b", [page("b", 1, unique("b"))])])
+    assert duplicates == set()
+    assert keys(documents) == [("a", 1), ("b", 1)]
+    canonical = next(document for document in documents if document.metadata["file_id"] == "a")
+    assert sources(canonical) == []
+
+
+def test_reindexing_the_canonical_file_with_a_changed_page_promotes_the_duplicate(dedup):
+    dedup.update([("a", [page("a", 1, BOILERPLATE)])])
+    dedup.update([("b", [page("b", 1, BOILERPLATE)])])
+
+    documents, duplicates = dedup.update([("a", [page("a", 1, unique("a"))])])
+    assert duplicates == set()
+    assert keys(documents) == [("a", 1), ("b", 1)]
+    promoted = next(document for document in documents if document.metadata["file_id"] == "b")
+    assert promoted.text == BOILERPLATE
+
+
+def test_pages_without_words_are_passed_through(dedup):
+    documents, duplicates = dedup.update([("a", [page("a", 1, "  "), page("a", 2, "  ")])])
+    assert len(documents) == 2
+    assert duplicates == set()
+
+
+def test_clusters_persist_across_instances(dedup):
+    dedup.update([("a", [page("a", 1, BOILERPLATE)])])
+    reopened = PageDeduplicator()
+    _, duplicates = reopened.update([("b", [page("b", 1, BOILERPLATE)])])
+    assert duplicates == {("b", 1)}
@@ -0,0 +1,44 @@
+from connecter.folder_index import FolderPathIndex
+
+
+def folder(file_id, name, parent=None):
+    return {'id': file_id, 'name': name, 'parents': [parent] if parent else []}
+
+
+def test_resolves_nested_paths():
+    index = FolderPathIndex([
+        folder('root', 'Clients'),
+        folder('acme', 'Acme', 'root'),
+        folder('2024', '2024', 'acme'),
+        folder('report', 'report.pdf', '2024'),
+        folder('notes', 'notes.txt', 'root'),
+        folder('top', 'top.docx'),
+    ])
+    assert index.resolve('report') == 'Clients/Acme/2024/report.pdf'
+    assert index.resolve('notes') == 'Clients/notes.txt'
+    assert index.resolve('top') == 'top.docx'
+    assert index.resolve('unknown') is None
+    assert index.folder_paths['acme'] == ['Clients', 'Acme']
+
+
+def test_missing_parents_are_looked_up_once():
+    lookups = []
+
+    def lookup(file_id):
+        lookups.append(file_id)
+        return {'shared': folder('shared', 'Shared')}.get(file_id)
+
+    index = FolderPathIndex([folder('a', 'a.pdf', 'shared'), folder('b', 'b.pdf', 'shared')], lookup=lookup)
+    assert index.resolve('a') == 'Shared/a.pdf'
+    assert index.resolve('b') == 'Shared/b.pdf'
+    assert lookups == ['shared']
+
+
+def test_unreachable_parent_ends_the_path():
+    index = FolderPathIndex([folder('sub', 'Sub', 'hidden'), folder('file', 'file.pdf', 'sub')], lookup=lambda file_id: None)
+    assert index.resolve('file') == 'Sub/file.pdf'
+
+
+def test_parent_cycle_terminates():
+    index = FolderPathIndex([folder('x', 'X', 'y'), folder('y', 'Y', 'x'), folder('file', 'file.pdf', 'x')])
+    assert index.resolve('file') == 'Y/X/file.pdf'
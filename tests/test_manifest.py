@@ -0,0 +1,55 @@
+from connecter.manifest import SyncManifest
+
+
+def drive_file(file_id, modified='2024-01-01T00:00:00Z', md5='abc', size='10'):
+    return {'id': file_id, 'name': f'{file_id}.pdf', 'modifiedTime': modified, 'md5Checksum': md5, 'size': size}
+
+
+def test_is_changed_compares_the_fingerprint(tmp_path):
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    assert manifest.is_changed(drive_file('a'))
+    manifest.update(drive_file('a'))
+    assert 'a' in manifest
+    assert not manifest.is_changed(drive_file('a'))
+    assert manifest.is_changed(drive_file('a', md5='def'))
+    # Google Workspace files only carry a modifiedTime
+    workspace = drive_file('doc', md5=None, size=None)
+    manifest.update(workspace)
+    assert not manifest.is_changed(workspace)
+    assert manifest.is_changed(drive_file('doc', modified='2024-02-01T00:00:00Z', md5=None, size=None))
+
+
+def test_diff_reports_changed_and_deleted_files(tmp_path):
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    for file_id in ('a', 'b', 'c'):
+        manifest.update(drive_file(file_id))
+    changed, deleted = manifest.diff([drive_file('a'), drive_file('b', size='20'), drive_file('d')])
+    assert [file['id'] for file in changed] == ['b', 'd']
+    assert deleted == ['c']
+
+
+def test_empty_listing_deletes_nothing(tmp_path):
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    manifest.update(drive_file('a'))
+    assert manifest.diff([]) == ([], [])
+
+
+def test_save_and_reload(tmp_path):
+    path = tmp_path / 'sync' / 'manifest.json'
+    manifest = SyncManifest(str(path))
+    manifest.update(drive_file('a'))
+    manifest.update(drive_file('b'))
+    manifest.remove('b')
+    manifest.save()
+    reloaded = SyncManifest(str(path))
+    assert reloaded.entries == manifest.entries
+    assert not reloaded.is_changed(drive_file('a'))
+    assert 'b' not in reloaded
+    assert not (tmp_path / 'sync' / 'manifest.json.tmp').exists()
+
+
+def test_corrupt_manifest_starts_from_scratch(tmp_path, capsys):
+    path = tmp_path / 'manifest.json'
+    path.write_text('{"a": ')
+    assert SyncManifest(str(path)).entries == {}
+    assert 'Could not read sync manifest' in capsys.readouterr().out
@@ -0,0 +1,177 @@
+import threading
+import time
+
+from llama_index.core import Document
+
+from connecter.manifest import SyncManifest
+from rag.dedup import PageDeduplicator
+from rag.pipeline import IngestionPipeline
+
+
+def drive_file(file_id, version="1"):
+    return {"id": file_id, "name": f"{file_id}.pdf", "modifiedTime": version, "md5Checksum": version, "size": "1"}
+
+
+class StubConnecter:
+    def __init__(self, files, release_after=None, failing=()):
+        self.files = files
+        # ids of the files whose download fails
+        self.failing = set(failing)
+        # the listing blocks after this many files until release is set
+        self.release_after = release_after
+        self.release = threading.Event()
+
+    def iter_files(self):
+        for i, file in enumerate(self.files):
+            if i == self.release_after:
+                self.release.wait(5)
+            yield file
+
+    def download_files(self, files, on_error=None):
+        for file in files:
+            metadata = {"file_id": file["id"], "file_name": file["name"], "last_modified_date": file["modifiedTime"]}
+            if file["id"] in self.failing:
+                on_error(metadata, ConnectionResetError())
+                continue
+            yield {"metadata": metadata}
+
+
+class StubParser:
+    def __init__(self, pages=None):
+        # file_id -> page texts, two distinct pages by default
+        self.pages = pages or {}
+
+    async def aparse_many(self, datas):
+        for data in datas:
+            metadata = data["metadata"]
+            texts = self.pages.get(metadata["file_id"], [f"{metadata['file_id']} page {i}" for i in range(2)])
+            yield metadata, [
+                Document(text=text, metadata={**metadata, "page_number": i + 1}) for i, text in enumerate(texts)
+            ]
+
+
+class StubIndexer:
+    def __init__(self):
+        self.upserted = []
+        self.replaced = []
+        self.stale = []
+        self.deleted = []
+
+    def upsert_summaries(self, nodes):
+        return nodes
+
+    def upsert_documents(self, documents, replace_file_ids=()):
+        self.upserted.append([document.metadata["file_id"] for document in documents])
+        self.replaced.extend(replace_file_ids)
+        return documents
+
+    def delete_stale(self, file_id, version):
+        self.stale.append((file_id, version))
+
+    def delete_file(self, file_id):
+        self.deleted.append(file_id)
+
+
+def test_a_small_batch_is_indexed_before_the_listing_ends(tmp_path):
+    connecter = StubConnecter([drive_file("a"), drive_file("b")], release_after=1)
+    indexer = StubIndexer()
+    pipeline = IngestionPipeline(connecter, StubParser(), indexer, SyncManifest(str(tmp_path / "manifest.json")))
+    pipeline.config["flush_seconds"] = 0.2
+    run = threading.Thread(target=pipeline.run)
+    run.start()
+    try:
+        deadline = time.monotonic() + 3
+        while not indexer.upserted and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # a is queryable while the listing still waits for b
+        assert indexer.upserted == [["a", "a"]]
+    finally:
+        connecter.release.set()
+        run.join(5)
+    assert indexer.upserted == [["a", "a"], ["b", "b"]]
+    assert pipeline.progress["files_indexed"] == 2
+
+
+def test_an_empty_listing_deletes_nothing(tmp_path):
+    manifest = SyncManifest(str(tmp_path / "manifest.json"))
+    manifest.update(drive_file("a"))
+    indexer = StubIndexer()
+    IngestionPipeline(StubConnecter([]), StubParser(), indexer, manifest).run()
+    assert indexer.deleted == []
+    assert "a" in manifest
+
+
+def test_files_missing_from_the_listing_are_deleted(tmp_path):
+    manifest = SyncManifest(str(tmp_path / "manifest.json"))
+    manifest.update(drive_file("a"))
+    manifest.update(drive_file("b"))
+    indexer = StubIndexer()
+    progress = IngestionPipeline(StubConnecter([drive_file("a")]), StubParser(), indexer, manifest).run()
+    assert indexer.deleted == ["b"]
+    assert "b" not in manifest
+    assert progress["files_deleted"] == 1
+    assert progress["files_changed"] == 0
+
+
+def test_failed_downloads_are_counted_and_retried_next_sync(tmp_path):
+    manifest = SyncManifest(str(tmp_path / "manifest.json"))
+    connecter = StubConnecter([drive_file("a"), drive_file("b")], failing=["b"])
+    progress = IngestionPipeline(connecter, StubParser(), StubIndexer(), manifest).run()
+    assert progress["files_failed"] == 1
+    assert progress["files_indexed"] == 1
+    assert "b" not in manifest
+
+
+def test_changed_files_replace_their_previous_version(tmp_path):
+    manifest = SyncManifest(str(tmp_path / "manifest.json"))
+    manifest.update(drive_file("a"))
+    manifest.update(drive_file("b"))
+    indexer = StubIndexer()
+    connecter = StubConnecter([drive_file("a", version="2"), drive_file("b"), drive_file("c")])
+    progress = IngestionPipeline(connecter, StubParser(), indexer, manifest).run()
+    assert indexer.upserted == [["a", "a", "c", "c"]]
+    # only a was indexed before, c is new
+    assert indexer.replaced == ["a"]
+    assert indexer.stale == []
+    assert not manifest.is_changed(drive_file("a", version="2"))
+    assert progress["files_changed"] == 2
+
+
+def test_a_full_run_starts_every_file_from_scratch(tmp_path):
+    manifest = SyncManifest(str(tmp_path / "manifest.json"))
+    manifest.update(drive_file("a"))
+    indexer = StubIndexer()
+    IngestionPipeline(StubConnecter([drive_file("a"), drive_file("b")]), StubParser(), indexer, manifest).run(full=True)
+    assert indexer.deleted == ["a", "b"]
+    assert indexer.upserted == [["a", "a", "b", "b"]]
+
+
+def test_a_new_version_made_only_of_duplicates_prunes_the_old_one(tmp_path, monkeypatch):
+    config = {"dedup": {
+        "enabled": True, "path": str(tmp_path / "dedup.sqlite"), "threshold": 0.85,
+        "num_perm": 128, "bands": 16, "shingle_size": 3, "seed": 1,
+    }}
+    monkeypatch.setattr(PageDeduplicator, "_load_configs", lambda self: config)
+    shared = (
+        "This document is confidential and intended solely for the use of the client. Any distribution, copying or "
+        "disclosure of its content without the prior written consent of the firm is strictly prohibited."
+    )
+    manifest = SyncManifest(str(tmp_path / "manifest.json"))
+    deduplicator = PageDeduplicator()
+    parser = StubParser({"a": [shared, "Revenue of the media division grew"], "b": ["Procurement costs fell"]})
+    IngestionPipeline(
+        StubConnecter([drive_file("a"), drive_file("b")]), parser, StubIndexer(), manifest, deduplicator=deduplicator
+    ).run()
+
+    # b now only repeats a page of a: nothing of b is upserted to overwrite its old chunks
+    parser.pages["b"] = [shared]
+    indexer = StubIndexer()
+    progress = IngestionPipeline(
+        StubConnecter([drive_file("a"), drive_file("b", version="2")]), parser, indexer, manifest,
+        deduplicator=deduplicator,
+    ).run()
+    assert indexer.replaced == ["b"]
+    assert indexer.stale == [("b", "2")]
+    # the canonical page of a is rewritten to cite b
+    assert indexer.upserted == [["a"]]
+    assert progress["pages_deduplicated"] == 1
@@ -0,0 +1,53 @@
+import numpy as np
+
+from rag.router import EmbeddingRouter
+
+AXES = {"summary": [1.0, 0.0, 0.0], "figure": [0.0, 1.0, 0.0], "other": [0.0, 0.0, 1.0]}
+
+
+class AxisEmbedding:
+    """Embeds a text on the axis of the first keyword it contains, counting the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        return [next((AXES[word] for word in AXES if word in text), AXES["other"]) for text in texts]
+
+
+def build(embed_fn=None, min_margin=0.05):
+    return EmbeddingRouter(
+        ["Synthesizes a summary", "Answers a pointed figure question"],
+        embed_fn or AxisEmbedding(),
+        examples={0: ["Give me the summary of the deck"], 1: ["Which figure shows costs?"]},
+        min_margin=min_margin,
+    )
+
+
+def test_routes_with_the_given_query_embedding_without_embedding_again():
+    embed_fn = AxisEmbedding()
+    router = build(embed_fn)
+    calls = embed_fn.calls
+    assert router.route("anything", embedding=[0.1, 0.9, 0.0]).answers[0].choice == 2
+    assert router.route("anything", embedding=np.array([2.0, 0.1, 0.0])).answers[0].choice == 1
+    assert embed_fn.calls == calls
+
+
+def test_embeds_the_query_when_no_embedding_is_given():
+    assert build().route("a summary please").answers[0].choice == 1
+
+
+def test_low_margin_falls_back_to_the_llm():
+    assert build().route("q", embedding=[1.0, 1.0, 0.0]) is None
+
+
+def test_memo_holds_decisions_until_evicted():
+    router = build()
+    router.cache_size = 1
+    assert router.lookup("What is the figure?") is None
+    answers = router.route("What is the figure?")
+    router.remember("What is the figure?", answers)
+    assert router.lookup("  what is the   FIGURE? ") is answers
+    router.remember("another query", answers)
+    assert router.lookup("What is the figure?") is None
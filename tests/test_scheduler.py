@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rag.scheduler import (
+    BACKGROUND, INTERACTIVE, ProviderLimiter, Scheduler, ScheduledOpenAIEmbedding, priority,
+)
+
+
+def provider_config(**overrides):
+    return {
+        "rpm": None, "tpm": None, "min_concurrency": 1, "initial_concurrency": 1,
+        "max_concurrency": 8, "cooldown_seconds": 0.05, **overrides,
+    }
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_interactive_call_preempts_queued_background_calls():
+    # one slot: a successful call would otherwise grow the limit and grant two waiters at once
+    limiter = ProviderLimiter("test", provider_config(max_concurrency=1), interactive_reserve=0)
+    with priority(BACKGROUND):
+        limiter.acquire()
+    granted = []
+
+    def call(level, name):
+        with priority(level):
+            limiter.acquire()
+        granted.append(name)
+        limiter.release()
+
+    threads = [threading.Thread(target=call, args=(BACKGROUND, f"background {i}")) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: limiter.stats()["queued"] == 3)
+    # queued last, served first
+    interactive = threading.Thread(target=call, args=(INTERACTIVE, "interactive"))
+    interactive.start()
+    wait_until(lambda: limiter.stats()["queued"] == 4)
+
+    limiter.release()
+    for thread in threads + [interactive]:
+        thread.join(timeout=2)
+    assert granted[0] == "interactive"
+    assert sorted(granted[1:]) == ["background 0", "background 1", "background 2"]
+
+
+def test_background_calls_leave_the_interactive_reserve_free():
+    limiter = ProviderLimiter("test", provider_config(initial_concurrency=2), interactive_reserve=1)
+    with priority(BACKGROUND):
+        limiter.acquire()
+    blocked = threading.Event()
+
+    def background():
+        with priority(BACKGROUND):
+            limiter.acquire()
+        blocked.set()
+
+    thread = threading.Thread(target=background, daemon=True)
+    thread.start()
+    wait_until(lambda: limiter.stats()["queued"] == 1)
+    assert not blocked.is_set()
+    # the reserved slot still serves a query right away
+    with priority(INTERACTIVE):
+        limiter.acquire()
+    assert limiter.stats()["in_flight"] == 2
+    limiter.release()
+    limiter.release()
+    thread.join(timeout=2)
+    assert blocked.is_set()
+
+
+def test_rate_limit_halves_concurrency_and_pauses_the_provider():
+    limiter = ProviderLimiter("test", provider_config(initial_concurrency=8, cooldown_seconds=0.2))
+    limiter.acquire()
+    limiter.acquire()
+    limiter.release(rate_limited=True, succeeded=False)
+    assert limiter.stats()["concurrency"] == 4
+    # the other call failing in the same burst does not halve again
+    limiter.release(rate_limited=True, succeeded=False)
+    assert limiter.stats()["concurrency"] == 4
+
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+    limiter.release()
+    assert limiter.stats()["concurrency"] == 4.25
+
+
+def test_call_retries_after_a_rate_limit(monkeypatch):
+    monkeypatch.setattr(Scheduler, "_load_configs", lambda self: {"scheduler": {
+        "interactive_reserve": 0, "max_retries": 2, "burst_seconds": 10,
+        "providers": {"test": provider_config(initial_concurrency=4)},
+    }})
+    scheduler = Scheduler()
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited("429 Too Many Requests")
+        return "ok"
+
+    assert scheduler.call("test", flaky) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.04
+    assert scheduler.limiter("test").stats() == {"concurrency": 2.5, "in_flight": 0, "queued": 0}
+
+    def always_limited():
+        raise RateLimited("429 Too Many Requests")
+
+    with pytest.raises(RateLimited):
+        scheduler.call("test", always_limited)
+
+
+def test_cancelled_waiter_does_not_leak_its_slot():
+    limiter = ProviderLimiter("test", provider_config())
+
+    async def scenario():
+        await limiter.aacquire()
+        waiting = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        limiter.release()
+        await asyncio.wait_for(limiter.aacquire(), timeout=1)
+        limiter.release()
+
+    asyncio.run(scenario())
+    stats = limiter.stats()
+    assert (stats["in_flight"], stats["queued"]) == (0, 0)
+
+
+def test_embedding_client_leaves_retries_to_the_scheduler():
+    assert ScheduledOpenAIEmbedding(api_key="test").max_retries == 0
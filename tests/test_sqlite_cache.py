@@ -0,0 +1,44 @@
+import sqlite3
+
+from rag.cache import SqliteLRUCache
+
+
+def test_evicts_least_recently_used_entries_beyond_max_bytes(tmp_path):
+    cache = SqliteLRUCache(str(tmp_path / "cache.sqlite"), max_bytes=30)
+    cache.set_many([("a", b"x" * 10), ("b", b"x" * 10), ("c", b"x" * 10)])
+    assert cache.get("a") == b"x" * 10
+    cache.set("d", b"x" * 10)
+    # b is the least recently used: a was read after c was written
+    assert cache.get("b") is None
+    assert set(cache.get_many(["a", "b", "c", "d"])) == {"a", "c", "d"}
+    assert cache.stats()["bytes"] == 30
+
+
+def test_replacing_an_entry_counts_its_size_once(tmp_path):
+    cache = SqliteLRUCache(str(tmp_path / "cache.sqlite"), max_bytes=100)
+    cache.set("a", b"x" * 40)
+    cache.set("a", b"x" * 50)
+    assert cache.stats()["bytes"] == 50
+    assert cache.stats()["entries"] == 1
+
+
+def test_size_is_reloaded_when_reopened(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    SqliteLRUCache(path, max_bytes=100).set_many([("a", b"x" * 40), ("b", b"x" * 40)])
+    cache = SqliteLRUCache(path, max_bytes=100)
+    assert cache.stats()["bytes"] == 80
+    cache.set("c", b"x" * 40)
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 80
+
+
+def test_entries_of_the_previous_layout_are_carried_over(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO entries VALUES ('a', ?, 3, 1.0)", (b"abc",))
+    cache = SqliteLRUCache(path, max_bytes=100)
+    assert cache.get("a") == b"abc"
+    assert cache.stats()["bytes"] == 3
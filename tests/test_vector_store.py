@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import (
+    FilterOperator, MetadataFilter, MetadataFilters, VectorStoreQuery,
+)
+
+from rag.vector_store import LocalVectorStore
+
+DIM = 8
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).normal(size=DIM).tolist()
+
+
+def node(node_id, file_id, version="1", node_type="chunk", seed=None):
+    return TextNode(
+        id_=node_id,
+        text=f"text of {node_id}",
+        metadata={"file_id": file_id, "last_modified_date": version, "node_type": node_type, "experts": [{"name": "A"}]},
+        embedding=embedding(seed if seed is not None else hash(node_id) % 1000),
+    )
+
+
+def query_ids(store, seed, top_k=10, filters=None, node_ids=None):
+    result = store.query(VectorStoreQuery(
+        query_embedding=embedding(seed), similarity_top_k=top_k, filters=filters, node_ids=node_ids,
+    ))
+    return result.ids
+
+
+@pytest.fixture(params=["float32", "float16", "int8"])
+def store(request, tmp_path):
+    return LocalVectorStore(path=str(tmp_path / "store"), dim=DIM, dtype=request.param)
+
+
+def test_nearest_node_comes_first(store):
+    store.add([node(f"n{i}", "f", seed=i) for i in range(20)])
+    assert query_ids(store, seed=7, top_k=3)[0] == "n7"
+
+
+def test_upsert_overwrites_the_row_of_a_node(store):
+    store.add([node("n1", "f", version="1", seed=1)])
+    store.add([node("n1", "f", version="2", seed=2)])
+    result = store.query(VectorStoreQuery(query_embedding=embedding(2), similarity_top_k=5))
+    assert result.ids == ["n1"]
+    assert result.nodes[0].metadata["last_modified_date"] == "2"
+
+
+def test_delete_where_removes_only_matching_nodes_and_frees_their_rows(store):
+    store.add([node("a1", "a", version="1"), node("a2", "a", version="2"), node("b1", "b", version="1")])
+    deleted = store.delete_where({"$and": [{"file_id": {"$eq": "a"}}, {"last_modified_date": {"$ne": "2"}}]})
+    assert deleted == ["a1"]
+    assert sorted(query_ids(store, seed=0)) == ["a2", "b1"]
+    # the freed row is reused, and the new node is found by the filters already built
+    store.add([node("c1", "c")])
+    assert query_ids(store, seed=0, filters=MetadataFilters(filters=[MetadataFilter(key="file_id", value="c")])) == ["c1"]
+    assert store.delete_where({"file_id": {"$eq": "a"}}) == ["a2"]
+    assert store.delete_where({"file_id": {"$eq": "missing"}}) == []
+
+
+def test_filters(store):
+    store.add([
+        node("a1", "a", node_type="chunk"), node("a2", "a", node_type="page_summary"),
+        node("b1", "b", node_type="chunk"), node("c1", "c", node_type="document_summary"),
+    ])
+
+    def ids(*filters, condition="and"):
+        return sorted(query_ids(store, seed=0, filters=MetadataFilters(filters=list(filters), condition=condition)))
+
+    assert ids(MetadataFilter(key="node_type", value="chunk")) == ["a1", "b1"]
+    assert ids(MetadataFilter(key="file_id", value="a"), MetadataFilter(key="node_type", value="chunk")) == ["a1"]
+    assert ids(MetadataFilter(key="file_id", value="a"), MetadataFilter(key="file_id", value="c"), condition="or") == ["a1", "a2", "c1"]
+    assert ids(MetadataFilter(key="file_id", value=["a", "c"], operator=FilterOperator.IN)) == ["a1", "a2", "c1"]
+    assert ids(MetadataFilter(key="file_id", value=["a", "c"], operator=FilterOperator.NIN)) == ["b1"]
+    assert ids(MetadataFilter(key="node_type", value="chunk", operator=FilterOperator.NE)) == ["a2", "c1"]
+    assert ids(MetadataFilter(key="file_id", value="unknown")) == []
+    # list values are compared as a whole
+    assert store.delete_where({"experts": {"$eq": [{"name": "B"}]}}) == []
+    assert len(store.delete_where({"experts": {"$eq": [{"name": "A"}]}})) == 4
+
+
+def test_node_ids_restrict_the_query(store):
+    store.add([node("a1", "a"), node("a2", "a"), node("b1", "b")])
+    assert sorted(query_ids(store, seed=0, node_ids=["a1", "b1", "gone"])) == ["a1", "b1"]
+
+
+def test_reload_sees_another_instance_writes(store, tmp_path):
+    store.add([node("a1", "a")])
+    store.query(VectorStoreQuery(
+        query_embedding=embedding(0), similarity_top_k=5,
+        filters=MetadataFilters(filters=[MetadataFilter(key="file_id", value="b")]),
+    ))
+    other = LocalVectorStore(path=store.path, dim=DIM, dtype=store.dtype)
+    other.add([node(f"b{i}", "b", seed=i) for i in range(1500)])
+    other.delete_where({"file_id": {"$eq": "a"}})
+    store.reload()
+    filters = MetadataFilters(filters=[MetadataFilter(key="file_id", value="b")])
+    assert len(query_ids(store, seed=3, top_k=2000, filters=filters)) == 1500
+    assert query_ids(store, seed=3, top_k=1) == ["b3"]
+    assert query_ids(store, seed=0, filters=MetadataFilters(filters=[MetadataFilter(key="file_id", value="a")])) == []
+
+
+@pytest.mark.parametrize("before, after", [("float16", "float32"), ("float32", "int8"), ("int8", "float16")])
+def test_changing_the_dtype_converts_the_stored_vectors(tmp_path, before, after):
+    path = str(tmp_path / "store")
+    LocalVectorStore(path=path, dim=DIM, dtype=before).add([node(f"n{i}", "f", seed=i) for i in range(20)])
+    store = LocalVectorStore(path=path, dim=DIM, dtype=after)
+    assert query_ids(store, seed=7, top_k=1) == ["n7"]
+    assert store.query(VectorStoreQuery(query_embedding=embedding(7), similarity_top_k=1)).similarities[0] < 0.01